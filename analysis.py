@@ -0,0 +1,133 @@
+"""A pool of worker processes for searching positions off the request thread.
+
+Positions go to the workers as bitboard keys (one int) and come back as
+plain tuples, so nothing bigger than a few ints is pickled per job. Every
+job has a deadline and a slot in a shared array of cancel flags that the
+worker's search polls, so a cancelled job stops within a clock interval.
+"""
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import bitboard
+import search
+import tablebase
+
+
+class PoolFull(Exception):
+    pass
+
+
+class Cancelled(Exception):
+    # The job was cancelled, or its deadline passed before a worker got to it
+    pass
+
+
+# What a worker sends back for a job it didn't start
+_NOT_STARTED = 'not started'
+
+
+class AnalysisJob(object):
+    def __init__(self, pool, future, slot):
+        self.future = future
+        self._pool = pool
+        self._slot = slot
+
+    def cancel(self):
+        self._pool._cancel(self._slot, self)
+        self.future.cancel()
+
+    def done(self):
+        return self.future.done()
+
+    def add_done_callback(self, fn):
+        self.future.add_done_callback(lambda _: fn(self))
+
+    def result(self, timeout=None):
+        # A search.SearchResult, or None if the position has no moves.
+        # Raises Cancelled if the job was cancelled or ran out of time
+        # before starting, and concurrent.futures.TimeoutError if it isn't
+        # done within timeout.
+        if self.future.cancelled():
+            raise Cancelled
+        found = self.future.result(timeout)
+        if found == _NOT_STARTED:
+            raise Cancelled
+        if found is None:
+            return None
+        key, moves, push, score, depth, nodes = found
+        return search.SearchResult(bitboard.from_key(key), moves, push, score, depth, nodes)
+
+
+class AnalysisPool(object):
+    def __init__(self, workers=None, max_jobs=256, table_size=1 << 16, tablebase_path=None):
+        context = multiprocessing.get_context()
+        self._flags = context.Array('b', max_jobs, lock=False)
+        self._free = list(range(max_jobs))
+        self._owners = {}
+        self._lock = threading.Lock()
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self._flags, table_size, tablebase_path),
+        )
+
+    def submit(self, state, time_limit=1.0, max_depth=8, node_limit=None):
+        # The deadline starts now, so time spent queued counts against it
+        deadline = time.time() + time_limit
+        with self._lock:
+            if not self._free:
+                raise PoolFull
+            slot = self._free.pop()
+        self._flags[slot] = 0
+        future = self._executor.submit(
+            _analyse, bitboard.key(state), deadline, max_depth, node_limit, slot)
+        job = AnalysisJob(self, future, slot)
+        with self._lock:
+            self._owners[slot] = job
+        future.add_done_callback(lambda _: self._release(slot, job))
+        return job
+
+    def _cancel(self, slot, job):
+        # Slots are reused, so only flag one the job still holds
+        with self._lock:
+            if self._owners.get(slot) is job:
+                self._flags[slot] = 1
+
+    def _release(self, slot, job):
+        with self._lock:
+            if self._owners.get(slot) is job:
+                del self._owners[slot]
+                self._free.append(slot)
+
+    def shutdown(self, wait=True):
+        for slot in range(len(self._flags)):
+            self._flags[slot] = 1
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+_flags = None
+_table = None
+_tablebase = None
+
+
+def _init_worker(flags, table_size, tablebase_path):
+    global _flags, _table, _tablebase
+    _flags = flags
+    _table = search.TranspositionTable(table_size)
+    if tablebase_path is not None:
+        _tablebase = tablebase.Tablebase(tablebase_path)
+
+
+def _analyse(key, deadline, max_depth, node_limit, slot):
+    remaining = deadline - time.time()
+    if remaining <= 0 or _flags[slot]:
+        return _NOT_STARTED
+    searcher = search.Searcher(_table, should_stop=lambda: _flags[slot], tablebase=_tablebase)
+    result = searcher.search(bitboard.from_key(key), max_depth, remaining, node_limit)
+    if result is None:
+        return None
+    return (bitboard.key(result.state), result.moves, result.push,
+            result.score, result.depth, result.nodes)
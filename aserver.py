@@ -0,0 +1,297 @@
+"""An asyncio HTTP/1.1 server for the WSGI app.
+
+Connections live on one event loop, so an idle or keep-alive connection
+costs a socket and a little memory rather than a thread. The application
+itself runs in a bounded pool of worker threads. A request that has to
+wait for a game to change (a /1/game/status long poll) hands the wait back
+to the loop through ``environ['pushfight.suspend']``, freeing its worker,
+and is run again once the game moves or the wait runs out.
+
+On SIGINT or SIGTERM (or stop()) the server stops accepting connections,
+answers waiting long polls straight away and gives requests in flight a
+grace period to finish.
+"""
+import asyncio
+import io
+import signal
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_to_bytes
+
+_REASONS = {
+    400: 'Bad Request',
+    413: 'Payload Too Large',
+    431: 'Request Header Fields Too Large',
+    500: 'Internal Server Error',
+    501: 'Not Implemented',
+}
+
+
+class _BadRequest(Exception):
+    def __init__(self, status):
+        self.status = status
+
+
+class AsyncServer(object):
+    def __init__(self, app, host='localhost', port=8080, workers=16, events=None,
+                 keepalive_timeout=75.0, max_body=1 << 20, max_headers=100, shutdown_grace=10.0,
+                 backlog=1024):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        # A notify.GameEvents; without one long polls block their worker
+        self.events = events
+        self.keepalive_timeout = keepalive_timeout
+        self.max_body = max_body
+        self.max_headers = max_headers
+        self.shutdown_grace = shutdown_grace
+        # Connections the OS queues before they're accepted
+        self.backlog = backlog
+        self.started = threading.Event()
+        self._loop = None
+        self._stopping = None
+        self._closing = False
+        self._executor = None
+        # Handler task -> whether it is in the middle of a request
+        self._tasks = {}
+        self._writers = {}
+        self._waits = set()
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    def stop(self):
+        # Safe to call from any thread once started is set
+        self._loop.call_soon_threadsafe(self._stopping.set)
+
+    async def serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='wsgi')
+        server = await asyncio.start_server(self._handle, self.host, self.port, backlog=self.backlog)
+        self.port = server.sockets[0].getsockname()[1]
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self._loop.add_signal_handler(sig, self._stopping.set)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # Not the main thread, or not supported here
+                pass
+        self.started.set()
+        try:
+            await self._stopping.wait()
+        finally:
+            server.close()
+            await self._shutdown()
+
+    async def _shutdown(self):
+        self._closing = True
+        for woken in list(self._waits):
+            _wake(woken)
+        for task, busy in list(self._tasks.items()):
+            if not busy:
+                self._writers[task].close()
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=self.shutdown_grace)
+        for task in list(self._tasks):
+            task.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._tasks[task] = False
+        self._writers[task] = writer
+        try:
+            while not self._closing:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader, writer), self.keepalive_timeout)
+                except _BadRequest as e:
+                    await self._write(writer, e.status, [], b'', False)
+                    break
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if request is None:
+                    break
+                environ, keep_alive = request
+                self._tasks[task] = True
+                peer = writer.get_extra_info('peername')
+                if peer:
+                    environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = str(peer[0]), str(peer[1])
+                try:
+                    status, headers, body = await self._call(environ)
+                except Exception:
+                    status, headers, body = '500 Internal Server Error', [], b''
+                keep_alive = keep_alive and not self._closing
+                await self._write(writer, status, headers, body, keep_alive, environ['REQUEST_METHOD'] == 'HEAD')
+                self._tasks[task] = False
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            del self._tasks[task]
+            del self._writers[task]
+            writer.close()
+
+    async def _read_request(self, reader, writer):
+        try:
+            line = await reader.readline()
+        except ValueError:
+            raise _BadRequest(400)
+        if not line:
+            return None
+        try:
+            method, target, version = line.decode('latin-1').rstrip('\r\n').split(' ')
+        except ValueError:
+            raise _BadRequest(400)
+        if not version.startswith('HTTP/1.'):
+            raise _BadRequest(400)
+
+        headers = {}
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:
+                raise _BadRequest(431)
+            if line in (b'\r\n', b'\n'):
+                break
+            if not line:
+                raise asyncio.IncompleteReadError(line, None)
+            if len(headers) >= self.max_headers:
+                raise _BadRequest(431)
+            name, sep, value = line.decode('latin-1').partition(':')
+            if not sep:
+                raise _BadRequest(400)
+            name = name.strip().upper().replace('-', '_')
+            value = value.strip()
+            headers[name] = headers[name] + ',' + value if name in headers else value
+
+        if 'chunked' in headers.get('TRANSFER_ENCODING', '').lower():
+            raise _BadRequest(501)
+        try:
+            length = int(headers.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            raise _BadRequest(400)
+        if length < 0:
+            raise _BadRequest(400)
+        if length > self.max_body:
+            raise _BadRequest(413)
+        if length and headers.get('EXPECT', '').lower() == '100-continue':
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+        body = await reader.readexactly(length) if length else b''
+
+        connection = headers.get('CONNECTION', '').lower()
+        if version == 'HTTP/1.0':
+            keep_alive = connection == 'keep-alive'
+        else:
+            keep_alive = connection != 'close'
+
+        path, _, query = target.partition('?')
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote_to_bytes(path).decode('latin-1'),
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': version,
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in headers.items():
+            if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[name] = value
+            else:
+                environ['HTTP_' + name] = value
+        return environ, keep_alive
+
+    async def _call(self, environ):
+        # Runs the app on a worker, and again after a wait it asked for
+        suspended = []
+        resumed = []
+
+        def suspend(game_id, after, timeout, current=None):
+            # Returns True if the server will wait and call the app again,
+            # in which case the app's response is thrown away
+            if resumed or self.events is None or self._closing:
+                return False
+            suspended.append((game_id, after, timeout, current))
+            # Tells plugins this run's response doesn't count
+            environ['pushfight.suspended'] = True
+            return True
+
+        environ['pushfight.suspend'] = suspend
+        while True:
+            result = await self._loop.run_in_executor(self._executor, self._run_app, environ)
+            if not suspended:
+                return result
+            await self._wait(*suspended.pop())
+            resumed.append(True)
+            environ.pop('pushfight.suspended', None)
+            environ['wsgi.input'].seek(0)
+
+    def _run_app(self, environ):
+        response = []
+        chunks = []
+
+        def start_response(status, headers, exc_info=None):
+            response[:] = [status, headers]
+            return chunks.append
+
+        result = self.app(environ, start_response)
+        try:
+            for chunk in result:
+                chunks.append(chunk)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        status, headers = response
+        return status, headers, b''.join(chunks)
+
+    async def _wait(self, game_id, after, timeout, current):
+        woken = self._loop.create_future()
+
+        def on_publish(version):
+            if version > after:
+                self._loop.call_soon_threadsafe(_wake, woken)
+
+        unwatch = self.events.watch(game_id, on_publish)
+        self._waits.add(woken)
+        try:
+            if current is not None:
+                version = await self._loop.run_in_executor(self._executor, current)
+                if version is not None and version > after:
+                    return
+            if not self._closing:
+                await asyncio.wait_for(woken, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            unwatch()
+            self._waits.discard(woken)
+
+    async def _write(self, writer, status, headers, body, keep_alive, head=False):
+        if isinstance(status, int):
+            status = '{} {}'.format(status, _REASONS.get(status, ''))
+        names = {name.lower() for name, _ in headers}
+        headers = list(headers)
+        if 'content-length' not in names:
+            headers.append(('Content-Length', str(len(body))))
+        headers.append(('Connection', 'keep-alive' if keep_alive else 'close'))
+        lines = ['HTTP/1.1 ' + status]
+        lines.extend('{}: {}'.format(name, value) for name, value in headers)
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if not head:
+            writer.write(body)
+        await writer.drain()
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
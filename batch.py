@@ -0,0 +1,136 @@
+"""Move generation over many positions at once with NumPy.
+
+A batch of N positions is three arrays:
+
+    squares  (N, 10) ints, the square of each piece in pushfight.PIECE_ORDER
+    anchors  (N,) ints, the anchored square or -1 for none
+    white    (N,) bools, whether it is white's turn
+
+Squares are ``10*row + col`` as everywhere else. Results keep the piece
+names, so they line up with the JSON boards the server stores. The single
+position engine in bitboard.py is the reference implementation.
+"""
+import numpy as np
+
+import geometry
+
+NPIECES = 10
+PUSHERS = {True: (0, 1, 2), False: (5, 6, 7)}
+MOVERS = {True: (0, 1, 2, 3, 4), False: (5, 6, 7, 8, 9)}
+
+# An extra square past the end of the grid stands for the rail, so rays of
+# different lengths can share one padded table
+RAIL = geometry.NSQUARES
+_NSLOTS = geometry.NSQUARES + 1
+
+IS_ONBOARD = np.array(geometry.IS_ONBOARD + (False,))
+
+
+def _pad(rows, width):
+    table = np.full((_NSLOTS, width), RAIL, dtype=np.int64)
+    for sq, row in enumerate(rows):
+        table[sq, :len(row)] = row
+    return table
+
+
+_RAY_WIDTH = max(len(ray) for rays in geometry.PUSH_RAYS for ray in rays) + 1
+RAYS = tuple(_pad(rays, _RAY_WIDTH) for rays in geometry.PUSH_RAYS)
+NEIGHBOURS = _pad(geometry.NEIGHBOURS, len(geometry.DIRECTIONS))
+
+
+def is_over(squares):
+    return ~IS_ONBOARD[squares].all(axis=1)
+
+
+def _occupancy(squares):
+    occ = np.zeros((len(squares), _NSLOTS), dtype=bool)
+    np.put_along_axis(occ, squares, True, axis=1)
+    occ[:, RAIL] = False
+    return occ
+
+
+def pushes(squares, anchors, white):
+    # Every legal push from every position. Returns (parents, squares,
+    # anchors, white) where parents[i] is the row of the input that
+    # result i came from.
+    squares = np.asarray(squares, dtype=np.int64)
+    anchors = np.asarray(anchors, dtype=np.int64)
+    white = np.asarray(white, dtype=bool)
+    n = len(squares)
+    rows = np.arange(n)
+    occ = _occupancy(squares)
+    positions = np.arange(_RAY_WIDTH)
+
+    found = []
+    for slot in range(len(PUSHERS[True])):
+        pusher = np.where(white, PUSHERS[True][slot], PUSHERS[False][slot])
+        origin = squares[rows, pusher]
+        for rays, step in zip(RAYS, geometry.STEPS):
+            ray = rays[origin]
+            occupied = occ[rows[:, None], ray]
+            # The line ends at the first empty square (the rail counts as one)
+            end = np.argmax(~occupied, axis=1)
+            target = ray[rows, end]
+            anchored = ((ray == anchors[:, None]) & (positions <= end[:, None])).any(axis=1)
+            ok = (end > 0) & (target != RAIL) & ~anchored
+            if not ok.any():
+                continue
+
+            ok_rows = rows[ok]
+            chain = np.zeros((len(ok_rows), _NSLOTS), dtype=bool)
+            in_line = positions < end[ok][:, None]
+            np.put_along_axis(chain, np.where(in_line, ray[ok], RAIL), True, axis=1)
+            chain[np.arange(len(ok_rows)), origin[ok]] = True
+            chain[:, RAIL] = False
+
+            moved = np.take_along_axis(chain, squares[ok], axis=1)
+            found.append((
+                ok_rows,
+                squares[ok] + step * moved,
+                origin[ok] + step,
+                ~white[ok],
+            ))
+
+    if not found:
+        return (np.zeros(0, dtype=np.int64), np.zeros((0, NPIECES), dtype=np.int64),
+                np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool))
+    parents, new_squares, new_anchors, new_white = (np.concatenate(parts) for parts in zip(*found))
+    order = np.argsort(parents, kind='stable')
+    return parents[order], new_squares[order], new_anchors[order], new_white[order]
+
+
+def moves(squares, white):
+    # Every single move from every position. Returns (parents, pieces,
+    # destinations) where pieces index PIECE_ORDER.
+    squares = np.asarray(squares, dtype=np.int64)
+    white = np.asarray(white, dtype=bool)
+    n = len(squares)
+    rows = np.arange(n)
+    empty = IS_ONBOARD & ~_occupancy(squares)
+
+    found = []
+    for slot in range(len(MOVERS[True])):
+        piece = np.where(white, MOVERS[True][slot], MOVERS[False][slot])
+        reach = np.zeros((n, _NSLOTS), dtype=bool)
+        reach[rows, squares[rows, piece]] = True
+        # Flood fill through empty on board squares
+        while True:
+            grown = reach | (reach[:, NEIGHBOURS].any(axis=2) & empty)
+            grown[:, RAIL] = False
+            if (grown == reach).all():
+                break
+            reach = grown
+        reach[rows, squares[rows, piece]] = False
+        parents, dests = np.nonzero(reach)
+        found.append((parents, piece[parents], dests))
+
+    parents, pieces, dests = (np.concatenate(parts) for parts in zip(*found))
+    order = np.argsort(parents, kind='stable')
+    return parents[order], pieces[order], dests[order]
+
+
+def apply_moves(squares, parents, pieces, dests):
+    # The positions after the moves returned by moves(), one row per move
+    moved = np.array(squares, dtype=np.int64)[parents]
+    moved[np.arange(len(parents)), pieces] = dests
+    return moved
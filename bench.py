@@ -0,0 +1,290 @@
+"""Benchmarks for the game engine and the HTTP API.
+
+    python bench.py                      # run and write bench_results.json
+    python bench.py --save-baseline      # ...and make it the new baseline
+    python bench.py --baseline bench_baseline.json
+
+Engine numbers come from fixed, seeded positions so runs are comparable.
+The HTTP numbers come from a local server on a random port, backed by a
+fresh database in a temporary directory. When a baseline is given, any
+result more than --tolerance worse than it is reported and the exit
+status is 1.
+"""
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from wsgiref.simple_server import WSGIRequestHandler, make_server
+
+import bitboard
+import geometry
+from pushfight import PIECE_ORDER, Board, Position, apply_turn
+
+SEED = 20200101
+# Whether bigger is better for each kind of result
+HIGHER_IS_BETTER = {'per_sec': True, 'ms': False, 'ns': False}
+
+
+def seed_positions(count, seed=SEED):
+    rng = random.Random(seed)
+    onboard = [sq for sq in range(geometry.NSQUARES) if geometry.IS_ONBOARD[sq]]
+    positions = []
+    for _ in range(count):
+        squares = rng.sample(onboard, len(PIECE_ORDER))
+        anchor = squares[rng.choice((5, 6, 7))]
+        positions.append(Position.from_squares(squares, anchor, True))
+    return positions
+
+
+def _rate(count, seconds):
+    return count / seconds if seconds else float('inf')
+
+
+def bench_next_states(positions):
+    boards = [Board.from_state(p.state) for p in positions]
+    start = time.perf_counter()
+    count = sum(1 for board in boards for _ in board.gen_next_states())
+    board_rate = _rate(count, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    count = sum(1 for p in positions for _ in bitboard.gen_unique_next_states(p.state))
+    unique_rate = _rate(count, time.perf_counter() - start)
+    return {
+        'board.gen_next_states.per_sec': board_rate,
+        'bitboard.gen_unique_next_states.per_sec': unique_rate,
+    }
+
+
+def bench_pushes(positions, repeat=20):
+    states = [p.state for p in positions]
+    calls = 0
+    found = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for state in states:
+            found += len(bitboard.pushes(state))
+            calls += 1
+    elapsed = time.perf_counter() - start
+    return {
+        'bitboard.pushes.calls.per_sec': _rate(calls, elapsed),
+        'bitboard.pushes.results.per_sec': _rate(found, elapsed),
+    }
+
+
+def bench_hashing(positions):
+    states = list(bitboard.gen_unique_next_states(positions[0].state))
+    pieces = [bitboard.to_pieces(state) for state in states]
+    anchored = [bitboard.anchored_coords(state) for state in states]
+
+    # A fresh Board per hash, which is what dedupe and cache lookups pay
+    start = time.perf_counter()
+    for p, a in zip(pieces, anchored):
+        hash(Board(p, a, False))
+    board_ns = (time.perf_counter() - start) * 1e9 / len(states)
+
+    created = [Position.from_state(state) for state in states]
+    start = time.perf_counter()
+    for _ in range(10):
+        for position in created:
+            hash(position)
+    position_ns = (time.perf_counter() - start) * 1e9 / (10 * len(created))
+    return {
+        'board.hash.ns': board_ns,
+        'position.hash.ns': position_ns,
+    }
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class LocalServer(object):
+    # server.py's routes on a random local port, with the database in a
+    # temporary directory
+    def __init__(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self._cwd = os.getcwd()
+        os.chdir(self.tmpdir.name)
+        # db_interface opens its database relative to the working directory
+        import server
+        from cryptography.fernet import Fernet
+        self.module = server
+        server.session_key = Fernet(Fernet.generate_key())
+        self.httpd = make_server('127.0.0.1', 0, server.b.default_app(), handler_class=_QuietHandler)
+        self.url = 'http://127.0.0.1:{}'.format(self.httpd.server_port)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        os.chdir(self._cwd)
+        self.tmpdir.cleanup()
+
+    def request(self, method, path, body=None, auth=None):
+        data = json.dumps(body).encode('utf8') if body is not None else None
+        req = urllib.request.Request(self.url + path, data=data, method=method)
+        req.add_header('Content-Type', 'application/json')
+        if auth is not None:
+            creds = base64.b64encode('{}:{}'.format(*auth).encode('utf8')).decode('utf8')
+            req.add_header('Authorization', 'Basic ' + creds)
+        with urllib.request.urlopen(req) as resp:
+            return json.loads(resp.read().decode('utf8') or 'null')
+
+
+def _latencies(fn, count):
+    times = []
+    for i in range(count):
+        start = time.perf_counter()
+        fn(i)
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return {
+        'p50.ms': times[len(times) // 2],
+        'p90.ms': times[int(len(times) * 0.9)],
+        'max.ms': times[-1],
+    }
+
+
+def _playout(board, turns, rng):
+    # A random sequence of legal turns that doesn't end the game
+    white = True
+    played = []
+    for _ in range(turns):
+        state = bitboard.from_squares(board, white)
+        options = []
+        for moves, child in bitboard.gen_unique_next_states(state, with_moves=True):
+            if not bitboard.is_over(child):
+                options.append((moves, child))
+        if not options:
+            break
+        moves, child = rng.choice(options)
+        placed = state
+        for frm, to in moves:
+            placed = bitboard.apply_move(placed, frm, to)
+        push = bitboard.push_of(placed, child)
+        end = apply_turn(board, moves, push)
+        played.append((board, moves + (push,), end, 'blackTurn' if white else 'whiteTurn'))
+        board, white = end, not white
+    return played
+
+
+def bench_http(requests=50):
+    local = LocalServer()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return _bench_http(local, requests)
+    finally:
+        local.close()
+
+
+def _bench_http(local, requests):
+    server = local.module
+    email, password = 'bench@example.com', 'bench-password'
+    local.request('POST', '/1/register', {'email': email, 'password': password})
+    encoded = base64.b64encode(password.encode('utf8')).decode('utf8')
+    token = local.request('POST', '/1/login', {'user': email, 'password': encoded})['token']
+    auth = (email, token)
+
+    results = {}
+    login = _latencies(
+        lambda _: local.request('POST', '/1/login', {'user': email, 'password': encoded}),
+        max(requests // 5, 5))
+    results.update(('http.login.' + k, v) for k, v in login.items())
+
+    game = server.make_game(email, 'opponent@example.com', color='white')
+    game['turns'][-1]['gameStage'] = 'whiteTurn'
+    server.db.put('games', game)
+    status = _latencies(
+        lambda _: local.request('GET', '/1/game/status?game=' + game['_id'], auth=auth),
+        requests)
+    results.update(('http.status.' + k, v) for k, v in status.items())
+
+    # Both players' turns are sent as the same user, which the server allows
+    game['black_player'] = email
+    server.db.put('games', game)
+    turns = _playout(game['turns'][-1]['board'], requests, random.Random(SEED))
+
+    def move(i):
+        start, moves, end, stage = turns[i]
+        local.request('POST', '/1/move', {
+            'gameId': game['_id'],
+            'startBoard': start,
+            'moves': [{'from': frm, 'to': to} for frm, to in moves],
+            'finalBoard': end,
+            'finalGameStage': stage,
+        }, auth=auth)
+
+    move_latency = _latencies(move, len(turns))
+    results.update(('http.move.' + k, v) for k, v in move_latency.items())
+    return results
+
+
+def run(http_requests=50, positions=20):
+    seeds = seed_positions(positions)
+    results = {}
+    results.update(bench_next_states(seeds))
+    results.update(bench_pushes(seeds))
+    results.update(bench_hashing(seeds))
+    if http_requests:
+        results.update(bench_http(http_requests))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # Names of results more than tolerance worse than the baseline
+    regressions = []
+    for name, value in sorted(results.items()):
+        old = baseline.get(name)
+        if old is None:
+            continue
+        higher = HIGHER_IS_BETTER[name.rsplit('.', 1)[-1]]
+        worse = value < old * (1 - tolerance) if higher else value > old * (1 + tolerance)
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--out', default='bench_results.json')
+    parser.add_argument('--baseline', default='bench_baseline.json')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='fraction a result may be worse than the baseline')
+    parser.add_argument('--requests', type=int, default=50,
+                        help='requests per endpoint, 0 skips the HTTP benchmarks')
+    args = parser.parse_args(argv)
+
+    results = run(http_requests=args.requests)
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    for name, value in sorted(results.items()):
+        print('{:45} {:14.3f}'.format(name, value))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        return 0
+    if not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    for name in regressions:
+        print('REGRESSION {}: {:.3f} (baseline {:.3f})'.format(
+            name, results[name], baseline[name]), file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,292 @@
+"""Bitboard move generation for push fight.
+
+The 4x10 board fits in a 40 bit integer, one bit per square, where square
+``10*row + col`` matches the integer encoding of ``pushfight.EXAMPLE_BOARD``.
+Off board squares that a piece can be pushed onto are part of the grid too,
+so a finished game is simply one with a piece bit outside ``ONBOARD``. The
+board's shape and the push tables come from geometry.py.
+
+A position (a "state") is the tuple
+
+    (wp, wm, bp, bm, anchor, is_whites_turn)
+
+where the first four entries are occupancy masks for each piece type and
+``anchor`` is the anchored square (or None). Pieces of the same type are
+interchangeable, so ``key(state)`` is a canonical hash of the position.
+"""
+
+from geometry import (
+    COLS, FULL, NSQUARES, OFFBOARD, ONBOARD, PUSH_CHAINS, PUSH_RAYS, STEPS,
+    coords, square,
+)
+
+WP, WM, BP, BM, ANCHOR, WHITE = range(6)
+
+PIECE_NAMES = (
+    ('wp1', 'wp2', 'wp3'),
+    ('wm1', 'wm2'),
+    ('bp1', 'bp2', 'bp3'),
+    ('bm1', 'bm2'),
+)
+
+
+def _shift(mask, step):
+    return mask << step if step > 0 else mask >> -step
+
+
+def gen_bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low
+        mask ^= low
+
+
+def bit_square(bit):
+    return bit.bit_length() - 1
+
+
+def occupied(state):
+    return state[WP] | state[WM] | state[BP] | state[BM]
+
+
+def from_pieces(pieces, anchored, is_whites_turn):
+    masks = [0, 0, 0, 0]
+    for kind, names in enumerate(PIECE_NAMES):
+        for name in names:
+            row, col = pieces[name]
+            masks[kind] |= 1 << square(row, col)
+    anchor = square(*anchored) if anchored is not None else None
+    return (masks[WP], masks[WM], masks[BP], masks[BM], anchor, is_whites_turn)
+
+
+def from_squares(board, is_whites_turn):
+    # The JSON board shape used by the server and client,
+    # {piece: 10*row + col, ..., 'anchor': square or None}
+    masks = [0, 0, 0, 0]
+    for kind, names in enumerate(PIECE_NAMES):
+        for name in names:
+            masks[kind] |= 1 << board[name]
+    return (masks[WP], masks[WM], masks[BP], masks[BM], board.get('anchor'), is_whites_turn)
+
+
+def to_pieces(state):
+    # Same type pieces are named in square order
+    pieces = {}
+    for kind, names in enumerate(PIECE_NAMES):
+        for name, bit in zip(names, gen_bits(state[kind])):
+            pieces[name] = coords(bit_square(bit))
+    return pieces
+
+
+def anchored_coords(state):
+    anchor = state[ANCHOR]
+    return coords(anchor) if anchor is not None else None
+
+
+def key(state):
+    anchor = state[ANCHOR]
+    return (
+        state[WP]
+        | state[WM] << NSQUARES
+        | state[BP] << 2 * NSQUARES
+        | state[BM] << 3 * NSQUARES
+        | (anchor + 1 if anchor is not None else 0) << 4 * NSQUARES
+        | bool(state[WHITE]) << 4 * NSQUARES + 6
+    )
+
+
+def from_key(key):
+    # Inverse of key, for states sent between processes as a single int
+    anchor = key >> 4 * NSQUARES & 63
+    return (
+        key & FULL,
+        key >> NSQUARES & FULL,
+        key >> 2 * NSQUARES & FULL,
+        key >> 3 * NSQUARES & FULL,
+        anchor - 1 if anchor else None,
+        bool(key >> 4 * NSQUARES + 6),
+    )
+
+
+def is_over(state):
+    return bool(occupied(state) & OFFBOARD)
+
+
+def white_lost(state):
+    # Only meaningful once is_over(state)
+    return bool((state[WP] | state[WM]) & OFFBOARD)
+
+
+def popcount(mask):
+    return bin(mask).count('1')
+
+
+def reachable(bit, occ):
+    # Flood fill every empty on board square connected to bit
+    empty = ONBOARD & ~occ
+    reach = bit
+    while True:
+        grown = reach | ((reach << 1 | reach >> 1 | reach << COLS | reach >> COLS) & empty)
+        if grown == reach:
+            return reach & ~bit
+        reach = grown
+
+
+def gen_moves(state):
+    # Yields (from_square, to_square, next_state) for every single move
+    wp, wm, bp, bm, anchor, white = state
+    occ = wp | wm | bp | bm
+    empty = ONBOARD & ~occ
+    if white:
+        movers = ((WP, wp), (WM, wm))
+    else:
+        movers = ((BP, bp), (BM, bm))
+    for kind, mask in movers:
+        while mask:
+            bit = mask & -mask
+            mask ^= bit
+            # Flood fill every empty on board square connected to bit
+            reach = bit
+            while True:
+                grown = reach | ((reach << 1 | reach >> 1 | reach << COLS | reach >> COLS) & empty)
+                if grown == reach:
+                    break
+                reach = grown
+            reach ^= bit
+            sq = bit.bit_length() - 1
+            while reach:
+                dest = reach & -reach
+                reach ^= dest
+                masks = [wp, wm, bp, bm, anchor, white]
+                masks[kind] ^= bit | dest
+                yield sq, dest.bit_length() - 1, tuple(masks)
+
+
+def apply_move(state, frm, to):
+    masks = list(state)
+    for kind in (WP, WM, BP, BM):
+        if masks[kind] >> frm & 1:
+            masks[kind] ^= 1 << frm | 1 << to
+            return tuple(masks)
+    raise ValueError("No piece on square {}".format(frm))
+
+
+def try_push(state, sq, direction, occ=None):
+    # Returns the mask of pieces pushed (including the pusher) or 0
+    if occ is None:
+        occ = occupied(state)
+    anchor = state[ANCHOR]
+    chains = PUSH_CHAINS[direction][sq]
+    for i, target in enumerate(PUSH_RAYS[direction][sq]):
+        if target == anchor:
+            return 0
+        if not occ >> target & 1:
+            return chains[i] if i else 0
+    # Ran into the rail
+    return 0
+
+
+def apply_push(state, chain, sq, direction):
+    step = STEPS[direction]
+    masks = []
+    for kind in (WP, WM, BP, BM):
+        moved = state[kind] & chain
+        masks.append(state[kind] ^ moved | _shift(moved, step))
+    return (masks[WP], masks[WM], masks[BP], masks[BM], sq + step, not state[WHITE])
+
+
+_PUSH_TABLES = tuple(zip(PUSH_RAYS, PUSH_CHAINS, STEPS))
+
+
+def pushes(state):
+    # Every position reachable by a single push, as a list. This is the
+    # innermost loop of move generation so try_push and apply_push are
+    # inlined here.
+    wp, wm, bp, bm, anchor, white = state
+    occ = wp | wm | bp | bm
+    pushers = wp if white else bp
+    turn = not white
+    results = []
+    for rays, chains, step in _PUSH_TABLES:
+        # Only pushers with an occupied neighbour in this direction can push
+        if step > 0:
+            candidates = pushers & occ >> step
+        else:
+            candidates = pushers & occ << -step
+        while candidates:
+            bit = candidates & -candidates
+            candidates ^= bit
+            sq = bit.bit_length() - 1
+            for i, target in enumerate(rays[sq]):
+                if target == anchor:
+                    break
+                if not occ >> target & 1:
+                    chain = chains[sq][i]
+                    if step > 0:
+                        results.append((
+                            wp ^ (wp & chain) | (wp & chain) << step,
+                            wm ^ (wm & chain) | (wm & chain) << step,
+                            bp ^ (bp & chain) | (bp & chain) << step,
+                            bm ^ (bm & chain) | (bm & chain) << step,
+                            sq + step, turn))
+                    else:
+                        results.append((
+                            wp ^ (wp & chain) | (wp & chain) >> -step,
+                            wm ^ (wm & chain) | (wm & chain) >> -step,
+                            bp ^ (bp & chain) | (bp & chain) >> -step,
+                            bm ^ (bm & chain) | (bm & chain) >> -step,
+                            sq + step, turn))
+                    break
+    return results
+
+
+def push_of(placed, pushed):
+    # The (from_square, to_square) of the pusher taking placed to pushed.
+    # A push shifts a line of pieces by one, so the pusher's square is the
+    # only one it empties.
+    vacated = occupied(placed) & ~occupied(pushed)
+    return bit_square(vacated), pushed[ANCHOR]
+
+
+def gen_pushes(state):
+    yield from pushes(state)
+
+
+def gen_next_states(state, nmoves=2):
+    # Up to nmoves moves followed by a mandatory push
+    yield from pushes(state)
+    if nmoves == 0:
+        return
+    for _, _, moved in gen_moves(state):
+        if nmoves == 1:
+            yield from pushes(moved)
+        else:
+            yield from gen_next_states(moved, nmoves - 1)
+
+
+def gen_unique_next_states(state, nmoves=2, with_moves=False):
+    # Like gen_next_states but each distinct successor is yielded once.
+    # Move orders that transpose (A then B, B then A, out and back) are
+    # merged before pushing, so duplicates are never expanded. With
+    # with_moves, yields (moves, state) where moves is a tuple of
+    # (from_square, to_square) pairs reaching the pushed position.
+    layer = {state: ()}
+    arranged = dict(layer)
+    for _ in range(nmoves):
+        next_layer = {}
+        for placed, moves in layer.items():
+            for frm, to, moved in gen_moves(placed):
+                if moved not in arranged:
+                    arranged[moved] = next_layer[moved] = moves + ((frm, to),)
+        layer = next_layer
+
+    seen = set()
+    for placed, moves in arranged.items():
+        for pushed in pushes(placed):
+            if pushed in seen:
+                continue
+            seen.add(pushed)
+            if with_moves:
+                yield moves, pushed
+            else:
+                yield pushed
@@ -0,0 +1,110 @@
+"""Compact encodings of boards and turns.
+
+A JSON board names the square of each of the ten pieces and the anchor,
+{'wp1': 14, ..., 'bm2': 16, 'anchor': None}, about 120 bytes. Squares are
+``10*row + col`` on the 4x10 grid, so each fits in one printable
+character, chr(48 + square), from '0' to 'W'. A board is then an eleven
+character string, the pieces in PIECES order and then the anchor, '.' if
+there is none:
+
+    >>> encode_board(pushfight.EXAMPLE_BOARD)
+    '>HF4RSI5?@.'
+
+A move {'from': 14, 'to': 15} is the two characters for its squares, and a
+turn's moves are their concatenation. None of these characters need
+escaping in JSON.
+
+The SQLite backend stores turns packed with pack_turn, and /1/game/status
+sends boards this way when asked for ?format=compact.
+"""
+from geometry import NSQUARES
+
+PIECES = ('wp1', 'wp2', 'wp3', 'wm1', 'wm2', 'bp1', 'bp2', 'bp3', 'bm1', 'bm2')
+_ZERO = 48
+NO_ANCHOR = '.'
+BOARD_LENGTH = len(PIECES) + 1
+_BOARD_KEYS = frozenset(PIECES + ('anchor',))
+_MOVE_KEYS = frozenset(('from', 'to'))
+# Exports convert every turn, so these are looked up rather than worked out
+_CHARS = tuple(chr(_ZERO + sq) for sq in range(NSQUARES))
+_SQUARES = {c: sq for sq, c in enumerate(_CHARS)}
+
+
+def _square_char(sq):
+    # Exactly ints, so a bool or float doesn't come back as something else
+    if type(sq) is not int or not 0 <= sq < NSQUARES:
+        raise ValueError("Bad square {!r}".format(sq))
+    return _CHARS[sq]
+
+
+def _char_square(c):
+    try:
+        return _SQUARES[c]
+    except KeyError:
+        raise ValueError("Bad square {!r}".format(c))
+
+
+def encode_board(board):
+    # Only boards with exactly the usual keys, so decoding gives them back
+    if board.keys() != _BOARD_KEYS:
+        raise ValueError("Bad board {!r}".format(board))
+    chars = [_square_char(board[name]) for name in PIECES]
+    anchor = board['anchor']
+    chars.append(NO_ANCHOR if anchor is None else _square_char(anchor))
+    return ''.join(chars)
+
+
+def decode_board(text):
+    if not isinstance(text, str) or len(text) != BOARD_LENGTH:
+        raise ValueError("Bad board {!r}".format(text))
+    try:
+        board = dict(zip(PIECES, map(_SQUARES.__getitem__, text)))
+    except KeyError:
+        raise ValueError("Bad board {!r}".format(text))
+    board['anchor'] = None if text[-1] == NO_ANCHOR else _char_square(text[-1])
+    return board
+
+
+def encode_moves(moves):
+    chars = []
+    for move in moves:
+        if not isinstance(move, dict) or move.keys() != _MOVE_KEYS:
+            raise ValueError("Bad move {!r}".format(move))
+        chars.append(_square_char(move['from']) + _square_char(move['to']))
+    return ''.join(chars)
+
+
+def decode_moves(text):
+    if not isinstance(text, str) or len(text) % 2:
+        raise ValueError("Bad moves {!r}".format(text))
+    return [{'from': _char_square(text[i]), 'to': _char_square(text[i + 1])}
+            for i in range(0, len(text), 2)]
+
+
+def pack_turn(turn):
+    # A copy of turn with its board and moves packed. Either is left as it
+    # was if it doesn't have the usual shape, so any turn can be stored.
+    packed = dict(turn)
+    for key, encode in (('board', encode_board), ('moves', encode_moves)):
+        value = turn.get(key)
+        if value is None or isinstance(value, str):
+            continue
+        try:
+            packed[key] = encode(value)
+        except (ValueError, AttributeError, TypeError):
+            pass
+    return packed
+
+
+def unpack_turn(turn):
+    # The inverse of pack_turn. Turns stored before packing, or with values
+    # that were never packed, come back as they are.
+    unpacked = dict(turn)
+    for key, decode in (('board', decode_board), ('moves', decode_moves)):
+        value = turn.get(key)
+        if isinstance(value, str):
+            try:
+                unpacked[key] = decode(value)
+            except ValueError:
+                pass
+    return unpacked
@@ -1,9 +1,34 @@
-from utils import hash_pw, check_pw
-from tinydb import TinyDB, Query, where
+import bisect
+import contextlib
+import heapq
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+import compact
+from locks import KeyedLocks
+from utils import hash_pw
+from tinydb import TinyDB, where
+
+log = logging.getLogger('pushfight.db')
 
 # A generic interface that lets us swap out backends with somewhat more ease
 
+class Conflict(ValueError):
+    # A turn was added to the game since the header append_turn was given
+    pass
+
+
 class Base(object):
+    # Fields of each bucket that find() can look up without a scan, kept
+    # up to date by put() and delete(). _id is always indexed.
+    INDEXES = {
+        'users': ('email',),
+        'games': ('white_player', 'black_player', 'game_status'),
+    }
+
     def get(self, bucket, key):
         raise NotImplementedError
 
@@ -17,6 +42,107 @@ class Base(object):
     def find(self, bucket, value, key=None):
         raise NotImplementedError
 
+    def find_any(self, bucket, value, keys):
+        # Documents where any of keys equals value, each once
+        found = {}
+        for key in keys:
+            for doc in self.find(bucket, value, key=key):
+                found.setdefault(doc['_id'], doc)
+        return list(found.values())
+
+    def find_page(self, bucket, value, keys, after=None, limit=20):
+        # Like find_any, newest first, at most limit documents starting
+        # after the cursor returned with the previous page. Returns the
+        # documents and the cursor for the next page, None after the last.
+        # Cursors are plain JSON values. This default pages through _id.
+        if after is not None and not isinstance(after, str):
+            raise ValueError("Bad cursor")
+        docs = sorted(self.find_any(bucket, value, keys), key=lambda doc: str(doc['_id']), reverse=True)
+        if after is not None:
+            docs = [doc for doc in docs if str(doc['_id']) < after]
+        if len(docs) <= limit:
+            return docs, None
+        return docs[:limit], str(docs[limit - 1]['_id'])
+
+    def scan(self, bucket, after=None, limit=1000):
+        # Up to limit (cursor, document) pairs from bucket, oldest first,
+        # after the cursor given. Fewer than limit means there are no more.
+        # Cursors are plain JSON values, so an export can be resumed from
+        # any document it wrote.
+        raise NotImplementedError
+
+    @contextlib.contextmanager
+    def batch(self):
+        # Backends that can group writes into one transaction do it here
+        yield
+
+    # Turns. Games start with a 'turns' list, which put() stores; after that
+    # the game document is a header with a 'turn_count' and turns are added
+    # and read through these, so backends can keep them as a log. These
+    # defaults keep the list inside the game document.
+
+    def append_turn(self, game, turn, **fields):
+        # Adds turn after the game's latest, sets any header fields passed
+        # and returns the new header. The game's turn_count is its version:
+        # this is a compare-and-swap from the version in game, and raises
+        # Conflict if another turn was added since game was read.
+        with _turn_locks.hold(game['_id']):
+            current = list(self.find('games', game['_id']))[0]
+            if len(current['turns']) != self.turn_count(game):
+                raise Conflict
+            current['turns'].append(turn)
+            current['turn_count'] = len(current['turns'])
+            current.update(fields)
+            return self.put('games', current)
+
+    def latest_turn(self, game):
+        return self.get_turns(game)[-1]
+
+    def get_turns(self, game, start=0, limit=None):
+        # The turns from ply start on, at most limit of them
+        turns = game['turns'] if 'turns' in game else list(self.find('games', game['_id']))[0]['turns']
+        return turns[start:] if limit is None else turns[start:start + limit]
+
+    @staticmethod
+    def turn_count(game):
+        if 'turn_count' in game:
+            return game['turn_count']
+        return len(game['turns'])
+
+def _dump_turn(turn):
+    # Turns are stored with compact boards and moves, about a tenth the size
+    return json.dumps(compact.pack_turn(turn), separators=(',', ':'))
+
+def _load_turn(doc):
+    return compact.unpack_turn(json.loads(doc))
+
+# Makes the default append_turn's read and write one step per game
+_turn_locks = KeyedLocks()
+
+def _index_value(value):
+    # Indexes hold plain values, anything else as JSON text
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    return json.dumps(value, sort_keys=True)
+
+
+def _check_cursor(after):
+    # Backends that page by doc_id use it as the cursor
+    if after is not None and (not isinstance(after, int) or isinstance(after, bool)):
+        raise ValueError("Bad cursor")
+
+
+def _merge_newest(runs, count):
+    # Up to count distinct ids from runs that are each sorted newest first
+    merged = []
+    for doc_id in heapq.merge(*runs, reverse=True):
+        if not merged or merged[-1] != doc_id:
+            merged.append(doc_id)
+            if len(merged) == count:
+                break
+    return merged
+
+
 class TestDB(Base):
     # can infer is_setup and current turn from data
     def _board(anchor=None):
@@ -142,14 +268,13 @@ class TestDB(Base):
             raise KeyError("No such bucket")
         return value
 
-    def delete(self, key):
-        if not isinstance(key, int):
-            raise ValueError
+    def delete(self, bucket, key):
         if bucket == 'users':
-            del self.USERS[_id]
+            self.USERS.pop(key, None)
         elif bucket == 'games':
-            del self.GAMES[_id]
-        raise KeyError("No such bucket")
+            self.GAMES.pop(key, None)
+        else:
+            raise KeyError("No such bucket")
 
     def find(self, bucket, value, key=None):
         if key is None:
@@ -163,7 +288,13 @@ class TestDB(Base):
 
 
 class Tiny(Base):
-    _DB = TinyDB('db.json')
+    def __init__(self, path='db.json'):
+        self._DB = TinyDB(path)
+        # bucket -> field -> value -> sorted doc_ids, built the first time
+        # a bucket is used and kept up to date by put and delete
+        self._indexes = {}
+        # TinyDB rewrites the whole file on each write, so writes take turns
+        self._lock = threading.RLock()
 
     @property
     def USERS(self):
@@ -173,14 +304,48 @@ class Tiny(Base):
     def GAMES(self):
         return self._DB.table('GAMES')
 
-    def get(self, bucket, key):
+    def _table(self, bucket):
         if bucket == 'users':
-            table = self.USERS
+            return self.USERS
         elif bucket == 'games':
-            table = self.GAMES
-        else:
-            raise KeyError("No such bucket")
-        return table.search(where('_id') == key)
+            return self.GAMES
+        raise KeyError("No such bucket")
+
+    def _index(self, bucket):
+        index = self._indexes.get(bucket)
+        if index is None:
+            index = {key: {} for key in ('_id',) + self.INDEXES[bucket]}
+            for doc in self._table(bucket).all():
+                self._index_doc(index, doc, doc.doc_id)
+            self._indexes[bucket] = index
+        return index
+
+    @staticmethod
+    def _get_docs(table, doc_ids):
+        # TinyDB reads the whole file for each get, so all of doc_ids are
+        # fetched with one. It returns them in table order, put back in ours.
+        if not doc_ids:
+            return []
+        docs = {doc.doc_id: doc for doc in table.get(doc_ids=doc_ids)}
+        return [docs[doc_id] for doc_id in doc_ids if doc_id in docs]
+
+    @staticmethod
+    def _index_doc(index, doc, doc_id, remove=False):
+        for key, entries in index.items():
+            value = _index_value(doc.get(key))
+            ids = entries.setdefault(value, [])
+            at = bisect.bisect_left(ids, doc_id)
+            found = at < len(ids) and ids[at] == doc_id
+            if remove:
+                if found:
+                    del ids[at]
+            elif not found:
+                ids.insert(at, doc_id)
+            if not ids:
+                del entries[value]
+
+    def get(self, bucket, key):
+        return self.find(bucket, key)
 
     def put(self, bucket, value, key='_id'):
         # We don't need key in this schema, but we might want it in general
@@ -188,47 +353,304 @@ class Tiny(Base):
         if qval is None:
             raise ValueError
 
-        if bucket == 'users':
-            table = self.USERS
-        elif bucket == 'games':
-            table = self.GAMES
-        else:
-            raise KeyError("No such bucket")
-
-        old = table.get(where(key) == qval)
-        _id = value.get('_id')
-        if old:
-            if _id is not None and _id != old['doc_id']:
-                raise ValueError
-            table.upsert(value, where('doc_id') == _id)
-            doc_id = _id
-        else:
-            doc_id = table.insert(value)
-            def add_id(doc):
-                doc['_id'] = _id
-            table.update(add_id, doc_ids=[doc_id])
+        table = self._table(bucket)
+        with self._lock:
+            index = self._index(bucket)
+            found = self.find(bucket, qval, key=key)
+            old = found[0] if found else None
+            _id = value.get('_id')
+            if old:
+                if _id is not None and _id != old.get('_id'):
+                    raise ValueError
+                doc_id = old.doc_id
+                self._index_doc(index, old, doc_id, remove=True)
+                table.update(value, doc_ids=[doc_id])
+            else:
+                doc_id = table.insert(value)
+                def add_id(doc):
+                    doc['_id'] = _id if _id is not None else doc_id
+                table.update(add_id, doc_ids=[doc_id])
 
-        return table.get(doc_id=doc_id)
+            doc = table.get(doc_id=doc_id)
+            self._index_doc(index, doc, doc_id)
+            return doc
 
-    def delete(self, key):
-        if bucket == 'users':
-            table = self.USERS
-        elif bucket == 'games':
-            table = self.GAMES
-        else:
-            raise KeyError("No such bucket")
-        table.remove(where('_id') == key)
+    def delete(self, bucket, key):
+        table = self._table(bucket)
+        with self._lock:
+            index = self._index(bucket)
+            for doc in self.find(bucket, key):
+                self._index_doc(index, doc, doc.doc_id, remove=True)
+                table.remove(doc_ids=[doc.doc_id])
 
     def find(self, bucket, value, key=None):
         if key is None:
             # Why not do this in the function def?
             # Because then you can't search for "None" as a key
             key = '_id'
-        if bucket == 'users':
-            table = self.USERS
-        elif bucket == 'games':
-            table = self.GAMES
-        # print(table.all())
-        return table.search(where(key) == value)
+        table = self._table(bucket)
+        entries = self._index(bucket).get(key)
+        if entries is None:
+            return table.search(where(key) == value)
+        return self._get_docs(table, entries.get(_index_value(value), []))
+
+    def find_any(self, bucket, value, keys):
+        table = self._table(bucket)
+        index = self._index(bucket)
+        if not all(key in index for key in keys):
+            return super().find_any(bucket, value, keys)
+        doc_ids = set()
+        for key in keys:
+            doc_ids.update(index[key].get(_index_value(value), ()))
+        return self._get_docs(table, sorted(doc_ids))
+
+    def find_page(self, bucket, value, keys, after=None, limit=20):
+        # Pages through doc_ids, which only grow, walking each field's
+        # sorted ids backwards from the cursor
+        _check_cursor(after)
+        table = self._table(bucket)
+        index = self._index(bucket)
+        if not all(key in index for key in keys):
+            return super().find_page(bucket, value, keys, after, limit)
+        value = _index_value(value)
+        runs = []
+        for key in keys:
+            ids = index[key].get(value, [])
+            end = len(ids) if after is None else bisect.bisect_left(ids, after)
+            runs.append(ids[end - 1::-1] if end else [])
+        doc_ids = _merge_newest(runs, limit + 1)
+        docs = self._get_docs(table, doc_ids[:limit])
+        return docs, (doc_ids[limit - 1] if len(doc_ids) > limit else None)
+
+    def scan(self, bucket, after=None, limit=1000):
+        # One read of the file per chunk
+        _check_cursor(after)
+        table = self._table(bucket)
+        with self._lock:
+            ids = sorted(doc_id for run in self._index(bucket)['_id'].values() for doc_id in run)
+        start = 0 if after is None else bisect.bisect_right(ids, after)
+        docs = self._get_docs(table, ids[start:start + limit])
+        return [(doc.doc_id, doc) for doc in docs]
+
+
+class SQLite(Base):
+    # Documents are stored as JSON, with the indexed fields copied into
+    # indexed columns. Other keys still work but scan the table.
+    def __init__(self, path='db.sqlite3'):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        with self.batch():
+            for bucket, columns in self.INDEXES.items():
+                self._conn.execute(
+                    'CREATE TABLE IF NOT EXISTS {} (doc_id INTEGER PRIMARY KEY, _id UNIQUE, {}, doc TEXT NOT NULL)'
+                    .format(bucket, ', '.join(columns)))
+                for column in ('_id',) + columns:
+                    self._conn.execute('CREATE INDEX IF NOT EXISTS {0}_{1} ON {0} ({1})'.format(bucket, column))
+            # One row per turn, the game header's turn_count is the next ply
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS turns (game_id NOT NULL, ply INTEGER NOT NULL, doc TEXT NOT NULL, '
+                'PRIMARY KEY (game_id, ply)) WITHOUT ROWID')
+
+    def _columns(self, bucket):
+        try:
+            return ('_id',) + self.INDEXES[bucket]
+        except KeyError:
+            raise KeyError("No such bucket")
+
+    _column_value = staticmethod(_index_value)
+
+    @contextlib.contextmanager
+    def batch(self):
+        # Groups every write inside it into one transaction, and holds the
+        # connection so other threads don't interleave with it
+        with self._lock:
+            if self._depth == 0:
+                self._conn.execute('BEGIN IMMEDIATE')
+            self._depth += 1
+            try:
+                yield
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._conn.execute('ROLLBACK')
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self._conn.execute('COMMIT')
+
+    def _select(self, bucket, value, key):
+        columns = self._columns(bucket)
+        if key in columns:
+            if value is None:
+                sql = 'SELECT doc_id, doc FROM {} WHERE {} IS NULL'.format(bucket, key)
+                rows = self._conn.execute(sql)
+            else:
+                sql = 'SELECT doc_id, doc FROM {} WHERE {} = ?'.format(bucket, key)
+                rows = self._conn.execute(sql, (self._column_value(value),))
+            return [(doc_id, json.loads(doc)) for doc_id, doc in rows]
+        rows = self._conn.execute('SELECT doc_id, doc FROM {}'.format(bucket))
+        found = []
+        for doc_id, doc in rows:
+            doc = json.loads(doc)
+            if doc.get(key) == value:
+                found.append((doc_id, doc))
+        return found
+
+    def get(self, bucket, key):
+        return self.find(bucket, key)
+
+    def put(self, bucket, value, key='_id'):
+        qval = value.get(key)
+        if qval is None:
+            raise ValueError
+        columns = self._columns(bucket)
+
+        turns = None
+        if bucket == 'games' and 'turns' in value:
+            value = dict(value)
+            turns = value.pop('turns')
+            value['turn_count'] = len(turns)
+
+        with self.batch():
+            old = self._select(bucket, qval, key)
+            _id = value.get('_id')
+            if old:
+                doc_id, doc = old[0]
+                if _id is not None and _id != doc.get('_id'):
+                    raise ValueError
+                doc.update(value)
+            else:
+                doc = dict(value)
+                doc_id = self._conn.execute(
+                    'INSERT INTO {} (doc) VALUES (?)'.format(bucket), ('{}',)).lastrowid
+                if _id is None:
+                    doc['_id'] = doc_id
+            sql = 'UPDATE {} SET {}, doc = ? WHERE doc_id = ?'.format(
+                bucket, ', '.join('{} = ?'.format(column) for column in columns))
+            params = [self._column_value(doc.get(column)) for column in columns]
+            self._conn.execute(sql, params + [json.dumps(doc), doc_id])
+            if turns is not None:
+                self._conn.execute('DELETE FROM turns WHERE game_id = ?', (doc['_id'],))
+                self._conn.executemany(
+                    'INSERT INTO turns (game_id, ply, doc) VALUES (?, ?, ?)',
+                    [(doc['_id'], ply, _dump_turn(turn)) for ply, turn in enumerate(turns)])
+        return doc
+
+    def append_turn(self, game, turn, **fields):
+        ply = self.turn_count(game)
+        with self.batch():
+            try:
+                self._conn.execute(
+                    'INSERT INTO turns (game_id, ply, doc) VALUES (?, ?, ?)',
+                    (game['_id'], ply, _dump_turn(turn)))
+            except sqlite3.IntegrityError:
+                raise Conflict
+            return self.put('games', dict(fields, _id=game['_id'], turn_count=ply + 1))
+
+    def latest_turn(self, game):
+        if 'turns' in game:
+            return game['turns'][-1]
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT doc FROM turns WHERE game_id = ? AND ply = ?',
+                (game['_id'], self.turn_count(game) - 1)).fetchone()
+        return _load_turn(row[0]) if row else None
+
+    def get_turns(self, game, start=0, limit=None):
+        if 'turns' in game:
+            return super().get_turns(game, start, limit)
+        with self._lock:
+            # A negative LIMIT is no limit
+            rows = self._conn.execute(
+                'SELECT doc FROM turns WHERE game_id = ? AND ply >= ? ORDER BY ply LIMIT ?',
+                (game['_id'], start, -1 if limit is None else limit))
+            return [_load_turn(doc) for doc, in rows]
+
+    def delete(self, bucket, key):
+        self._columns(bucket)
+        with self.batch():
+            self._conn.execute('DELETE FROM {} WHERE _id = ?'.format(bucket), (key,))
+            if bucket == 'games':
+                self._conn.execute('DELETE FROM turns WHERE game_id = ?', (key,))
+
+    def find(self, bucket, value, key=None):
+        if key is None:
+            key = '_id'
+        with self._lock:
+            return [doc for _, doc in self._select(bucket, value, key)]
+
+    def find_any(self, bucket, value, keys):
+        columns = self._columns(bucket)
+        if value is None or not all(key in columns for key in keys):
+            return super().find_any(bucket, value, keys)
+        # SQLite answers an OR of indexed columns with one index lookup per
+        # column and drops the duplicates
+        sql = 'SELECT doc FROM {} WHERE {} ORDER BY doc_id'.format(
+            bucket, ' OR '.join('{} = ?'.format(key) for key in keys))
+        with self._lock:
+            rows = self._conn.execute(sql, [self._column_value(value)] * len(keys))
+            return [json.loads(doc) for doc, in rows]
+
+    def find_page(self, bucket, value, keys, after=None, limit=20):
+        columns = self._columns(bucket)
+        if not all(key in columns for key in keys):
+            return super().find_page(bucket, value, keys, after, limit)
+        # Each column's index is ordered by (value, doc_id), so every query
+        # reads at most limit + 1 entries, then the runs are merged
+        _check_cursor(after)
+        if after is None:
+            after = (1 << 63) - 1
+        runs = []
+        docs = {}
+        with self._lock:
+            for key in keys:
+                op = 'IS' if value is None else '='
+                sql = 'SELECT doc_id, doc FROM {} WHERE {} {} ? AND doc_id < ? ORDER BY doc_id DESC LIMIT ?'.format(
+                    bucket, key, op)
+                rows = self._conn.execute(sql, (self._column_value(value), after, limit + 1)).fetchall()
+                runs.append([doc_id for doc_id, _ in rows])
+                docs.update(rows)
+        doc_ids = _merge_newest(runs, limit + 1)
+        page = [json.loads(docs[doc_id]) for doc_id in doc_ids[:limit]]
+        return page, (doc_ids[limit - 1] if len(doc_ids) > limit else None)
+
+    def scan(self, bucket, after=None, limit=1000):
+        # A range seek on the rowid per chunk. Between chunks nothing is
+        # held, so a live server's writes carry on.
+        self._columns(bucket)
+        _check_cursor(after)
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT doc_id, doc FROM {} WHERE doc_id > ? ORDER BY doc_id LIMIT ?'.format(bucket),
+                (after or 0, limit)).fetchall()
+        return [(doc_id, json.loads(doc)) for doc_id, doc in rows]
+
+    def close(self):
+        self._conn.close()
+
+
+def open_db(path):
+    # db.json files from before the SQLite backend still open with TinyDB
+    if path.endswith('.json'):
+        return Tiny(path)
+    return SQLite(path)
+
+
+def default_path():
+    # PUSHFIGHT_DB, else db.sqlite3, except that a deployment from before the
+    # SQLite backend keeps its db.json until it's imported
+    path = os.environ.get('PUSHFIGHT_DB')
+    if path:
+        return path
+    if os.path.exists('db.json') and not os.path.exists('db.sqlite3'):
+        log.warning('Using db.json with TinyDB. To move it to SQLite run: '
+                    'python dbtool.py export --db db.json --out dump.ndjson && '
+                    'python dbtool.py import --db db.sqlite3 --in dump.ndjson')
+        return 'db.json'
+    return 'db.sqlite3'
+
 
-db = Tiny()
\ No newline at end of file
+db = open_db(default_path())
@@ -0,0 +1,249 @@
+"""Export and import the database as a stream, for analytics and backups.
+
+    python dbtool.py export --db db.sqlite3 --out dump.ndjson [--compact] [--resume]
+    python dbtool.py import --db copy.sqlite3 --in dump.ndjson [--offset BYTES]
+    python dbtool.py export --db db.sqlite3 --columns positions/ [--resume]
+
+Exports read the database through Base.scan, a chunk at a time, so memory
+stays bounded and a live server isn't held up; on SQLite the server keeps
+writing while an export runs. Each line of an export is one document:
+
+    {"bucket": "users", "cursor": 3, "doc": {...}}
+    {"bucket": "games", "cursor": 7, "doc": {...}, "turns": [...]}
+
+where a game's turns are history.encode records, with compact.py boards
+and moves given --compact. --resume carries on after the last complete
+line of an existing export. Imports put documents back a chunk per
+transaction and print the byte offset reached after each, which --offset
+picks up from.
+
+--columns writes every position played instead, as fixed width little
+endian column files that numpy.fromfile reads straight into the arrays
+batch.py works on. Row i is the board before ply i + 1 of a game and the
+moves played from it:
+
+    games.txt    game ids as JSON, one per line; the game column indexes it
+    game.u4      uint32
+    ply.u2       uint16, the ply the move was played on
+    squares.i1   int8 x 10, pushfight.PIECE_ORDER
+    anchor.i1    int8, -1 for none
+    white.u1     uint8, 1 if white was to move
+    move.S6      the compact moves, NUL padded, empty for setup placements
+    columns.json row count and export cursor, written after each chunk
+"""
+import argparse
+import itertools
+import json
+import os
+import struct
+import sys
+
+import compact
+import history
+from db_interface import open_db
+from pushfight import PIECE_ORDER
+
+BUCKETS = ('users', 'games')
+CHUNK = 500
+# Bytes per row of each column file
+COLUMNS = (('game', 'u4', 4), ('ply', 'u2', 2), ('squares', 'i1', len(PIECE_ORDER)),
+           ('anchor', 'i1', 1), ('white', 'u1', 1), ('move', 'S6', 6))
+
+
+def export_records(db, after=None, packed=False, chunk=CHUNK):
+    # Every document as an export line, users first. after is the
+    # (bucket, cursor) of the last line already written.
+    buckets = BUCKETS
+    cursor = None
+    if after is not None:
+        bucket, cursor = after
+        buckets = BUCKETS[BUCKETS.index(bucket):]
+    for bucket in buckets:
+        while True:
+            rows = db.scan(bucket, after=cursor, limit=chunk)
+            for cursor, doc in rows:
+                yield _record(db, bucket, cursor, doc, packed)
+            if len(rows) < chunk:
+                break
+        cursor = None
+
+
+def _record(db, bucket, cursor, doc, packed):
+    record = {'bucket': bucket, 'cursor': cursor, 'doc': dict(doc)}
+    if bucket == 'games':
+        turns = db.get_turns(doc)
+        record['doc'].pop('turns', None)
+        record['doc']['turn_count'] = len(turns)
+        record['turns'] = list(history.encode(turns, packed=packed))
+    return record
+
+
+def export_ndjson(db, path, packed=False, resume=False, chunk=CHUNK):
+    # Returns the number of lines written
+    after = None
+    if resume and os.path.exists(path):
+        line = _last_line(path)
+        if line is not None:
+            record = json.loads(line)
+            after = record['bucket'], record['cursor']
+    count = 0
+    with open(path, 'a' if resume else 'w') as out:
+        for record in export_records(db, after, packed, chunk):
+            out.write(json.dumps(record, separators=(',', ':')) + '\n')
+            count += 1
+    return count
+
+
+def _last_line(path, block=1 << 16):
+    # The last complete line of path, after cutting off any partial line an
+    # interrupted export left behind. Reads backwards from the end.
+    with open(path, 'rb+') as f:
+        pos = f.seek(0, os.SEEK_END)
+        tail = b''
+        while pos > 0 and tail.count(b'\n') < 2:
+            step = min(block, pos)
+            pos -= step
+            f.seek(pos)
+            tail = f.read(step) + tail
+        end = tail.rfind(b'\n')
+        f.truncate(pos + end + 1)
+        if end < 0:
+            return None
+        return tail[tail.rfind(b'\n', 0, end) + 1:end]
+
+
+def import_ndjson(db, path, offset=0, chunk=CHUNK, progress=None):
+    # Puts the documents of an export back, from byte offset on, one chunk
+    # per transaction. progress(count, offset) is called after each chunk.
+    # Returns the same.
+    count = 0
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            lines = list(itertools.islice(f, chunk))
+            if not lines:
+                break
+            with db.batch():
+                for line in lines:
+                    _put(db, json.loads(line))
+            count += len(lines)
+            offset += sum(map(len, lines))
+            if progress is not None:
+                progress(count, offset)
+    return count, offset
+
+
+def _put(db, record):
+    doc = dict(record['doc'])
+    if record['bucket'] == 'users':
+        db.put('users', doc, key='email')
+        return
+    doc.pop('turn_count', None)
+    doc['turns'] = [{key: value for key, value in turn.items() if key != 'ply'}
+                    for turn in history.decode(record['turns'])]
+    db.put('games', doc)
+
+
+def export_columns(db, directory, resume=False, chunk=CHUNK):
+    # Returns the number of rows in the columns
+    os.makedirs(directory, exist_ok=True)
+    meta_path = os.path.join(directory, 'columns.json')
+    meta = {'rows': 0, 'games_size': 0, 'games': 0, 'after': None,
+            'columns': {name: dtype for name, dtype, _ in COLUMNS}}
+    if resume and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+    # Anything written after columns.json was last saved is dropped
+    files = {}
+    for name, dtype, width in COLUMNS + (('games', 'txt', None),):
+        path = os.path.join(directory, '{}.{}'.format(name, dtype))
+        with open(path, 'ab') as f:
+            f.truncate(meta['games_size'] if width is None else meta['rows'] * width)
+        files[name] = open(path, 'ab')
+    try:
+        cursor = meta['after']
+        while True:
+            rows = db.scan('games', after=cursor, limit=chunk)
+            for cursor, doc in rows:
+                game_id = json.dumps(doc['_id']) + '\n'
+                files['games'].write(game_id.encode('utf8'))
+                meta['rows'] += _write_positions(files, meta['games'], db.get_turns(doc))
+                meta['games'] += 1
+            for f in files.values():
+                f.flush()
+            meta['games_size'] = files['games'].tell()
+            meta['after'] = cursor
+            with open(meta_path + '.tmp', 'w') as f:
+                json.dump(meta, f)
+            os.replace(meta_path + '.tmp', meta_path)
+            if len(rows) < chunk:
+                break
+    finally:
+        for f in files.values():
+            f.close()
+    return meta['rows']
+
+
+def _write_positions(files, game, turns):
+    # A row for each turn after the first: the board it was played on and
+    # its moves. Returns the number written.
+    count = 0
+    for ply in range(1, len(turns)):
+        before, turn = turns[ply - 1], turns[ply]
+        try:
+            compact.encode_board(before['board'])
+            moves = compact.encode_moves(turn.get('moves') or [])
+        except (ValueError, AttributeError, TypeError, KeyError):
+            # Boards the codec doesn't know aren't positions batch.py can use
+            continue
+        if len(moves) > 6:
+            continue
+        board = before['board']
+        anchor = board['anchor']
+        files['game'].write(struct.pack('<I', game))
+        files['ply'].write(struct.pack('<H', ply))
+        files['squares'].write(bytes(board[name] for name in PIECE_ORDER))
+        files['anchor'].write(struct.pack('<b', -1 if anchor is None else anchor))
+        # A turn's stage is the stage after it, so says who moves next
+        files['white'].write(b'\x01' if str(before.get('gameStage')).lower().startswith('white') else b'\x00')
+        files['move'].write(moves.encode('ascii').ljust(6, b'\0'))
+        count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export')
+    export.add_argument('--db', default=os.environ.get('PUSHFIGHT_DB', 'db.sqlite3'))
+    target = export.add_mutually_exclusive_group(required=True)
+    target.add_argument('--out', help='newline delimited JSON file')
+    target.add_argument('--columns', metavar='DIR', help='directory for column files of positions')
+    export.add_argument('--compact', action='store_true', help='compact boards and moves')
+    export.add_argument('--resume', action='store_true', help='carry on an interrupted export')
+    export.add_argument('--chunk', type=int, default=CHUNK)
+    load = commands.add_parser('import')
+    load.add_argument('--db', default=os.environ.get('PUSHFIGHT_DB', 'db.sqlite3'))
+    load.add_argument('--in', dest='path', required=True)
+    load.add_argument('--offset', type=int, default=0, help='byte offset to start from')
+    load.add_argument('--chunk', type=int, default=CHUNK)
+    args = parser.parse_args(argv)
+
+    db = open_db(args.db)
+    try:
+        if args.command == 'import':
+            def progress(count, offset):
+                print('{} imported, --offset {}'.format(count, offset), file=sys.stderr)
+            import_ndjson(db, args.path, args.offset, args.chunk, progress)
+        elif args.columns:
+            print('{} positions'.format(export_columns(db, args.columns, args.resume, args.chunk)))
+        else:
+            print('{} records'.format(export_ndjson(db, args.out, args.compact, args.resume, args.chunk)))
+    finally:
+        close = getattr(db, 'close', None)
+        if close is not None:
+            close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+"""Live games held in memory in front of the storage backend.
+
+GameCache wraps a db_interface backend and keeps recently used games,
+their header and latest turn, in an LRU. Status reads are served from it
+without touching the backend. Turns appended through it are written to a
+local journal first, kept in memory and passed to the backend in batches
+by a flusher thread every flush_interval seconds, or straight away when
+the move ends the game. Each flush starts a new journal file and deletes
+the one before once its turns are in the backend, so the journal stays
+small however busy the server is. If the process dies in between, both
+are replayed into the backend the next time a GameCache is opened on them.
+With no flush_interval turns are written through.
+
+A game's version is its turn_count, and append_turn only succeeds if the
+header it was given is at the current version, as with the backends.
+Everything except games passes straight through. This assumes it is the
+only writer of games to the backend.
+"""
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from db_interface import Base, Conflict
+
+# Stages after which a game doesn't change
+FINISHED = ('whiteWon', 'blackWon', 'draw')
+# Added to the journal's path for the file a flush is writing out
+ROTATED = '.old'
+
+log = logging.getLogger('pushfight.gamecache')
+
+
+class _Entry(object):
+    __slots__ = ('header', 'latest', 'pending')
+
+    def __init__(self, header, latest):
+        self.header = header
+        self.latest = latest
+        # (ply, turn, header fields) not yet in the backend, oldest first
+        self.pending = []
+
+
+class GameCache(Base):
+    def __init__(self, backend, maxsize=10000, flush_interval=0.5, journal=None):
+        self.backend = backend
+        self.maxsize = maxsize
+        self.flush_interval = flush_interval
+        self.hits = 0
+        self.misses = 0
+        # Guards the entries. Held only for in-memory work, backend reads
+        # and the journal are done outside it.
+        self._lock = threading.Lock()
+        # Keeps flushes in order, so a game's turns reach the backend in order
+        self._flush_lock = threading.Lock()
+        # Keeps journal records in the order their turns were appended.
+        # Taken before _lock, never while holding it.
+        self._journal_lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._dirty = set()
+        # Bumped whenever put or delete drops an entry, so a load that read
+        # the backend before the write doesn't cache what it read
+        self._generation = 0
+        self._journal = None
+        self._journal_path = journal
+        if journal is not None:
+            self._replay()
+            self._journal = open(journal, 'a')
+        self._closed = threading.Event()
+        self._flusher = None
+        if flush_interval:
+            self._flusher = threading.Thread(target=self._flush_loop, name='game-flush', daemon=True)
+            self._flusher.start()
+
+    def _replay(self):
+        # The rotated file holds the older turns
+        rotated = self._journal_path + ROTATED
+        for path in (rotated, self._journal_path):
+            if not os.path.exists(path):
+                continue
+            with open(path) as f:
+                for line in f:
+                    try:
+                        game_id, ply, turn, fields = json.loads(line)
+                    except ValueError:
+                        # A record cut short when the process died
+                        break
+                    found = self.backend.find('games', game_id)
+                    if found and self.backend.turn_count(found[0]) == ply:
+                        self.backend.append_turn(found[0], turn, **fields)
+        if os.path.exists(self._journal_path):
+            os.truncate(self._journal_path, 0)
+        if os.path.exists(rotated):
+            os.remove(rotated)
+
+    # Games
+
+    def _load(self, game_id):
+        # The entry for game_id, from the backend if it isn't cached. Call
+        # without the lock; the backend is read outside it so one game's
+        # miss doesn't hold up the others.
+        while True:
+            with self._lock:
+                entry = self._entries.get(game_id)
+                if entry is not None:
+                    self._entries.move_to_end(game_id)
+                    self.hits += 1
+                    return entry
+                self.misses += 1
+                generation = self._generation
+            found = self.backend.find('games', game_id)
+            if not found:
+                return None
+            header = dict(found[0])
+            header.pop('turns', None)
+            header['turn_count'] = self.backend.turn_count(found[0])
+            loaded = _Entry(header, self.backend.latest_turn(found[0]))
+            with self._lock:
+                entry = self._entries.get(game_id)
+                if entry is not None:
+                    # Another thread loaded it meanwhile
+                    return entry
+                if generation == self._generation:
+                    # Room is made first so the new entry isn't the one evicted
+                    self._evict(room=1)
+                    self._entries[game_id] = loaded
+                    return loaded
+            # A put or delete happened while reading, what was read may be old
+
+    def _evict(self, room=0):
+        # Drops the least recently used games that have nothing to flush
+        excess = len(self._entries) + room - self.maxsize
+        if excess <= 0:
+            return
+        victims = []
+        for game_id in self._entries:
+            if game_id not in self._dirty:
+                victims.append(game_id)
+                if len(victims) == excess:
+                    break
+        for game_id in victims:
+            del self._entries[game_id]
+
+    def _overlay(self, docs):
+        # Backend headers of cached games can be behind by the unflushed turns
+        with self._lock:
+            return [dict(self._entries[doc['_id']].header) if doc.get('_id') in self._entries else doc
+                    for doc in docs]
+
+    def get(self, bucket, key):
+        return self.find(bucket, key)
+
+    def find(self, bucket, value, key=None):
+        if bucket != 'games' or key not in (None, '_id'):
+            found = self.backend.find(bucket, value, key)
+            return self._overlay(found) if bucket == 'games' else found
+        entry = self._load(value)
+        if entry is None:
+            return []
+        with self._lock:
+            return [dict(entry.header)]
+
+    def find_any(self, bucket, value, keys):
+        found = self.backend.find_any(bucket, value, keys)
+        return self._overlay(found) if bucket == 'games' else found
+
+    def find_page(self, bucket, value, keys, after=None, limit=20):
+        docs, after = self.backend.find_page(bucket, value, keys, after=after, limit=limit)
+        return (self._overlay(docs) if bucket == 'games' else docs), after
+
+    def put(self, bucket, value, key='_id'):
+        if bucket != 'games':
+            return self.backend.put(bucket, value, key)
+        # Writes through, after any turns still waiting
+        self.flush()
+        doc = self.backend.put(bucket, value, key)
+        with self._lock:
+            self._entries.pop(doc['_id'], None)
+            self._generation += 1
+        return doc
+
+    def delete(self, bucket, key):
+        if bucket == 'games':
+            self.flush()
+            with self._lock:
+                self._entries.pop(key, None)
+                self._generation += 1
+        self.backend.delete(bucket, key)
+        if bucket == 'games':
+            with self._lock:
+                self._generation += 1
+
+    # Turns
+
+    def append_turn(self, game, turn, **fields):
+        game_id = game['_id']
+        header = None
+        while header is None:
+            # Loaded before taking the journal lock, so a miss on one game
+            # doesn't hold up moves on the others
+            if self._load(game_id) is None:
+                raise KeyError(game_id)
+            with self._journal_lock:
+                with self._lock:
+                    entry = self._entries.get(game_id)
+                    if entry is None:
+                        # Evicted since it was loaded
+                        continue
+                    ply = entry.header['turn_count']
+                    if self.turn_count(game) != ply:
+                        raise Conflict
+                    entry.pending.append((ply, turn, fields))
+                    entry.header.update(fields)
+                    entry.header['turn_count'] = ply + 1
+                    entry.latest = turn
+                    self._dirty.add(game_id)
+                    header = dict(entry.header)
+                if self._journal is not None:
+                    self._journal.write(json.dumps([game_id, ply, turn, fields]) + '\n')
+                    self._journal.flush()
+                    os.fsync(self._journal.fileno())
+        if turn.get('gameStage') in FINISHED or not self.flush_interval:
+            self.flush()
+            with self._lock:
+                if game_id not in self._dirty:
+                    self._entries.pop(game_id, None)
+        return header
+
+    def latest_turn(self, game):
+        if 'turns' in game:
+            return game['turns'][-1]
+        entry = self._load(game['_id'])
+        if entry is None:
+            return None
+        with self._lock:
+            return entry.latest
+
+    def get_turns(self, game, start=0, limit=None):
+        # Turns from the first pending one on are taken from the entry, the
+        # ones before it from the backend, which a flush meanwhile can only
+        # have added to
+        with self._lock:
+            entry = self._entries.get(game['_id'])
+            pending = list(entry.pending) if entry is not None else []
+        if not pending or 'turns' in game:
+            return self.backend.get_turns(game, start, limit)
+        end = None if limit is None else start + limit
+        stored = pending[0][0] if end is None else min(end, pending[0][0])
+        turns = self.backend.get_turns(game, start, stored - start) if start < stored else []
+        turns.extend(turn for ply, turn, _ in pending if ply >= start and (end is None or ply < end))
+        return turns
+
+    # Writing behind
+
+    def flush(self):
+        with self._flush_lock:
+            # Turns appended from here on go to a new journal file, the
+            # rotated one only holds turns in work
+            with self._journal_lock:
+                with self._lock:
+                    work = [(game_id, list(self._entries[game_id].pending)) for game_id in self._dirty]
+                self._rotate()
+            for game_id, pending in work:
+                for ply, turn, fields in pending:
+                    header = {'_id': game_id, 'turn_count': ply}
+                    self.backend.append_turn(header, turn, **fields)
+                    with self._lock:
+                        entry = self._entries[game_id]
+                        entry.pending.pop(0)
+                        if not entry.pending:
+                            self._dirty.discard(game_id)
+            with self._lock:
+                self._evict()
+            if self._journal_path is not None and os.path.exists(self._journal_path + ROTATED):
+                os.remove(self._journal_path + ROTATED)
+
+    def _rotate(self):
+        # Call with _journal_lock held. After a failed flush the rotated
+        # file is kept, with its turns still in work, until one succeeds.
+        if self._journal is None or not self._journal.tell():
+            return
+        rotated = self._journal_path + ROTATED
+        if os.path.exists(rotated):
+            return
+        self._journal.close()
+        os.replace(self._journal_path, rotated)
+        self._journal = open(self._journal_path, 'a')
+        _sync_dir(self._journal_path)
+
+    def _flush_loop(self):
+        failures = 0
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                # Left pending and journalled, tried again next interval.
+                # Logged once per run of failures rather than every interval.
+                if not failures:
+                    log.exception('Flushing turns to the backend failed, %d games waiting', len(self._dirty))
+                failures += 1
+            else:
+                if failures:
+                    log.warning('Flushed turns after %d failed attempts', failures)
+                failures = 0
+
+    def close(self):
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def info(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "dirty": len(self._dirty),
+            }
+
+
+def _sync_dir(path):
+    # So a rename in path's directory survives a crash
+    fd = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,161 @@
+"""The shape of the push fight board, precomputed at import time.
+
+This is the one definition of the asymmetric board described in the
+README. Squares are numbered ``10*row + col`` on the 4x10 grid, which also
+holds the off board squares a piece can be pushed onto. Above row 0 and
+below row 3 are the rails, which block pushes.
+
+Run ``python geometry.py > pushfight-viz/src/Pushfight/Geometry.elm`` to
+regenerate the client's copy (``make`` does this).
+"""
+
+ROWS = 4
+COLS = 10
+NSQUARES = ROWS * COLS
+RAIL = -1
+
+# Playable columns [lo, hi) of each row. (0, 2) is off the board, which
+# makes (3, 7) off too, while (0, 7) and (3, 2) are on.
+ROW_SPANS = ((3, 8), (1, 9), (1, 9), (2, 7))
+
+# Same order as pushfight._CARDINAL_DIRS
+DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+STEPS = tuple(COLS * dr + dc for dr, dc in DIRECTIONS)
+UP, DOWN, LEFT, RIGHT = range(len(DIRECTIONS))
+
+
+def square(row, col):
+    return COLS * row + col
+
+
+def coords(sq):
+    return divmod(sq, COLS)
+
+
+FULL = (1 << NSQUARES) - 1
+
+IS_ONBOARD = tuple(
+    ROW_SPANS[row][0] <= col < ROW_SPANS[row][1]
+    for row, col in map(coords, range(NSQUARES))
+)
+ONBOARD = sum(1 << sq for sq in range(NSQUARES) if IS_ONBOARD[sq])
+OFFBOARD = FULL & ~ONBOARD
+
+
+def _gen_next_square_table(dr, dc):
+    # The square a piece on sq lands on when pushed in (dr, dc). Pushing
+    # off the top or bottom edge hits the rail and is not allowed.
+    table = []
+    for sq in range(NSQUARES):
+        row, col = coords(sq)
+        row, col = row + dr, col + dc
+        if 0 <= row < ROWS and 0 <= col < COLS:
+            table.append(square(row, col))
+        else:
+            table.append(RAIL)
+    return tuple(table)
+
+
+NEXT_SQUARE = tuple(_gen_next_square_table(dr, dc) for dr, dc in DIRECTIONS)
+
+# On board squares next to each square, in DIRECTIONS order
+NEIGHBOURS = tuple(
+    tuple(nxt[sq] for nxt in NEXT_SQUARE if nxt[sq] != RAIL and IS_ONBOARD[nxt[sq]])
+    for sq in range(NSQUARES)
+)
+
+# On board squares with the rail directly above or below
+RAIL_ABOVE = tuple(sq for sq in range(NSQUARES) if IS_ONBOARD[sq] and NEXT_SQUARE[UP][sq] == RAIL)
+RAIL_BELOW = tuple(sq for sq in range(NSQUARES) if IS_ONBOARD[sq] and NEXT_SQUARE[DOWN][sq] == RAIL)
+
+# On board squares a piece can be pushed off from
+EDGE = sum(
+    1 << sq
+    for sq in range(NSQUARES)
+    if IS_ONBOARD[sq] and any(
+        nxt[sq] != RAIL and not IS_ONBOARD[nxt[sq]] for nxt in NEXT_SQUARE)
+)
+
+
+def _gen_ray(direction, sq):
+    ray = []
+    target = NEXT_SQUARE[direction][sq]
+    while target != RAIL:
+        ray.append(target)
+        target = NEXT_SQUARE[direction][target]
+    return tuple(ray)
+
+
+# PUSH_RAYS[direction][sq] is every square past sq in direction, up to the
+# rail or the edge of the grid. PUSH_CHAINS[direction][sq][i] is the mask
+# of the pieces that move when a piece on sq pushes a line that ends just
+# before PUSH_RAYS[direction][sq][i].
+PUSH_RAYS = tuple(
+    tuple(_gen_ray(direction, sq) for sq in range(NSQUARES))
+    for direction in range(len(DIRECTIONS))
+)
+
+
+def _gen_chains(sq, ray):
+    chains = []
+    chain = 1 << sq
+    for target in ray:
+        chains.append(chain)
+        chain |= 1 << target
+    return tuple(chains)
+
+
+PUSH_CHAINS = tuple(
+    tuple(_gen_chains(sq, rays[sq]) for sq in range(NSQUARES))
+    for rays in PUSH_RAYS
+)
+
+
+def _elm_list(squares):
+    return '[ ' + ', '.join(str(sq) for sq in squares) + ' ]'
+
+
+def elm_module():
+    on_board = [sq for sq in range(NSQUARES) if IS_ONBOARD[sq]]
+    return '''module Pushfight.Geometry exposing (isInBoard, isRailAbove, isRailBelow)
+
+-- Generated by geometry.py, do not edit
+
+
+onBoard : List Int
+onBoard =
+    {on_board}
+
+
+railAbove : List Int
+railAbove =
+    {rail_above}
+
+
+railBelow : List Int
+railBelow =
+    {rail_below}
+
+
+isInBoard : Int -> Bool
+isInBoard at =
+    List.member at onBoard
+
+
+isRailAbove : Int -> Bool
+isRailAbove at =
+    List.member at railAbove
+
+
+isRailBelow : Int -> Bool
+isRailBelow at =
+    List.member at railBelow
+'''.format(
+        on_board=_elm_list(on_board),
+        rail_above=_elm_list(RAIL_ABOVE),
+        rail_below=_elm_list(RAIL_BELOW),
+    )
+
+
+if __name__ == '__main__':
+    print(elm_module(), end='')
@@ -0,0 +1,90 @@
+"""Game histories as a starting board and the moves of each turn.
+
+Stored turns each carry the whole board. A history instead sends a record
+per turn that holds its stage and moves, and boards only where they're
+needed: on the first record, on every CHECKPOINT_EVERY'th ply, and on any
+turn whose moves don't replay to its board (setup placements, or moves a
+client recorded oddly). Replaying the moves through pushfight.apply_turn
+rebuilds the rest, so decode(encode(turns)) gives back the turns, each
+with its ply.
+
+Records are dicts, one per ply from start:
+
+    {'ply': 0, 'gameStage': 'whitesetup', 'moves': [], 'board': {...}}
+    {'ply': 5, 'gameStage': 'blackTurn', 'moves': [...]}
+
+With packed=True boards and moves are compact.py strings. Both functions
+are generators, so a history can be streamed as JSON lines.
+"""
+import compact
+from pushfight import apply_turn
+
+# A board is sent at least this often, so turn_at replays at most this
+# many turns
+CHECKPOINT_EVERY = 16
+
+
+def play(board, moves):
+    # The board after moves, each {'from': square, 'to': square}. A move
+    # onto an occupied square is the push. Raises ValueError if a move
+    # doesn't start from a piece.
+    board = dict(board)
+    for move in moves:
+        frm, to = move['from'], move['to']
+        at = {sq: name for name, sq in board.items() if name != 'anchor'}
+        if frm not in at:
+            raise ValueError("No piece on {}".format(frm))
+        if to in at:
+            board = apply_turn(board, [], (frm, to))
+        else:
+            board[at[frm]] = to
+    return board
+
+
+def _replays(board, turn):
+    try:
+        return play(board, turn['moves'] or []) == turn['board']
+    except (ValueError, KeyError, TypeError):
+        return False
+
+
+def encode(turns, start=0, packed=False, checkpoint_every=CHECKPOINT_EVERY, first=0):
+    # Records for the turns from ply start on. turns can be any iterable of
+    # stored turns, the first of them at ply first.
+    board = None
+    for ply, turn in enumerate(turns, first):
+        if ply < start:
+            board = turn.get('board')
+            continue
+        record = {'ply': ply, 'gameStage': turn.get('gameStage'), 'moves': turn.get('moves')}
+        if ply == start or ply % checkpoint_every == 0 or not _replays(board, turn):
+            record['board'] = turn.get('board')
+        board = turn.get('board')
+        yield compact.pack_turn(record) if packed else record
+
+
+def decode(records):
+    # Turns, {'ply', 'gameStage', 'moves', 'board'}, rebuilt from records
+    board = None
+    for record in records:
+        record = compact.unpack_turn(record)
+        if 'board' in record:
+            board = record['board']
+        elif board is None:
+            raise ValueError("History doesn't start with a board")
+        else:
+            board = play(board, record['moves'] or [])
+        yield dict(record, board=board)
+
+
+def turn_at(records, ply):
+    # The turn at ply from a list of records starting at ply 0, replaying
+    # from the nearest board before it
+    if not 0 <= ply < len(records):
+        raise IndexError(ply)
+    first = ply
+    while 'board' not in records[first]:
+        first -= 1
+    for turn in decode(records[first:ply + 1]):
+        pass
+    return turn
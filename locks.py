@@ -0,0 +1,37 @@
+"""Locks held per key, such as a game id.
+
+A request that reads a game, checks a move against it and writes it back
+holds that game's lock throughout, so two moves on one game can't
+interleave while moves on different games don't wait on each other. A
+key's lock only exists while someone holds it or is waiting for it.
+"""
+import contextlib
+import threading
+
+
+class KeyedLocks(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> [lock, number of threads holding or waiting on it]
+        self._locks = {}
+
+    @contextlib.contextmanager
+    def hold(self, key):
+        with self._lock:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+    def __len__(self):
+        # Number of keys held or waited on
+        with self._lock:
+            return len(self._locks)
@@ -0,0 +1,212 @@
+"""Request and hot path metrics, served in the Prometheus text format.
+
+A Registry holds counters and histograms, each with a fixed set of label
+names, plus collectors that read numbers other modules already keep (the
+info() of the password pool, token cache and game cache) when /metrics
+is scraped. Plugin is a bottle plugin that times every route and counts
+responses by status. TimedDB wraps a db_interface backend and times each
+storage operation.
+
+Observing a value takes a lock and a bisect, a microsecond or so, so it's
+cheap enough for every request and every database call.
+"""
+import bisect
+import contextlib
+import threading
+import time
+
+import bottle
+
+# Seconds. Requests, engine searches and bcrypt
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Database calls and Fernet, mostly well under a millisecond
+FAST_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 1.0)
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in pairs) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def render(self):
+        yield '# HELP {} {}'.format(self.name, self.help)
+        yield '# TYPE {} counter'.format(self.name)
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield '{}{} {}'.format(self.name, _labels(self.labels, labels), _number(value))
+
+
+class Histogram(object):
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # label values -> [count in each bucket and one past the last, sum]
+        self._series = {}
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    @contextlib.contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def count(self, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            return sum(series[0]) if series else 0
+
+    def render(self):
+        yield '# HELP {} {}'.format(self.name, self.help)
+        yield '# TYPE {} histogram'.format(self.name)
+        with self._lock:
+            series = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield '{}_bucket{} {}'.format(
+                    self.name, _labels(self.labels, labels, [('le', _number(bound))]), cumulative)
+            yield '{}_sum{} {}'.format(self.name, _labels(self.labels, labels), _number(total))
+            yield '{}_count{} {}'.format(self.name, _labels(self.labels, labels), cumulative)
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collect_info(self, prefix, info, help):
+        # Gauges for the numbers in the dict info() returns, nested dicts
+        # flattened with '_', read at each scrape
+        self._collectors.append((prefix, info, help))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, info, help in self._collectors:
+            for name, value in _flatten(prefix, info()):
+                lines.append('# HELP {} {}'.format(name, help))
+                lines.append('# TYPE {} gauge'.format(name))
+                lines.append('{} {}'.format(name, _number(value)))
+        return '\n'.join(lines) + '\n'
+
+
+def _flatten(prefix, info):
+    for key, value in sorted(info.items()):
+        name = '{}_{}'.format(prefix, key)
+        if isinstance(value, dict):
+            yield from _flatten(name, value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+class Plugin(object):
+    # Times each route and counts its responses by status. A long poll the
+    # async server suspends is recorded once, when it's finally answered,
+    # with the wait included.
+    name = 'metrics'
+    api = 2
+
+    def __init__(self, latency, responses):
+        self.latency = latency
+        self.responses = responses
+
+    def apply(self, callback, route):
+        method, rule = route.method, route.rule
+
+        def wrapper(*args, **kwargs):
+            environ = bottle.request.environ
+            start = environ.setdefault('pushfight.start', time.perf_counter())
+            status = 500
+            try:
+                result = callback(*args, **kwargs)
+                # static_file returns its errors rather than raising them
+                status = (result if isinstance(result, bottle.HTTPResponse) else bottle.response).status_code
+                return result
+            except bottle.HTTPResponse as e:
+                status = e.status_code
+                raise
+            finally:
+                if not environ.get('pushfight.suspended'):
+                    self.latency.observe(time.perf_counter() - start, method, rule)
+                    self.responses.inc(method, rule, str(status))
+        return wrapper
+
+
+class TimedDB(object):
+    # Passes everything through to db, timing the storage operations
+    OPERATIONS = ('get', 'put', 'delete', 'find', 'find_any', 'find_page', 'scan',
+                  'append_turn', 'latest_turn', 'get_turns')
+
+    def __init__(self, db, histogram):
+        self.db = db
+        self.histogram = histogram
+
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if name not in self.OPERATIONS:
+            return attr
+        histogram = self.histogram
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, name)
+        # Made once per operation
+        setattr(self, name, timed)
+        return timed
@@ -0,0 +1,73 @@
+"""In-process notifications of changes to games.
+
+A game's version is its turn count. /1/move publishes the new version
+after appending a turn, and long-polling /1/game/status requests wait
+here until a game passes the version they last saw.
+"""
+import threading
+
+
+class GameEvents(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        # game_id -> [condition, waiter count, latest published version].
+        # Only games someone is waiting on have an entry.
+        self._games = {}
+        # game_id -> callbacks added with watch()
+        self._watchers = {}
+
+    def publish(self, game_id, version):
+        with self._lock:
+            watchers = list(self._watchers.get(game_id, ()))
+            entry = self._games.get(game_id)
+            if entry is not None:
+                if entry[2] is None or version > entry[2]:
+                    entry[2] = version
+                entry[0].notify_all()
+        for callback in watchers:
+            callback(version)
+
+    def watch(self, game_id, callback):
+        # Calls callback(version) on every publish for game_id, on the
+        # publishing thread, until the returned function is called
+        with self._lock:
+            self._watchers.setdefault(game_id, []).append(callback)
+
+        def unwatch():
+            with self._lock:
+                callbacks = self._watchers.get(game_id, [])
+                if callback in callbacks:
+                    callbacks.remove(callback)
+                if not callbacks:
+                    self._watchers.pop(game_id, None)
+        return unwatch
+
+    def wait(self, game_id, after, timeout, current=None):
+        # Blocks until a version newer than after is published for game_id
+        # or timeout seconds pass, and returns whether one was. current()
+        # is checked after registering, so a version stored just before the
+        # wait began isn't missed.
+        with self._lock:
+            entry = self._games.get(game_id)
+            if entry is None:
+                # Conditions share the one lock, notify only wakes their game
+                entry = self._games[game_id] = [threading.Condition(self._lock), 0, None]
+            entry[1] += 1
+        try:
+            if current is not None:
+                version = current()
+                if version is not None and version > after:
+                    return True
+            with self._lock:
+                return entry[0].wait_for(lambda: entry[2] is not None and entry[2] > after, timeout)
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._games[game_id]
+
+    def waiting(self):
+        # Number of requests waiting, across all games
+        with self._lock:
+            return (sum(entry[1] for entry in self._games.values())
+                    + sum(len(callbacks) for callbacks in self._watchers.values()))
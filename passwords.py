@@ -0,0 +1,109 @@
+"""Password hashing off the request threads.
+
+bcrypt is deliberately slow, so a burst of logins run on the request
+threads would leave none for game traffic. PasswordPool runs it on a few
+dedicated threads (bcrypt releases the GIL) and caps how much work can be
+waiting, overall and per account and per client address. Work over a cap
+is refused with Busy, which the server answers with 429.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import check_pw, hash_pw
+
+
+class Busy(Exception):
+    pass
+
+
+class _Timing(object):
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def info(self):
+        return {"count": self.count, "total": self.total, "max": self.max}
+
+
+class PasswordPool(object):
+    def __init__(self, workers=2, max_queue=6, per_account=2, per_ip=4, rounds=12):
+        # Callers wait for their hash, so workers + max_queue is also the
+        # most request threads that can be tied up in here
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        self.max_pending = workers + max_queue
+        self.per_account = per_account
+        self.per_ip = per_ip
+        self.rounds = rounds
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._accounts = {}
+        self._ips = {}
+        self.rejected = 0
+        self._queue_wait = _Timing()
+        self._hash_time = _Timing()
+
+    def hash(self, plaintext, account=None, ip=None):
+        return self._run(hash_pw, (plaintext, self.rounds), account, ip)
+
+    def check(self, password, hashed, account=None, ip=None):
+        return self._run(check_pw, (password, hashed), account, ip)
+
+    def _run(self, fn, args, account, ip):
+        with self._lock:
+            if (self._pending >= self.max_pending
+                    or self._accounts.get(account, 0) >= self.per_account
+                    or self._ips.get(ip, 0) >= self.per_ip):
+                self.rejected += 1
+                raise Busy
+            self._pending += 1
+            _incr(self._accounts, account)
+            _incr(self._ips, ip)
+        try:
+            return self._executor.submit(self._timed, fn, args, time.perf_counter()).result()
+        finally:
+            with self._lock:
+                self._pending -= 1
+                _decr(self._accounts, account)
+                _decr(self._ips, ip)
+
+    def _timed(self, fn, args, submitted):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            finished = time.perf_counter()
+            with self._lock:
+                self._queue_wait.add(started - submitted)
+                self._hash_time.add(finished - started)
+
+    def info(self):
+        with self._lock:
+            return {
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "rejected": self.rejected,
+                "queue_wait": self._queue_wait.info(),
+                "hash_time": self._hash_time.info(),
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def _incr(counts, key):
+    if key is not None:
+        counts[key] = counts.get(key, 0) + 1
+
+
+def _decr(counts, key):
+    if key is not None:
+        counts[key] -= 1
+        if not counts[key]:
+            del counts[key]
@@ -0,0 +1,154 @@
+"""A sampling profiler for requests on a live server.
+
+Profiler.plugin() is a bottle plugin that picks a fraction (rate) of
+requests to profile. While a picked request runs, a background thread
+looks at its stack every interval seconds through sys._current_frames()
+and counts it under the request's route. Requests that aren't picked only
+cost a random() call, and a picked one isn't slowed down at all apart from
+the GIL the sampler takes for a moment each tick. The rate can be changed
+at any time, 0 turns sampling off.
+
+collapsed() gives the counts in the collapsed stack format flamegraph.pl
+and speedscope read, one stack per line, root first:
+
+    GET /1/move;server.py:post_move;server.py:_move;gamecache.py:find 12
+"""
+import os
+import random
+import sys
+import threading
+
+# Seconds between samples
+INTERVAL = 0.01
+# Distinct stacks kept, after which new ones are counted as one
+MAX_STACKS = 20000
+OTHER = '[other]'
+
+
+class Profiler(object):
+    def __init__(self, rate=0.0, interval=INTERVAL, max_stacks=MAX_STACKS):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self._lock = threading.Lock()
+        # Thread ident -> (route, frame of the plugin's wrapper)
+        self._active = {}
+        # (route, stack) -> samples
+        self._counts = {}
+        self.requests = 0
+        self.samples = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self.rate = 0.0
+        self.set_rate(rate)
+
+    def set_rate(self, rate, interval=None):
+        # Starts the sampler thread if rate is above 0, stops it at 0
+        if not 0 <= rate <= 1:
+            raise ValueError("rate must be between 0 and 1")
+        with self._lock:
+            if interval is not None:
+                self.interval = interval
+            self.rate = rate
+            if rate and self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+                self._thread.start()
+            elif not rate and self._thread is not None:
+                self._stop.set()
+                self._thread = None
+
+    def plugin(self):
+        return Plugin(self)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+            self.requests = 0
+            self.samples = 0
+
+    def info(self):
+        with self._lock:
+            return {"rate": self.rate, "requests": self.requests, "samples": self.samples,
+                    "stacks": len(self._counts), "active": len(self._active)}
+
+    def collapsed(self, route=None):
+        # Lines of 'route;frame;frame count', most samples first
+        with self._lock:
+            counts = list(self._counts.items())
+        lines = ['{};{} {}'.format(r, stack, count) if stack else '{} {}'.format(r, count)
+                 for (r, stack), count in sorted(counts, key=lambda item: (-item[1], item[0]))
+                 if route is None or r == route]
+        return ''.join(line + '\n' for line in lines)
+
+    def _enter(self, route, frame):
+        ident = threading.get_ident()
+        with self._lock:
+            self._active[ident] = (route, frame)
+            self.requests += 1
+        return ident
+
+    def _exit(self, ident):
+        with self._lock:
+            self._active.pop(ident, None)
+
+    def _run(self):
+        stop = self._stop
+        while not stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        # Counts the stack of each request being profiled once
+        with self._lock:
+            active = list(self._active.items())
+        if not active:
+            return
+        frames = sys._current_frames()
+        stacks = []
+        for ident, (route, root) in active:
+            frame = frames.get(ident)
+            if frame is not None:
+                stacks.append((route, _collapse(frame, root)))
+        del frames
+        with self._lock:
+            for key in stacks:
+                if key not in self._counts and len(self._counts) >= self.max_stacks:
+                    key = (key[0], OTHER)
+                self._counts[key] = self._counts.get(key, 0) + 1
+                self.samples += 1
+
+
+def _collapse(frame, root):
+    # 'file:function' for each frame above root, outermost first
+    names = []
+    while frame is not None and frame is not root:
+        code = frame.f_code
+        names.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+        frame = frame.f_back
+    if frame is None:
+        # The request has returned past the wrapper since it was listed
+        return ''
+    names.reverse()
+    return ';'.join(names)
+
+
+class Plugin(object):
+    # Profiles rate of the requests to each route
+    name = 'profiler'
+    api = 2
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def apply(self, callback, route):
+        profiler = self.profiler
+        name = '{} {}'.format(route.method, route.rule)
+
+        def wrapper(*args, **kwargs):
+            if not profiler.rate or random.random() >= profiler.rate:
+                return callback(*args, **kwargs)
+            ident = profiler._enter(name, sys._getframe())
+            try:
+                return callback(*args, **kwargs)
+            finally:
+                profiler._exit(ident)
+        return wrapper
@@ -207,6 +207,7 @@ type alias GameInfo =
     , gameStage : GameStage
     , request : Request
     , board : Board
+    , version : Int
     }
 
 
@@ -245,12 +246,13 @@ encodeGameStart gc =
 
 gameInfoDecoder : Decoder GameInfo
 gameInfoDecoder =
-    Decode.map5 GameInfo
+    Decode.map6 GameInfo
         (Color.decode)
         (field "game" string)
         (GameStage.decode)
         (Request.decode)
-        (field "board" Board.decode)
+        (field "board" (Decode.oneOf [ Board.decodeCompact, Board.decode ]))
+        (Decode.oneOf [ field "version" Decode.int, Decode.succeed 0 ])
 
         --(field "color" Color.decode)
         --(field "game" string)
@@ -285,8 +287,8 @@ join gid msg cred =
 -- make move
 
 
-move : GameStage.GameStage -> Board.Board -> List Move.Move -> GameStage.GameStage -> Board.Board -> String -> Cred -> (Result Http.Error () -> msg) -> Cmd msg
-move startGameStage board moves finalGameStage finalBoard gameId cred msg =
+move : GameStage.GameStage -> Board.Board -> List Move.Move -> GameStage.GameStage -> Board.Board -> Maybe Int -> String -> Cred -> (Result Http.Error () -> msg) -> Cmd msg
+move startGameStage board moves finalGameStage finalBoard version gameId cred msg =
     let
         body =
             Encode.object
@@ -297,6 +299,7 @@ move startGameStage board moves finalGameStage finalBoard gameId cred msg =
                 , ( "finalGameStage", GameStage.encode finalGameStage )
                 , ( "gameId", Encode.string gameId )
                 , ( "timer", Encode.null )
+                , ( "version", Maybe.withDefault Encode.null (Maybe.map Encode.int version) )
                 ]
                 |> Http.jsonBody
     in
@@ -314,8 +317,8 @@ move startGameStage board moves finalGameStage finalBoard gameId cred msg =
 --    }
 
 
-status : String -> Cred -> (Result Http.Error GameInfo -> msg) -> Cmd msg
-status gameId cred msg =
+status : String -> Maybe Int -> Cred -> (Result Http.Error GameInfo -> msg) -> Cmd msg
+status gameId after cred msg =
     --let
     --    body =
     --        Encode.object [ ( "game", Encode.string gameId ) ] |> Http.jsonBody
@@ -324,7 +327,7 @@ status gameId cred msg =
 
 
 
-    get (Endpoint.gameStatus gameId) Http.emptyBody (Just cred) (Http.expectJson msg gameInfoDecoder)
+    get (Endpoint.gameStatus gameId after) Http.emptyBody (Just cred) (Http.expectJson msg gameInfoDecoder)
 -- PERSISTENCE
 
 
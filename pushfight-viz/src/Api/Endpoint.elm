@@ -79,10 +79,17 @@ gameJoin =
 
 gameStatus :
     String
+    -> Maybe Int
     -> Endpoint
-gameStatus uuid =
+gameStatus uuid after =
     --url [ "game", "status", uuid ] [] -- [ Url.Builder.string "game" uuid ]
-    url [ "game", "status" ] [ Url.Builder.string "game" uuid ]
+    case after of
+        Just version ->
+            -- Long poll: the server answers once the game is past version
+            url [ "game", "status" ] [ Url.Builder.string "game" uuid, Url.Builder.int "after" version, Url.Builder.string "format" "compact" ]
+
+        Nothing ->
+            url [ "game", "status" ] [ Url.Builder.string "game" uuid, Url.Builder.string "format" "compact" ]
 --gameStatus : Endpoint
 --gameStatus =
 --    url [ "game", "status" ] []
@@ -26,6 +26,11 @@ type alias Model =
 
     --, color : Color
     , game : LoadableGame
+
+    -- The last version of the game seen from the server, and whether a
+    -- status request is waiting on the next one
+    , version : Maybe Int
+    , polling : Bool
     }
 
 
@@ -36,12 +41,23 @@ type LoadableGame
 
 init : Session -> String -> ( Model, Cmd Msg )
 init session gameId =
-    ( { session = session
-      , gameId = gameId
-      , game = Loading
-      }
-    , Cmd.none
-    )
+    poll
+        { session = session
+        , gameId = gameId
+        , game = Loading
+        , version = Nothing
+        , polling = False
+        }
+
+
+poll : Model -> ( Model, Cmd Msg )
+poll model =
+    case Session.cred model.session of
+        Just cred ->
+            ( { model | polling = True }, Api.status model.gameId model.version cred GameFromServer )
+
+        Nothing ->
+            ( model, Cmd.none )
 
 
 
@@ -109,7 +125,7 @@ update msg model =
                                 SendTurnEnded ( finalBoard, finalGameStage ) ->
                                     case Session.cred model.session of
                                         Just cred ->
-                                            Api.move game.gameStage game.board game.moves finalGameStage finalBoard model.gameId cred MovePosted
+                                            Api.move game.gameStage game.board game.moves finalGameStage finalBoard model.version model.gameId cred MovePosted
 
                                         Nothing ->
                                             Cmd.none
@@ -134,12 +150,11 @@ update msg model =
         --GameFromServer _ ->
         --    ( model, Cmd.none )
         CheckServer _ ->
-            case Session.cred model.session of
-                Just cred ->
-                    ( model, Api.status model.gameId cred GameFromServer )
+            if model.polling then
+                ( model, Cmd.none )
 
-                Nothing ->
-                    ( model, Cmd.none )
+            else
+                poll model
 
         GameFromServer (Ok gameFromServer) ->
             let
@@ -155,7 +170,7 @@ update msg model =
                         Loading ->
                             Game.init gameFromServer.board gameFromServer.gameStage gameFromServer.color [] 50 Request.NoRequest
             in
-            ( { model | game = Loaded updatedGame }, Cmd.none )
+            poll { model | game = Loaded updatedGame, version = Just gameFromServer.version }
 
         --init : Board.Board -> GameStage -> Color -> List Move -> Int -> Request -> Model
         --type alias Model =
@@ -174,7 +189,7 @@ update msg model =
         --        }
         --( model,  )
         GameFromServer (Err error) ->
-            Debug.log (String.join " | " (Api.decodeErrors error)) ( model, Cmd.none )
+            Debug.log (String.join " | " (Api.decodeErrors error)) ( { model | polling = False }, Cmd.none )
 
 
 
@@ -188,7 +203,9 @@ subscriptions model =
     Sub.batch
         [ Session.changes GotSession (Session.navKey model.session)
         , Sub.map GotGameMsg Game.subscriptions
-        , Time.every 1000 CheckServer
+        -- Status requests chain as long polls, this only restarts them
+        -- after an error
+        , Time.every 5000 CheckServer
         ]
 
 
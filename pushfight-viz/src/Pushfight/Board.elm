@@ -1,8 +1,9 @@
-module Pushfight.Board exposing (Board, anchorAt, decode, encode, isBlackPiece, isWhitePiece, ixToXY, move, pieceOutOfBounds)
+module Pushfight.Board exposing (Board, anchorAt, decode, decodeCompact, encode, isBlackPiece, isWhitePiece, ixToXY, move, pieceOutOfBounds)
 
 import Json.Decode as Decode exposing (Decoder)
 import Json.Decode.Pipeline exposing (required)
 import Json.Encode as Encode
+import Pushfight.Geometry as Geometry
 import Set
 
 
@@ -219,11 +220,11 @@ isValidPush pos dir =
         in
         case ( dir, pos ) of
             ( Up, p :: ps ) ->
-                List.member p [ 3, 4, 5, 6, 7 ]
+                Geometry.isRailAbove p
                     |> not
 
             ( Down, p :: ps ) ->
-                List.member p [ 33, 34, 35, 36, 37 ]
+                Geometry.isRailBelow p
                     |> not
 
             _ ->
@@ -262,22 +263,8 @@ ixToXY ix =
 
 
 isInBoard : Int -> Bool
-isInBoard at =
-    let
-        ( x, y ) =
-            ixToXY at
-    in
-    if y == 0 then
-        2 < x && x < 8
-
-    else if y == 1 || y == 2 then
-        0 < x && x < 9
-
-    else if y == 3 then
-        1 < x && x < 7
-
-    else
-        False
+isInBoard =
+    Geometry.isInBoard
 
 
 pieceOutOfBounds : Board -> Bool
@@ -418,3 +405,40 @@ decode =
         |> required "bm1" Decode.int
         |> required "bm2" Decode.int
         |> required "anchor" (Decode.nullable Decode.int)
+
+
+{-| The server's compact board, one character per square (chr (48 + square))
+for wp1 wp2 wp3 wm1 wm2 bp1 bp2 bp3 bm1 bm2 and then the anchor, '.' for none
+-}
+decodeCompact : Decoder Board
+decodeCompact =
+    let
+        square c =
+            Char.toCode c - 48
+
+        fromString text =
+            case String.toList text of
+                [ wp1, wp2, wp3, wm1, wm2, bp1, bp2, bp3, bm1, bm2, anchor ] ->
+                    Decode.succeed
+                        (Board (square wp1)
+                            (square wp2)
+                            (square wp3)
+                            (square wm1)
+                            (square wm2)
+                            (square bp1)
+                            (square bp2)
+                            (square bp3)
+                            (square bm1)
+                            (square bm2)
+                            (if anchor == '.' then
+                                Nothing
+
+                             else
+                                Just (square anchor)
+                            )
+                        )
+
+                _ ->
+                    Decode.fail ("Bad compact board " ++ text)
+    in
+    Decode.string |> Decode.andThen fromString
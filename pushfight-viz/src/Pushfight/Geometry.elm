@@ -0,0 +1,33 @@
+module Pushfight.Geometry exposing (isInBoard, isRailAbove, isRailBelow)
+
+-- Generated by geometry.py, do not edit
+
+
+onBoard : List Int
+onBoard =
+    [ 3, 4, 5, 6, 7, 11, 12, 13, 14, 15, 16, 17, 18, 21, 22, 23, 24, 25, 26, 27, 28, 32, 33, 34, 35, 36 ]
+
+
+railAbove : List Int
+railAbove =
+    [ 3, 4, 5, 6, 7 ]
+
+
+railBelow : List Int
+railBelow =
+    [ 32, 33, 34, 35, 36 ]
+
+
+isInBoard : Int -> Bool
+isInBoard at =
+    List.member at onBoard
+
+
+isRailAbove : Int -> Bool
+isRailAbove at =
+    List.member at railAbove
+
+
+isRailBelow : Int -> Bool
+isRailBelow at =
+    List.member at railBelow
@@ -1,92 +1,202 @@
+import threading
+from collections import OrderedDict
+
+import bitboard
+import geometry
+
+
+PIECE_ORDER = tuple(name for names in bitboard.PIECE_NAMES for name in names)
+_PIECE_GROUPS = ((0, 3), (3, 5), (5, 8), (8, 10))
+_SQUARE_BITS = 6
+_SQUARE_MASK = (1 << _SQUARE_BITS) - 1
+_ANCHOR_SHIFT = _SQUARE_BITS * len(PIECE_ORDER)
+_TURN_SHIFT = _ANCHOR_SHIFT + _SQUARE_BITS
+
+
+class Position(object):
+    # An immutable position packed into a single int: six bits for each
+    # piece's square in PIECE_ORDER, then the anchor square plus one (zero
+    # for no anchor) and the side to move. The hash is computed once, and
+    # equality is a single int comparison.
+    __slots__ = ('packed', '_hash')
+
+    def __init__(self, packed):
+        object.__setattr__(self, 'packed', packed)
+        object.__setattr__(self, '_hash', hash(packed))
+
+    @classmethod
+    def from_squares(cls, squares, anchor, is_whites_turn):
+        packed = 0
+        for i, sq in enumerate(squares):
+            if not 0 <= sq < bitboard.NSQUARES:
+                raise ValueError("No such square {}".format(sq))
+            packed |= sq << _SQUARE_BITS * i
+        if anchor is not None:
+            if not 0 <= anchor < bitboard.NSQUARES:
+                raise ValueError("No such square {}".format(anchor))
+            packed |= (anchor + 1) << _ANCHOR_SHIFT
+        packed |= bool(is_whites_turn) << _TURN_SHIFT
+        return cls(packed)
+
+    @classmethod
+    def from_pieces(cls, pieces, anchored, is_whites_turn):
+        squares = [bitboard.square(*pieces[name]) for name in PIECE_ORDER]
+        anchor = bitboard.square(*anchored) if anchored is not None else None
+        return cls.from_squares(squares, anchor, is_whites_turn)
+
+    @classmethod
+    def from_board(cls, board, is_whites_turn):
+        # The JSON board shape, {piece: 10*row + col, ..., 'anchor': square}
+        squares = [board[name] for name in PIECE_ORDER]
+        return cls.from_squares(squares, board.get('anchor'), is_whites_turn)
+
+    @classmethod
+    def from_state(cls, state):
+        squares = []
+        for kind in (bitboard.WP, bitboard.WM, bitboard.BP, bitboard.BM):
+            squares.extend(bitboard.bit_square(bit) for bit in bitboard.gen_bits(state[kind]))
+        return cls.from_squares(squares, state[bitboard.ANCHOR], state[bitboard.WHITE])
+
+    @property
+    def squares(self):
+        packed = self.packed
+        return tuple(packed >> _SQUARE_BITS * i & _SQUARE_MASK for i in range(len(PIECE_ORDER)))
+
+    @property
+    def anchor(self):
+        anchor = self.packed >> _ANCHOR_SHIFT & _SQUARE_MASK
+        return anchor - 1 if anchor else None
+
+    @property
+    def is_whites_turn(self):
+        return bool(self.packed >> _TURN_SHIFT)
+
+    @property
+    def pieces(self):
+        return {name: bitboard.coords(sq) for name, sq in zip(PIECE_ORDER, self.squares)}
+
+    @property
+    def state(self):
+        squares = self.squares
+        masks = []
+        for lo, hi in _PIECE_GROUPS:
+            mask = 0
+            for sq in squares[lo:hi]:
+                mask |= 1 << sq
+            masks.append(mask)
+        return tuple(masks) + (self.anchor, self.is_whites_turn)
+
+    def to_board(self):
+        board = dict(zip(PIECE_ORDER, self.squares))
+        board['anchor'] = self.anchor
+        return board
+
+    def canonical(self):
+        # Same type pieces are interchangeable, so order them by square
+        squares = self.squares
+        ordered = []
+        for lo, hi in _PIECE_GROUPS:
+            ordered.extend(sorted(squares[lo:hi]))
+        return Position.from_squares(ordered, self.anchor, self.is_whites_turn)
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if not isinstance(other, Position):
+            return NotImplemented
+        return self.packed == other.packed
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Position is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Position is immutable")
+
+    def __reduce__(self):
+        return (Position, (self.packed,))
+
+    def __repr__(self):
+        return 'Position({:#x})'.format(self.packed)
+
+
 class Board(object):
+    # A thin wrapper around a bitboard state, see bitboard.py
+    __slots__ = ('anchored', 'is_whites_turn', 'state', '_pieces', '_position')
+
     def __init__(self, pieces, anchored, is_whites_turn):
-        self.pieces = pieces
         self.anchored = anchored
         self.is_whites_turn = is_whites_turn
+        self.pieces = pieces
+
+    @classmethod
+    def from_state(cls, state):
+        board = cls.__new__(cls)
+        board.anchored = bitboard.anchored_coords(state)
+        board.is_whites_turn = state[bitboard.WHITE]
+        board._pieces = None
+        board._position = None
+        board.state = state
+        return board
+
+    @property
+    def pieces(self):
+        if self._pieces is None:
+            self._pieces = bitboard.to_pieces(self.state)
+        return self._pieces
+
+    @pieces.setter
+    def pieces(self, pieces):
+        self._pieces = pieces
+        self._position = None
+        self.state = bitboard.from_pieces(pieces, self.anchored, self.is_whites_turn)
+
+    @property
+    def position(self):
+        # The canonical Position, which is what caches should hold on to
+        if self._position is None:
+            self._position = Position.from_state(self.state)
+        return self._position
 
     def __hash__(self):
-        return hash((tuple(sorted(self.pieces.items())), self.anchored, self.is_whites_turn))
+        return hash(self.position)
 
     def __eq__(self, other):
-        return (
-            (tuple(sorted(self.pieces.items())), self.anchored, self.is_whites_turn) == 
-            (tuple(sorted(other.pieces.items())), other.anchored, other.is_whites_turn)
-        )
+        return self.position == other.position
+
+    def _state(self, pieces):
+        if pieces is None:
+            return self.state
+        return bitboard.from_pieces(pieces, self.anchored, self.is_whites_turn)
 
     def gen_neighbors(self, pieces, row, col):
-        unexplored = set([(row, col)])
-        explored = set(pieces.values())
-        def should_explore(r, c):
-            key = (r, c)
-            return (is_inbounds(r, c) and
-                    key not in explored)
-
-        while unexplored:
-            row, col = unexplored.pop()
-            explored.add((row, col))
-            for other_row, other_col in gen_ajacent_ixs(row, col):
-                if should_explore(other_row, other_col):
-                    yield other_row, other_col
-                    unexplored.add((other_row, other_col))
+        occ = bitboard.occupied(self._state(pieces))
+        bit = 1 << bitboard.square(row, col)
+        for dest in bitboard.gen_bits(bitboard.reachable(bit, occ)):
+            yield bitboard.coords(bitboard.bit_square(dest))
 
     def gen_next_states(self, pieces=None, nmoves=2):
-        pieces = pieces or self.pieces
-        yield from self.gen_execute_pushes(pieces)
-        if nmoves == 0:
-            return
+        for state in bitboard.gen_next_states(self._state(pieces), nmoves):
+            yield Board.from_state(state)
 
-        # for piece, (row, col) in pieces.items():
-        #     if 'w' in piece != self.is_whites_turn:
-        #         continue
-        if self.is_whites_turn:
-            movers = ('wp1', 'wp2', 'wp3', 'wm1', 'wm2')
-        else:
-            movers = ('bp1', 'bp2', 'bp3', 'bm1', 'bm2')
-
-        for mover in movers:
-            row, col = pieces[mover]
-            for (other_row, other_col) in self.gen_neighbors(pieces, row, col):
-                next_pieces = pieces.copy()
-                next_pieces[mover] = (other_row, other_col)
-                yield from self.gen_next_states(next_pieces, nmoves - 1)
+    def gen_unique_next_states(self, pieces=None, nmoves=2, with_moves=False):
+        # Each distinct successor once, optionally with the ((row, col), (row, col))
+        # moves that reach it
+        states = bitboard.gen_unique_next_states(self._state(pieces), nmoves, with_moves)
+        if not with_moves:
+            for state in states:
+                yield Board.from_state(state)
+            return
+        for moves, state in states:
+            moves = [(bitboard.coords(frm), bitboard.coords(to)) for frm, to in moves]
+            yield moves, Board.from_state(state)
 
     def gen_execute_pushes(self, pieces):
-        if self.is_whites_turn:
-            pushers = ('wp1', 'wp2', 'wp3')
-        else:
-            pushers = ('bp1', 'bp2', 'bp3')
-        inverted_pieces = dict(((r, c), p) for p, (r, c) in pieces.items())
-        for pusher in pushers:
-            row, col = pieces[pusher]
-            for dr, dc in gen_cardinal_dirs():
-                can_push, pushed_pieces = self.try_push(inverted_pieces, row + dr, col + dc, dr, dc, [pusher])
-                if can_push:
-                    new_pieces = pieces.copy()
-                    for piece in pushed_pieces:
-                        r, c = new_pieces[piece]
-                        new_pieces[piece] = (r + dr, c + dc)
-                    yield Board(new_pieces, anchored=(row + dr, col + dc), is_whites_turn=not self.is_whites_turn)
-
-    def try_push(self, inverted_pieces, row, col, dr, dc, pushed_pieces):
-        if (row, col) == self.anchored:
-            return False, pushed_pieces
-
-        try:
-            piece = inverted_pieces[(row, col)]
-        except KeyError:
-            if row == -1:
-                return not (2 < col < 8) and len(pushed_pieces) > 1, pushed_pieces
-            elif row == 4:
-                return not (1 < col < 7) and len(pushed_pieces) > 1, pushed_pieces
-            else:
-                return len(pushed_pieces) > 1, pushed_pieces
-        else:
-            pushed_pieces.append(piece)
-            return self.try_push(inverted_pieces, row + dr, col + dc, dr, dc, pushed_pieces)
+        for state in bitboard.gen_pushes(self._state(pieces)):
+            yield Board.from_state(state)
 
     def is_over(self, pieces=None):
-        pieces = pieces or self.pieces
-        return not all(is_inbounds(r, c) for r, c in pieces.values())
+        return bitboard.is_over(self._state(pieces))
 
     def vis(self):
         board = [
@@ -111,6 +221,78 @@ class Board(object):
         print()
 
 
+class SuccessorCache(object):
+    # A bounded LRU map from canonical positions to the keys of their legal
+    # successors. Concurrent lookups of the same position wait for the
+    # first one, so a position is only expanded once while it stays cached.
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def successors(self, state):
+        key = bitboard.key(state)
+        while True:
+            with self._lock:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    return self._cache[key]
+                pending = self._pending.get(key)
+                if pending is None:
+                    self.misses += 1
+                    pending = self._pending[key] = threading.Event()
+                    break
+            pending.wait()
+
+        try:
+            found = frozenset(bitboard.key(s) for s in bitboard.gen_unique_next_states(state))
+            with self._lock:
+                self._cache[key] = found
+                if len(self._cache) > self.maxsize:
+                    self._cache.popitem(last=False)
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+        return found
+
+    def is_legal(self, start, end):
+        # Up to two moves followed by a push takes start to end
+        return bitboard.key(end) in self.successors(start)
+
+    def info(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._cache),
+                "maxsize": self.maxsize,
+            }
+
+
+def apply_turn(board, moves, push):
+    # Plays (from_square, to_square) moves and then a push on a JSON board,
+    # keeping track of which named piece went where
+    board = dict(board)
+    at = {sq: name for name, sq in board.items() if name != 'anchor'}
+    for frm, to in moves:
+        name = at.pop(frm)
+        at[to] = name
+        board[name] = to
+    frm, to = push
+    step = to - frm
+    sq = frm
+    while sq in at:
+        board[at[sq]] = sq + step
+        sq += step
+    board['anchor'] = to
+    return board
+
+
 _CARDINAL_DIRS = ((-1, 0), (1, 0), (0, -1), (0, 1))
 def gen_cardinal_dirs():
     for direction in _CARDINAL_DIRS:
@@ -122,14 +304,7 @@ def gen_ajacent_ixs(row, col):
 
 
 def is_inbounds(row, col):
-    if row == 0:
-        return 2 < col < 8
-    elif row == 1 or row == 2:
-        return 0 < col < 9
-    elif row == 3:
-        return 1 < col < 7
-    else:
-        return False
+    return 0 <= row < geometry.ROWS and 0 <= col < geometry.COLS and geometry.IS_ONBOARD[geometry.square(row, col)]
 
 
 # EXAMPLE_BOARD = Board(
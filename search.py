@@ -0,0 +1,204 @@
+"""Iterative deepening alpha-beta search over the bitboard engine.
+
+A ply is a whole turn: up to two moves followed by a push. Scores are from
+the point of view of the side to move.
+"""
+import threading
+import time
+from collections import namedtuple
+
+import bitboard
+from geometry import EDGE
+
+WIN = 1000000
+EDGE_WEIGHT = 100
+
+EXACT, LOWER, UPPER = range(3)
+
+# How many nodes to search between looks at the clock
+_CLOCK_INTERVAL = 64
+
+SearchResult = namedtuple('SearchResult', 'state moves push score depth nodes')
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class TranspositionTable(object):
+    # A bounded map from position keys to (depth, score, flag, best child).
+    # When full the oldest entry is dropped.
+    def __init__(self, maxsize=1 << 18):
+        self.maxsize = maxsize
+        self._table = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._table.get(key)
+
+    def put(self, key, entry):
+        with self._lock:
+            self._table.pop(key, None)
+            self._table[key] = entry
+            if len(self._table) > self.maxsize:
+                del self._table[next(iter(self._table))]
+
+    def __len__(self):
+        return len(self._table)
+
+
+def evaluate(state):
+    # Pieces on squares they can be pushed off from are a liability
+    wp, wm, bp, bm, _, white = state
+    white_edge = bitboard.popcount((wp | wm) & EDGE)
+    black_edge = bitboard.popcount((bp | bm) & EDGE)
+    score = EDGE_WEIGHT * (black_edge - white_edge)
+    return score if white else -score
+
+
+def _terminal_score(state, depth):
+    # The push that ended the game was made by the other side. Sooner
+    # results (more depth left) score further from zero.
+    lost = bitboard.white_lost(state) == bool(state[bitboard.WHITE])
+    return -(WIN + depth) if lost else WIN + depth
+
+
+def _order(children, best):
+    # Game ending pushes first, then the previous best, then the rest in
+    # generation order, which has pushes with fewer moves first
+    if not children:
+        return children
+    first = [child for child in children if bitboard.is_over(child)]
+    if best is not None and best in children and best not in first:
+        first.append(best)
+    if not first:
+        return children
+    chosen = set(first)
+    return first + [child for child in children if child not in chosen]
+
+
+class Searcher(object):
+    # should_stop is polled along with the clock, and ends the search
+    # like running out of time when it returns True. A tablebase.Tablebase
+    # is probed before expanding each node.
+    def __init__(self, table=None, should_stop=None, tablebase=None):
+        self.table = table if table is not None else TranspositionTable()
+        self.should_stop = should_stop
+        self.tablebase = tablebase
+        self.nodes = 0
+        self._deadline = None
+        self._node_limit = None
+
+    def search(self, state, max_depth=8, time_limit=1.0, node_limit=None):
+        # Deepens until max_depth, time_limit seconds or node_limit nodes.
+        # The limits are hard: the best move of the deepest finished
+        # iteration is returned as soon as one runs out.
+        self.nodes = 0
+        self._deadline = time.monotonic() + time_limit if time_limit is not None else None
+        self._node_limit = node_limit
+
+        root = {}
+        for moves, child in bitboard.gen_unique_next_states(state, with_moves=True):
+            root[child] = moves
+        if not root:
+            return None
+
+        children = list(root)
+        best, best_score, depth = children[0], None, 0
+        try:
+            for depth in range(1, max_depth + 1):
+                score, child = self._search_root(children, depth, best)
+                best, best_score = child, score
+                if abs(score) >= WIN:
+                    break
+            else:
+                depth = max_depth
+        except SearchTimeout:
+            depth -= 1
+
+        placed = state
+        for frm, to in root[best]:
+            placed = bitboard.apply_move(placed, frm, to)
+        return SearchResult(
+            state=best,
+            moves=root[best],
+            push=bitboard.push_of(placed, best),
+            score=best_score,
+            depth=depth,
+            nodes=self.nodes,
+        )
+
+    def _search_root(self, children, depth, best):
+        alpha, beta = -WIN - depth - 1, WIN + depth + 1
+        best_child = None
+        for child in _order(children, best):
+            score = -self._negamax(child, depth - 1, -beta, -alpha)
+            if best_child is None or score > alpha:
+                alpha, best_child = score, child
+        return alpha, best_child
+
+    def _tick(self):
+        self.nodes += 1
+        if self._node_limit is not None and self.nodes > self._node_limit:
+            raise SearchTimeout
+        if self.nodes % _CLOCK_INTERVAL == 0:
+            if self._deadline is not None and time.monotonic() > self._deadline:
+                raise SearchTimeout
+            if self.should_stop is not None and self.should_stop():
+                raise SearchTimeout
+
+    def _negamax(self, state, depth, alpha, beta):
+        self._tick()
+        if bitboard.is_over(state):
+            return _terminal_score(state, depth)
+        if self.tablebase is not None:
+            outcome = self.tablebase.probe(state)
+            if outcome is not None:
+                # Scored as if the game ended abs(outcome) plies from here
+                score = WIN + depth - abs(outcome)
+                return score if outcome > 0 else -score
+        if depth == 0:
+            return evaluate(state)
+
+        key = bitboard.key(state)
+        entry = self.table.get(key)
+        best = None
+        if entry is not None:
+            entry_depth, score, flag, best = entry
+            if entry_depth >= depth:
+                if flag == EXACT:
+                    return score
+                if flag == LOWER and score >= beta:
+                    return score
+                if flag == UPPER and score <= alpha:
+                    return score
+
+        children = []
+        for i, child in enumerate(bitboard.gen_unique_next_states(state)):
+            children.append(child)
+            if i % 256 == 255:
+                self._tick()
+        if not children:
+            # Not being able to push loses
+            return -(WIN + depth)
+
+        start_alpha = alpha
+        best_score, best_child = -WIN - depth - 1, None
+        for child in _order(children, best):
+            score = -self._negamax(child, depth - 1, -beta, -alpha)
+            if score > best_score:
+                best_score, best_child = score, child
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                break
+
+        if best_score <= start_alpha:
+            flag = UPPER
+        elif best_score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table.put(key, (depth, best_score, flag, best_child))
+        return best_score
+
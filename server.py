@@ -4,18 +4,91 @@ import random
 import base64
 import time
 import json
+import logging
+import logging.handlers
+import concurrent.futures
+import queue
 from cryptography.fernet import Fernet, InvalidToken
 
 import bottle as b
 # from bottle import route, run, template
 
-from pushfight import EXAMPLE_BOARD
-from db_interface import db
-from utils import hash_pw, check_pw
+import analysis
+import aserver
+import bitboard
+import compact
+import history
+import notify
+import passwords
+import profiler
+import tokens
+import search
+import tablebase
+from pushfight import EXAMPLE_BOARD, SuccessorCache, apply_turn
+import db_interface
+import gamecache
+import locks
+import metrics
 
 games = {}
 users = {}
 session_key = None
+successor_cache = SuccessorCache()
+hint_table = search.TranspositionTable()
+# Hard limit on how long a hint request may search for, in seconds
+HINT_TIME_LIMIT = 1.0
+# Started in __main__; without it hints are searched on the request thread
+analysis_pool = None
+ANALYSIS_WORKERS = None  # defaults to the number of CPUs
+# Built with tablebase.py, used when present
+TABLEBASE_PATH = 'tablebase.bin'
+endgames = None
+game_events = notify.GameEvents()
+# Held while a move is checked against a game and added to it
+game_locks = locks.KeyedLocks()
+# bcrypt runs here instead of on the request threads
+password_pool = passwords.PasswordPool()
+# Tokens that have been verified, so repeat requests skip the crypto
+token_cache = tokens.TokenCache()
+log = logging.getLogger('pushfight')
+registry = metrics.Registry()
+request_seconds = registry.histogram(
+    'pushfight_request_seconds', 'Time to answer a request', ('method', 'route'))
+requests_total = registry.counter(
+    'pushfight_requests_total', 'Requests answered, by status', ('method', 'route', 'status'))
+db_seconds = registry.histogram(
+    'pushfight_db_seconds', 'Time spent in database calls', ('op',), metrics.FAST_BUCKETS)
+fernet_seconds = registry.histogram(
+    'pushfight_fernet_seconds', 'Time to make and check session tokens', ('op',), metrics.FAST_BUCKETS)
+engine_seconds = registry.histogram(
+    'pushfight_engine_seconds', 'Time spent checking moves and searching for hints', ('op',))
+b.install(metrics.Plugin(request_seconds, requests_total))
+# Off until --profile-rate or POST /admin/profile turns it on
+request_profiler = profiler.Profiler()
+b.install(request_profiler.plugin())
+# Users allowed the /admin endpoints
+ADMINS = set(filter(None, os.environ.get('PUSHFIGHT_ADMINS', '').split(',')))
+# Addresses of reverse proxies whose X-Forwarded-For is believed
+TRUSTED_PROXIES = set(filter(None, os.environ.get('PUSHFIGHT_TRUSTED_PROXIES', '').split(',')))
+# Games in play are read from memory. __main__ reopens this to write turns
+# behind through a journal, until then they're written through.
+db = metrics.TimedDB(gamecache.GameCache(db_interface.db, flush_interval=0), db_seconds)
+GAMES_JOURNAL = 'games.journal'
+# Longest a /1/game/status long poll is held open, in seconds
+STATUS_MAX_WAIT = 25.0
+
+
+def _cache_info():
+    # Tests swap in a plain backend, which keeps no counts
+    info = getattr(db, 'info', None)
+    return info() if info is not None else {}
+
+
+registry.collect_info('pushfight_bcrypt', lambda: password_pool.info(), 'Password pool counters')
+registry.collect_info('pushfight_token_cache', lambda: token_cache.info(), 'Verified token cache counters')
+registry.collect_info('pushfight_game_cache', _cache_info, 'Live game cache counters')
+registry.collect_info('pushfight_profiler', request_profiler.info, 'Request profiler counters')
+registry.collect_info('pushfight_long_polls', lambda: {'waiting': game_events.waiting()}, 'Status requests waiting')
 
 def init_board():
     return EXAMPLE_BOARD
@@ -25,19 +98,58 @@ def check_cred(user, password):
     # Check a user's stored password against a presented one
     for rec in db.find('users', user, key='email'):
         stored = rec.get('password').encode('utf8')
-        return stored and check_pw(password, stored)
+        return stored and _password_work(password_pool.check, password, stored, account=user)
     return False
 
 
-def _auth_check(user, token):
+def _password_work(fn, *args, **kwargs):
+    try:
+        return fn(*args, ip=_client_ip(), **kwargs)
+    except passwords.Busy:
+        raise b.HTTPError(429, "Too many password checks in progress, try again shortly", Retry_After='1')
+
+
+def _client_ip():
+    # The peer's address. X-Forwarded-For is set by the client, so it's
+    # only believed when the peer is a proxy in TRUSTED_PROXIES, and then
+    # only the entries trusted proxies added: the rightmost one that isn't
+    # a proxy is the client.
+    ip = b.request.environ.get('REMOTE_ADDR')
+    if ip in TRUSTED_PROXIES:
+        forwarded = b.request.environ.get('HTTP_X_FORWARDED_FOR', '')
+        for hop in reversed([hop.strip() for hop in forwarded.split(',') if hop.strip()]):
+            ip = hop
+            if hop not in TRUSTED_PROXIES:
+                break
+    return ip
+
+
+def _verify_token(token):
+    # The token's info if it is ours and hasn't expired, else None
     try:
-        b = session_key.decrypt(bytes(token, 'utf8'))
+        with fernet_seconds.time('decrypt'):
+            b = session_key.decrypt(bytes(token, 'utf8'))
     except InvalidToken:
-        return False
+        return None
     try:
         info = json.loads(str(b, 'utf8'))
     except:
+        return None
+    expires = info.get('expires')
+    if not isinstance(expires, (int, float)) or expires <= time.time():
+        return None
+    return info
+
+def _auth_check(user, token):
+    cached = token_cache.get(token)
+    if cached is tokens.REVOKED:
+        return False
+    if cached is not None:
+        return user == cached
+    info = _verify_token(token)
+    if info is None:
         return False
+    token_cache.put(token, info.get('user'), info['expires'])
     return user == info.get('user')
 
 def new_anonymous_user():
@@ -58,7 +170,7 @@ def get_game_uuid(game):
         if i not in games:
             games[i] = game
             return i
-    print('No slots available! Panic!', file=sys.stderr)
+    log.error('No slots available! Panic!')
 
 
 # def find_game_by_id(gid):
@@ -98,7 +210,7 @@ def register():
     current = db.find('users', email, key='email')
     if len(current) > 0:
         b.abort(400, "Email already registered")
-    hashed_string = hash_pw(password)
+    hashed_string = _password_work(password_pool.hash, password, account=email)
     doc = db.put('users', {"email": email, "password": hashed_string}, key='email')
     return {"username": doc['_id']}
 
@@ -123,10 +235,21 @@ def login():
         "user": user,
         "expires": now + 3600,
     }
-    token_bytes = session_key.encrypt(bytes(json.dumps(token_info), 'utf8'))
+    with fernet_seconds.time('encrypt'):
+        token_bytes = session_key.encrypt(bytes(json.dumps(token_info), 'utf8'))
     return {"username": user, "token": str(token_bytes, 'utf8')}
 
 
+@b.post('/1/logout')
+@b.auth_basic(_auth_check)
+def logout():
+    _, token = b.request.auth
+    info = _verify_token(token)
+    if info is not None:
+        token_cache.revoke(token, info['expires'])
+    return {}
+
+
 @b.post('/1/checkuser')
 @b.auth_basic(_auth_check)
 def check_user():
@@ -137,29 +260,64 @@ def check_user():
         b.abort(401, "Bad auth")
 
 
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def _page_args():
+    # The limit and cursor query params of a paginated endpoint
+    try:
+        limit = int(b.request.query.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        b.abort(400, "Bad limit")
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        b.abort(400, "Limit must be between 1 and {}".format(MAX_PAGE_SIZE))
+    cursor = b.request.query.get('cursor')
+    if not cursor:
+        return limit, None
+    try:
+        after = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeEncodeError):
+        b.abort(400, "Bad cursor")
+    return limit, after
+
+
+def _find_page(bucket, value, keys, after, limit):
+    try:
+        return db.find_page(bucket, value, keys, after=after, limit=limit)
+    except ValueError:
+        b.abort(400, "Bad cursor")
+
+
+def _encode_cursor(after):
+    if after is None:
+        return None
+    return str(base64.urlsafe_b64encode(json.dumps(after).encode('utf8')), 'ascii')
+
+
 @b.get('/1/opengames')
 def get_open_games():
-    # Returns: {games: [{game: `<uuid>`, opponent: `<uuid>`}, ...]}
+    # Returns: {games: [{game: `<uuid>`, opponent: `<uuid>`}, ...], next: `<cursor>`|null}
+    limit, after = _page_args()
+    games, after = _find_page("games", "waitingforplayers", ("game_status",), after, limit)
     game_data = []
-    # TODO: should limit the number of returned results
-    for g in db.find("games", "waitingforplayers", key="game_status"):
+    for g in games:
         opponent = g["white_player"]
         game_data.append({
             "game": g["_id"],
             "opponent": opponent if opponent else g["black_player"],
         })
-    return {"games": game_data}
+    return {"games": game_data, "next": _encode_cursor(after)}
 
 
 @b.get('/1/mygames')
 @b.auth_basic(_auth_check)
 def get_my_games():
-    # Returns: {games: [`<uuid>`, ...]}
+    # Returns: {games: [`<uuid>`, ...], next: `<cursor>`|null}
     user,_ = b.request.auth
-    games = []
-    for key in ("white_player", "black_player"):
-        games += [g["_id"] for g in db.find("games", user, key=key)]
-    return {"games": games}
+    limit, after = _page_args()
+    games, after = _find_page("games", user, ("white_player", "black_player"), after, limit)
+    return {"games": [g["_id"] for g in games], "next": _encode_cursor(after)}
 
 # def _getLatestState(game):
 #     if len(game.turns) == 0:
@@ -210,15 +368,38 @@ def game_status():
         b.abort(404, "User not associated with game")
         return
 
+    fmt = _response_format()
+
+    # Long poll: with after=<version>, hold the request until the game
+    # has moved past that version or the wait runs out
+    after = b.request.query.get('after')
+    if after is not None:
+        try:
+            after = int(after)
+            wait = min(float(b.request.query.get('wait', STATUS_MAX_WAIT)), STATUS_MAX_WAIT)
+        except ValueError:
+            b.abort(400, "Bad after or wait")
+            return
+        if db.turn_count(game) <= after and wait > 0:
+            current = lambda: _game_version(game_id)
+            suspend = b.request.environ.get('pushfight.suspend')
+            if suspend is None:
+                game_events.wait(game_id, after, wait, current=current)
+            elif suspend(game_id, after, wait, current):
+                # The async server waits without a worker and calls us again
+                return
+            game = db.find('games', game_id)[0]
+
     color = 'white' if user == game['white_player'] else 'black'
-    latest = game['turns'][-1]
-    print('^^^^^', latest)
+    latest = db.latest_turn(game)
+    log.debug('Status of %s: %s', game_id, latest)
     ret = {
         "game": game['_id'],
-        'board': latest['board'],
+        'board': _board_out(latest['board'], fmt),
         'gameStage': latest['gameStage'],
         'request': game['request'],
         'color': color,
+        'version': db.turn_count(game),
     }
     # ret = {
     #     'board': _getLatestState(game),
@@ -228,6 +409,123 @@ def game_status():
     # }
     return ret
 
+def _response_format():
+    # ?format=compact sends boards as compact.encode_board strings
+    fmt = b.request.query.get('format', 'json')
+    if fmt not in ('json', 'compact'):
+        b.abort(400, "Bad format")
+    return fmt
+
+
+def _board_out(board, fmt):
+    if fmt == 'compact':
+        try:
+            return compact.encode_board(board)
+        except (ValueError, AttributeError):
+            # Not a board the codec knows, sent as it was stored
+            pass
+    return board
+
+
+def _game_version(game_id):
+    games = db.find('games', game_id)
+    return db.turn_count(games[0]) if games else None
+
+
+@b.get('/1/game/history')
+@b.auth_basic(_auth_check)
+def game_history():
+    # The game's turns from ply "from" on, at most "limit" of them, one JSON
+    # line each, with boards only where history.encode puts them
+    user,_ = b.request.auth
+    game_id = b.request.query.game
+    games = db.find('games', game_id)
+    if len(games) == 0:
+        b.abort(404, "No such game")
+        return
+    game = games[0]
+    if user not in [game['white_player'], game['black_player']]:
+        b.abort(404, "User not associated with game")
+        return
+    fmt = _response_format()
+    try:
+        start = int(b.request.query.get('from', 0))
+    except ValueError:
+        b.abort(400, "Bad from")
+        return
+    if not 0 <= start <= db.turn_count(game):
+        b.abort(400, "Bad from")
+        return
+    try:
+        limit = b.request.query.get('limit')
+        limit = int(limit) if limit is not None else None
+    except ValueError:
+        b.abort(400, "Bad limit")
+        return
+    if limit is not None and limit < 1:
+        b.abort(400, "Bad limit")
+        return
+    # The first record always has its board, so the turns before start
+    # aren't needed
+    turns = db.get_turns(game, start, limit)
+    records = history.encode(turns, start=start, packed=fmt == 'compact', first=start)
+    b.response.content_type = 'application/x-ndjson'
+    return (json.dumps(record, separators=(',', ':')) + '\n' for record in records)
+
+@b.get('/1/game/hint')
+@b.auth_basic(_auth_check)
+def game_hint():
+    user,_ = b.request.auth
+    game_id = b.request.query.game
+    games = db.find('games', game_id)
+    if len(games) == 0:
+        b.abort(404, "No such game")
+        return
+    game = games[0]
+    if user not in [game['white_player'], game['black_player']]:
+        b.abort(404, "User not associated with game")
+        return
+
+    latest = db.latest_turn(game)
+    color = 'white' if user == game['white_player'] else 'black'
+    if latest['gameStage'] != color + 'Turn':
+        b.abort(403, "Not your turn")
+        return
+
+    start = bitboard.from_squares(latest['board'], color == 'white')
+    with engine_seconds.time('hint'):
+        result = analyse(start, HINT_TIME_LIMIT)
+    if result is None:
+        b.abort(400, "No legal moves")
+        return
+    return {
+        "game": game['_id'],
+        "moves": [{"from": frm, "to": to} for frm, to in result.moves + (result.push,)],
+        "board": apply_turn(latest['board'], result.moves, result.push),
+        "score": result.score,
+        "depth": result.depth,
+    }
+
+
+def analyse(state, time_limit):
+    if analysis_pool is None:
+        return search.Searcher(hint_table, tablebase=endgames).search(state, time_limit=time_limit)
+    try:
+        job = analysis_pool.submit(state, time_limit=time_limit)
+    except analysis.PoolFull:
+        raise b.HTTPError(503, "Analysis queue is full", Retry_After='1')
+    try:
+        # The worker stops itself at the deadline, the grace period covers
+        # getting the result back
+        return job.result(timeout=time_limit + 1.0)
+    except analysis.Cancelled:
+        # Waited in the queue past its deadline
+        raise b.HTTPError(503, "Analysis timed out", Retry_After='1')
+    except concurrent.futures.TimeoutError:
+        job.cancel()
+        raise b.HTTPError(503, "Analysis timed out", Retry_After='1')
+
+
 def make_game(user1, user2, color='white', timed=False):
     _id = '{}_{}_{}'.format(user1, user2, int(time.time()))
     turn = {
@@ -245,6 +543,7 @@ def make_game(user1, user2, color='white', timed=False):
             # "white_setup": None,
             # "black_setup": None,
             "turns": [turn],
+            "game_status": turn['gameStage'],
             # 'color': color,
             # "game_stage": "WhiteSetup",
             'request': "NoRequest"
@@ -308,7 +607,7 @@ def start_impl(opponent=None):
         timed = False
 
     game = make_game(username, opponent, color=color, timed=timed)
-    print(game)
+    log.debug('New game %s', game)
     db.put('games', game)
     return {
         "game": game['_id'],
@@ -401,11 +700,19 @@ def post_game_join():
 
 
 @b.post('/1/move')
+@b.auth_basic(_auth_check)
 def post_move():
-    body = b.request
+    body = b.request.json
+    if not body:
+        b.abort(400, "Bad request - no body")
     user,_ = b.request.auth
-    game_id = body.gameId
-    games = db.find('games', game_id, key='email')
+    game_id = body.get('gameId')
+    with game_locks.hold(game_id):
+        return _move(user, game_id, body)
+
+
+def _move(user, game_id, body):
+    games = db.find('games', game_id)
     if len(games) == 0:
         b.abort(404, "No such game")
         return
@@ -414,33 +721,145 @@ def post_move():
     if user not in [game['white_player'], game['black_player']]:
         b.abort(404, "User not associated with game")
         return
+    # The version the client last saw, from /1/game/status. Older clients
+    # don't send one and are only checked by startBoard.
+    version = body.get('version')
+    if version is not None and version != db.turn_count(game):
+        b.abort(409, "Game was updated by another move")
+        return
     # if body.startGameStage == 'WhiteSetup':
     #     game['white_setup'] = body.endBoard
     # elif body.startGameStage == 'BlackSetup':
     #     game['white_setup'] = body.endBoard
     # board = board.board
+    # The client sends finalBoard/finalGameStage, the README says endBoard/endGameStage
+    end_board = body.get('finalBoard', body.get('endBoard'))
+    # if len(game.turns) == 0:
+        # game['turns'].append(turn)
+    latest = db.latest_turn(game)
+    # A move made from a board that's since changed is a conflict, even if
+    # the turn has passed to the other player
+    if latest['board'] != body.get('startBoard'):
+        b.abort(409, "Move does not match")
+        return
+    mover = MOVERS.get(latest['gameStage'])
+    if mover is None or user != game[mover + '_player']:
+        b.abort(403, "Not your turn")
+        return
+    with engine_seconds.time('legal'):
+        stage = next_stage(latest, end_board)
+    if stage is None:
+        b.abort(400, "Move is not valid")
+        return
+    # The stage is worked out here, the client's is only checked against it
+    claimed = body.get('finalGameStage', body.get('endGameStage'))
+    if claimed is not None and claimed != stage:
+        b.abort(400, "Game stage should be {}".format(stage))
+        return
     turn = {
         # 'startBoard': body.startBoard,
         # 'startGameStage': body.startGameStage,
-        'moves': body.moves,
-        'gameStage': body.endGameStage,
-        'board': body.endBoard,
+        'moves': body.get('moves'),
+        'gameStage': stage,
+        'board': end_board,
     }
-    # if len(game.turns) == 0:
-        # game['turns'].append(turn)
-    if game['turns'][-1]['board'] == body.startBoard:
-        game['turns'].append(turn)
-        db.put('games', game)
-        return {
-            "game": game['_id'],
-            "board": game['turns'][-1]['board'],
-            "gameStage": game['turns'][-1]['gameStage'],
-            "request": game['request'],
-            "color": color,
-        }
-    else:
-        b.abort(404, "Move does not match")
+
+    try:
+        game = db.append_turn(game, turn, game_status=turn['gameStage'])
+    except db_interface.Conflict:
+        b.abort(409, "Game was updated by another move")
         return
+    game_events.publish(game['_id'], db.turn_count(game))
+    return {
+        "game": game['_id'],
+        "board": turn['board'],
+        "gameStage": turn['gameStage'],
+        "request": game['request'],
+        "color": mover,
+    }
+
+
+# The color that moves in each stage, nobody moves in the others
+MOVERS = {
+    'whitesetup': 'white',
+    'whiteSetup': 'white',
+    'blackSetup': 'black',
+    'whiteTurn': 'white',
+    'blackTurn': 'black',
+}
+# Setup placements aren't pushes and aren't checked
+AFTER_SETUP = {
+    'whitesetup': 'blackSetup',
+    'whiteSetup': 'blackSetup',
+    'blackSetup': 'whiteTurn',
+}
+
+
+def next_stage(latest, end_board):
+    # The stage after a move from latest to end_board, None if it isn't legal
+    stage = latest['gameStage']
+    if stage in AFTER_SETUP:
+        return AFTER_SETUP[stage]
+    if stage not in ('whiteTurn', 'blackTurn'):
+        return None
+    is_whites_turn = stage == 'whiteTurn'
+    try:
+        start = bitboard.from_squares(latest['board'], is_whites_turn)
+        end = bitboard.from_squares(end_board, not is_whites_turn)
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not successor_cache.is_legal(start, end):
+        return None
+    if bitboard.is_over(end):
+        return 'blackWon' if bitboard.white_lost(end) else 'whiteWon'
+    return 'blackTurn' if is_whites_turn else 'whiteTurn'
+
+@b.get('/metrics')
+def get_metrics():
+    # Prometheus text format
+    b.response.content_type = 'text/plain; version=0.0.4; charset=utf-8'
+    return registry.render()
+
+
+def _admin_check():
+    user,_ = b.request.auth
+    if user not in ADMINS:
+        b.abort(403, "Not an admin")
+
+
+@b.get('/admin/profile')
+@b.auth_basic(_auth_check)
+def get_profile():
+    # Samples so far as collapsed stacks, for flamegraph.pl or speedscope.
+    # ?route=<method> <rule> gives one route's.
+    _admin_check()
+    b.response.content_type = 'text/plain; charset=utf-8'
+    return request_profiler.collapsed(b.request.query.get('route'))
+
+
+@b.post('/admin/profile')
+@b.auth_basic(_auth_check)
+def post_profile():
+    # Body: {rate: <fraction of requests>, interval: <seconds>, reset: <bool>}
+    _admin_check()
+    body = b.request.json
+    if not body:
+        b.abort(400, "Bad request")
+    try:
+        rate = float(body.get('rate', request_profiler.rate))
+        interval = body.get('interval')
+        if interval is not None:
+            interval = float(interval)
+            if interval <= 0:
+                raise ValueError(interval)
+        request_profiler.set_rate(rate, interval)
+    except (TypeError, ValueError):
+        b.abort(400, "Bad rate or interval")
+        return
+    if body.get('reset'):
+        request_profiler.reset()
+    return request_profiler.info()
+
 
 DIRNAME = os.path.dirname(os.path.realpath(__file__))
 
@@ -453,18 +872,87 @@ def server_static(filepath="index.html"):
     return b.static_file(filepath, root=os.path.join(DIRNAME, 'deploy/'))
 
 
+class ThreadingWSGIRefServer(b.ServerAdapter):
+    # bottle's wsgiref server with a thread per request, so a long poll
+    # doesn't hold up everyone else
+    def run(self, app):
+        from socketserver import ThreadingMixIn
+        from wsgiref.simple_server import WSGIServer, make_server
+
+        class Server(ThreadingMixIn, WSGIServer):
+            daemon_threads = True
+
+        make_server(self.host, self.port, app, Server, **self.options).serve_forever()
+
+
 def load_session_key(filename='secret_api_key'):
     global session_key
     with open(filename,'rb') as f:
         session_key = Fernet(f.read())
 
 
+def parse_args(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Push fight API server')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--mode', choices=('async', 'threaded'), default='threaded',
+                        help='threaded uses a thread per request, async (experimental) '
+                             'serves connections from an event loop')
+    parser.add_argument('--workers', type=int, default=16,
+                        help='threads running requests in async mode')
+    parser.add_argument('--log-level', default='INFO',
+                        choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'))
+    parser.add_argument('--profile-rate', type=float, default=0.0,
+                        help='fraction of requests to profile, see /admin/profile')
+    parser.add_argument('--admin', action='append', default=[], metavar='EMAIL',
+                        help='user allowed the /admin endpoints, can be repeated')
+    parser.add_argument('--trusted-proxy', action='append', default=[], metavar='ADDR',
+                        help='reverse proxy whose X-Forwarded-For is used for the client '
+                             'address, can be repeated')
+    return parser.parse_args(argv)
+
+
+def start_logging(level, stream=sys.stderr):
+    # Request threads only put records on a queue, a listener thread
+    # formats and writes them. Returns the listener, to stop() at exit.
+    records = queue.Queue()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    listener = logging.handlers.QueueListener(records, handler)
+    log.addHandler(logging.handlers.QueueHandler(records))
+    log.setLevel(level)
+    listener.start()
+    return listener
+
+
 if __name__ == '__main__':
+    args = parse_args()
+    log_listener = start_logging(args.log_level)
+    ADMINS.update(args.admin)
+    TRUSTED_PROXIES.update(args.trusted_proxy)
+    request_profiler.set_rate(args.profile_rate)
     if not os.path.exists('secret_api_key'):
-        print('Generating a new api key')
+        log.info('Generating a new api key')
         key = Fernet.generate_key()
         with open('secret_api_key','wb') as f:
             f.write(key)
 
     load_session_key()
-    b.run(host='localhost', port=8080)
+    tablebase_path = None
+    if os.path.exists(TABLEBASE_PATH):
+        tablebase_path = TABLEBASE_PATH
+        endgames = tablebase.Tablebase(tablebase_path)
+    analysis_pool = analysis.AnalysisPool(workers=ANALYSIS_WORKERS, tablebase_path=tablebase_path)
+    db = metrics.TimedDB(gamecache.GameCache(db_interface.db, journal=GAMES_JOURNAL), db_seconds)
+    try:
+        if args.mode == 'async':
+            aserver.AsyncServer(
+                b.default_app(), args.host, args.port, workers=args.workers, events=game_events).run()
+        else:
+            b.run(server=ThreadingWSGIRefServer, host=args.host, port=args.port)
+    finally:
+        analysis_pool.shutdown(wait=False)
+        password_pool.shutdown(wait=False)
+        db.close()
+        log_listener.stop()
@@ -0,0 +1,184 @@
+"""Precomputed outcomes of positions close to the end of a game.
+
+The file is a small header followed by fixed size records sorted by the
+canonical bitboard key, so a lookup is a binary search over an mmap and
+nothing is loaded at startup. Every process that opens the same file
+shares its pages.
+
+An outcome is the number of plies until the game ends, positive when the
+side to move wins and negative when it loses: 1 means there is a winning
+push this turn, -1 that every push loses (or there is none), -2 that
+every turn leads to the opponent winning on theirs.
+
+    python tablebase.py --plies 1 --random 100 --out tablebase.bin
+"""
+import argparse
+import json
+import mmap
+import random
+import struct
+import sys
+
+import bitboard
+import geometry
+
+MAGIC = b'PFTB'
+VERSION = 1
+_HEADER = struct.Struct('<4sHI')
+_KEY_BYTES = 21
+_RECORD = _KEY_BYTES + 1
+
+
+def _key_bytes(state):
+    return bitboard.key(state).to_bytes(_KEY_BYTES, 'big')
+
+
+def write(path, outcomes):
+    # outcomes maps bitboard keys to signed outcomes
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(outcomes)))
+        for key in sorted(outcomes):
+            f.write(key.to_bytes(_KEY_BYTES, 'big'))
+            f.write(struct.pack('b', outcomes[key]))
+
+
+class Tablebase(object):
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a version {} tablebase".format(path, VERSION))
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def probe(self, state):
+        # The outcome for the side to move, or None if it isn't stored
+        target = _key_bytes(state)
+        data = self._map
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            at = _HEADER.size + mid * _RECORD
+            found = data[at:at + _KEY_BYTES]
+            if found < target:
+                lo = mid + 1
+            elif found > target:
+                hi = mid
+            else:
+                return struct.unpack_from('b', data, at + _KEY_BYTES)[0]
+        return None
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def solve(state, plies):
+    # The exact outcome if the game is decided within plies, else None
+    if plies <= 0:
+        return None
+    white = bool(state[bitboard.WHITE])
+    children = []
+    losses = []
+    for child in bitboard.gen_unique_next_states(state):
+        if not bitboard.is_over(child):
+            children.append(child)
+        elif bitboard.white_lost(child) != white:
+            return 1
+        else:
+            # Pushing one of your own pieces off loses
+            losses.append(-1)
+
+    wins, unknown = [], False
+    for child in children:
+        outcome = solve(child, plies - 1)
+        if outcome is None:
+            unknown = True
+        elif outcome > 0:
+            losses.append(-(outcome + 1))
+        else:
+            wins.append(-outcome + 1)
+    if wins:
+        return min(wins)
+    if unknown:
+        return None
+    # Out of pushes, or all of them lose: hold on as long as possible
+    return min(losses) if losses else -1
+
+
+def build(seeds, plies, spread=1):
+    # Solves the seeds and every position up to spread turns after them
+    outcomes = {}
+    seen = set()
+    layer = [state for state in seeds if not bitboard.is_over(state)]
+    for depth in range(spread + 1):
+        next_layer = []
+        for state in layer:
+            key = bitboard.key(state)
+            if key in seen:
+                continue
+            seen.add(key)
+            outcome = solve(state, plies)
+            if outcome is not None:
+                outcomes[key] = outcome
+            if depth < spread:
+                next_layer.extend(
+                    child for child in bitboard.gen_unique_next_states(state)
+                    if not bitboard.is_over(child))
+        layer = next_layer
+    return outcomes
+
+
+def random_positions(count, seed=None):
+    rng = random.Random(seed)
+    onboard = [sq for sq in range(geometry.NSQUARES) if geometry.IS_ONBOARD[sq]]
+    for _ in range(count):
+        squares = rng.sample(onboard, 10)
+        board = {}
+        for names in bitboard.PIECE_NAMES:
+            for name in names:
+                board[name] = squares.pop()
+        white = rng.random() < 0.5
+        opponents = bitboard.PIECE_NAMES[bitboard.BP if white else bitboard.WP]
+        board['anchor'] = board[rng.choice(opponents)]
+        yield bitboard.from_squares(board, white)
+
+
+def file_positions(path):
+    # Turns as stored in games, one JSON object per line:
+    # {"board": {...}, "gameStage": "whiteTurn"}
+    with open(path) as f:
+        for line in f:
+            turn = json.loads(line)
+            stage = turn.get('gameStage')
+            if stage in ('whiteTurn', 'blackTurn'):
+                yield bitboard.from_squares(turn['board'], stage == 'whiteTurn')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--out', default='tablebase.bin')
+    parser.add_argument('--plies', type=int, default=1,
+                        help='store positions decided within this many plies')
+    parser.add_argument('--spread', type=int, default=1,
+                        help='also solve positions this many turns after each seed')
+    parser.add_argument('--random', type=int, default=0,
+                        help='number of random seed positions')
+    parser.add_argument('--turns', default=None,
+                        help='seed from a file of stored turns, one JSON object per line')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    seeds = list(random_positions(args.random, args.seed))
+    if args.turns:
+        seeds.extend(file_positions(args.turns))
+    outcomes = build(seeds, args.plies, args.spread)
+    write(args.out, outcomes)
+    print('Wrote {} positions to {}'.format(len(outcomes), args.out), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
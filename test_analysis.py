@@ -0,0 +1,49 @@
+import unittest
+
+import analysis
+import bitboard
+from test_bitboard import state_of
+from test_pushfight import EXAMPLE
+
+
+class TestAnalysisPool(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = analysis.AnalysisPool(workers=1, max_jobs=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.shutdown()
+
+    def test_search_in_worker(self):
+        state = state_of(
+            wp=[(1, 3), (2, 4), (2, 5)], wm=[(0, 4), (3, 4)],
+            bp=[(1, 4), (2, 3), (3, 3)], bm=[(1, 5), (1, 8)])
+        result = self.pool.submit(state, time_limit=5).result(timeout=10)
+        self.assertTrue(bitboard.is_over(result.state))
+        self.assertFalse(bitboard.white_lost(result.state))
+
+    def test_cancel_and_queue_limit(self):
+        busy = self.pool.submit(EXAMPLE.state, time_limit=30)
+        queued = self.pool.submit(EXAMPLE.state, time_limit=30)
+        with self.assertRaises(analysis.PoolFull):
+            self.pool.submit(EXAMPLE.state)
+        queued.cancel()
+        busy.cancel()
+        with self.assertRaises(analysis.Cancelled):
+            queued.result(timeout=10)
+        # A running search notices the flag and returns what it has; one no
+        # worker had picked up yet is cancelled outright
+        try:
+            busy.result(timeout=10)
+        except analysis.Cancelled:
+            pass
+        self.assertTrue(busy.done())
+
+    def test_expired_deadline(self):
+        with self.assertRaises(analysis.Cancelled):
+            self.pool.submit(EXAMPLE.state, time_limit=0).result(timeout=10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import http.client
+import json
+import socket
+import threading
+import time
+import unittest
+
+import bottle
+
+from aserver import AsyncServer
+from notify import GameEvents
+
+
+def make_app(events, versions):
+    app = bottle.Bottle()
+
+    @app.post('/echo')
+    def echo():
+        return {'body': bottle.request.json, 'query': dict(bottle.request.query)}
+
+    @app.get('/poll/<game>')
+    def poll(game):
+        after = int(bottle.request.query.after)
+        if versions.get(game, 0) <= after:
+            suspend = bottle.request.environ['pushfight.suspend']
+            if suspend(game, after, 5.0, lambda: versions.get(game, 0)):
+                return
+        return {'version': versions.get(game, 0)}
+
+    return app
+
+
+class TestAsyncServer(unittest.TestCase):
+    def setUp(self):
+        self.events = GameEvents()
+        self.versions = {}
+        self.server = AsyncServer(make_app(self.events, self.versions), '127.0.0.1', 0,
+                                  workers=1, events=self.events, shutdown_grace=2.0)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.thread.start()
+        self.assertTrue(self.server.started.wait(5))
+
+    def tearDown(self):
+        if self.thread.is_alive():
+            self.server.stop()
+            self.thread.join(5)
+
+    def connect(self):
+        return http.client.HTTPConnection('127.0.0.1', self.server.port, timeout=5)
+
+    def test_keep_alive(self):
+        conn = self.connect()
+        for i in range(3):
+            conn.request('POST', '/echo?x=%d' % i, body=json.dumps({'i': i}),
+                         headers={'Content-Type': 'application/json'})
+            resp = conn.getresponse()
+            self.assertEqual(resp.status, 200)
+            self.assertEqual(json.loads(resp.read()), {'body': {'i': i}, 'query': {'x': str(i)}})
+        conn.close()
+
+    def test_bad_requests(self):
+        # Refused before the body is read
+        conn = self.connect()
+        conn.putrequest('POST', '/echo')
+        conn.putheader('Content-Length', str(self.server.max_body + 1))
+        conn.endheaders()
+        self.assertEqual(conn.getresponse().status, 413)
+        conn = self.connect()
+        conn.putrequest('POST', '/echo')
+        conn.putheader('Transfer-Encoding', 'chunked')
+        conn.endheaders()
+        self.assertEqual(conn.getresponse().status, 501)
+        conn = self.connect()
+        conn.request('GET', '/nowhere')
+        self.assertEqual(conn.getresponse().status, 404)
+
+    def test_long_poll_frees_worker(self):
+        results = []
+
+        def wait():
+            conn = self.connect()
+            conn.request('GET', '/poll/g?after=0')
+            results.append(json.loads(conn.getresponse().read()))
+
+        waiters = [threading.Thread(target=wait) for _ in range(3)]
+        for t in waiters:
+            t.start()
+        while self.events.waiting() < 3:
+            time.sleep(0.001)
+
+        # Three polls are waiting but the one worker still serves requests
+        conn = self.connect()
+        conn.request('POST', '/echo', body='{}', headers={'Content-Type': 'application/json'})
+        self.assertEqual(conn.getresponse().status, 200)
+
+        self.versions['g'] = 1
+        self.events.publish('g', 1)
+        for t in waiters:
+            t.join(5)
+        self.assertEqual(results, [{'version': 1}] * 3)
+
+    def test_stop_answers_waiting_polls(self):
+        results = []
+
+        def wait():
+            conn = self.connect()
+            conn.request('GET', '/poll/g?after=0')
+            results.append(json.loads(conn.getresponse().read()))
+
+        waiter = threading.Thread(target=wait)
+        waiter.start()
+        while self.events.waiting() < 1:
+            time.sleep(0.001)
+        idle = socket.create_connection(('127.0.0.1', self.server.port))
+        while len(self.server._tasks) < 2:
+            time.sleep(0.001)
+
+        start = time.time()
+        self.server.stop()
+        waiter.join(5)
+        self.thread.join(5)
+        self.assertLess(time.time() - start, 2.0)
+        self.assertEqual(results, [{'version': 0}])
+        self.assertFalse(self.thread.is_alive())
+        # Idle connections are closed
+        idle.settimeout(1)
+        self.assertEqual(idle.recv(1), b'')
+
+
+if __name__ == '__main__':
+    unittest.main()
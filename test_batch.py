@@ -0,0 +1,69 @@
+import random
+import unittest
+
+import numpy as np
+
+import batch
+import bitboard
+import geometry
+from pushfight import PIECE_ORDER, Board, Position
+
+ONBOARD = [sq for sq in range(geometry.NSQUARES) if geometry.IS_ONBOARD[sq]]
+
+
+def random_batch(n, seed=0):
+    rng = random.Random(seed)
+    squares, anchors, white = [], [], []
+    for _ in range(n):
+        placed = rng.sample(ONBOARD, len(PIECE_ORDER))
+        is_white = rng.random() < 0.5
+        opponents = [placed[i] for i in (batch.PUSHERS[not is_white])]
+        squares.append(placed)
+        anchors.append(rng.choice(opponents) if rng.random() < 0.7 else -1)
+        white.append(is_white)
+    return squares, anchors, white
+
+
+def reference_board(squares, anchor, white):
+    anchor = int(anchor) if anchor >= 0 else None
+    return Board.from_state(Position.from_squares(squares, anchor, bool(white)).state)
+
+
+class TestBatch(unittest.TestCase):
+    def test_pushes_match_board(self):
+        squares, anchors, white = random_batch(300)
+        parents, pushed, pushed_anchors, pushed_white = batch.pushes(squares, anchors, white)
+        for i in range(len(squares)):
+            board = reference_board(squares[i], anchors[i], white[i])
+            expected = list(board.gen_execute_pushes(None))
+            rows = np.nonzero(parents == i)[0]
+            got = [reference_board(pushed[r].tolist(), pushed_anchors[r], pushed_white[r]) for r in rows]
+            self.assertEqual(sorted(map(hash, got)), sorted(map(hash, expected)))
+
+    def test_pushes_keep_names(self):
+        # wp1 on 14 pushes bm1 on 15 and bm2 on 16 to the right
+        squares = [[14, 24, 22, 4, 34, 35, 25, 5, 15, 16]]
+        parents, pushed, anchors, white = batch.pushes(squares, [-1], [True])
+        row = [i for i in range(len(parents)) if anchors[i] == 15][0]
+        self.assertEqual(pushed[row].tolist(), [15, 24, 22, 4, 34, 35, 25, 5, 16, 17])
+        self.assertFalse(white[row])
+
+    def test_moves_match_board(self):
+        squares, anchors, white = random_batch(100, seed=1)
+        parents, pieces, dests = batch.moves(squares, white)
+        counts = np.bincount(parents, minlength=len(squares))
+        for i in range(len(squares)):
+            state = reference_board(squares[i], anchors[i], white[i]).state
+            self.assertEqual(counts[i], len(list(bitboard.gen_moves(state))))
+        moved = batch.apply_moves(squares, parents, pieces, dests)
+        self.assertTrue((moved[np.arange(len(parents)), pieces] == dests).all())
+
+    def test_is_over(self):
+        squares, anchors, white = random_batch(50, seed=2)
+        _, pushed, _, _ = batch.pushes(squares, anchors, white)
+        expected = [bitboard.is_over(Position.from_squares(row.tolist(), None, True).state) for row in pushed]
+        self.assertEqual(batch.is_over(pushed).tolist(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+import bitboard
+from bitboard import square
+from pushfight import Board
+from test_pushfight import EXAMPLE
+
+
+def state_of(wp=(), wm=(), bp=(), bm=(), anchor=None, is_whites_turn=True):
+    def mask(squares):
+        return sum(1 << square(r, c) for r, c in squares)
+    anchor = square(*anchor) if anchor is not None else None
+    return (mask(wp), mask(wm), mask(bp), mask(bm), anchor, is_whites_turn)
+
+
+class TestBitboard(unittest.TestCase):
+    def test_pieces_round_trip(self):
+        state = bitboard.from_pieces(EXAMPLE.pieces, None, True)
+        pieces = bitboard.to_pieces(state)
+        self.assertEqual(sorted(pieces.values()), sorted(EXAMPLE.pieces.values()))
+        self.assertEqual(bitboard.from_pieces(pieces, None, True), state)
+
+    def test_key_ignores_piece_names(self):
+        swapped = dict(EXAMPLE.pieces)
+        swapped['wp1'], swapped['wp3'] = swapped['wp3'], swapped['wp1']
+        a = bitboard.from_pieces(EXAMPLE.pieces, None, True)
+        b = bitboard.from_pieces(swapped, None, True)
+        self.assertEqual(bitboard.key(a), bitboard.key(b))
+        self.assertNotEqual(bitboard.key(a), bitboard.key(a[:5] + (False,)))
+
+    def test_push_off_edge(self):
+        state = state_of(wp=[(1, 7)], bm=[(1, 8)])
+        (pushed,) = bitboard.pushes(state)
+        self.assertTrue(bitboard.is_over(pushed))
+        self.assertEqual(pushed[bitboard.ANCHOR], square(1, 8))
+        self.assertFalse(pushed[bitboard.WHITE])
+
+    def test_rail_blocks_push(self):
+        state = state_of(wp=[(1, 4)], bm=[(0, 4)])
+        self.assertEqual(bitboard.pushes(state), [])
+
+    def test_anchor_blocks_push(self):
+        state = state_of(wp=[(2, 3)], bm=[(2, 4)], bp=[(2, 5)], anchor=(2, 5))
+        self.assertEqual(bitboard.pushes(state), [])
+        state = state_of(wp=[(2, 3)], bm=[(2, 4)], bp=[(2, 5)], anchor=None)
+        (pushed,) = bitboard.pushes(state)
+        self.assertEqual(pushed[bitboard.BP], 1 << square(2, 6))
+
+    def test_moves_stay_connected(self):
+        # A mover boxed in by its own pieces has nowhere to go
+        state = state_of(wm=[(0, 3)], wp=[(0, 4), (1, 3)])
+        moved = [frm for frm, _, _ in bitboard.gen_moves(state)]
+        self.assertNotIn(square(0, 3), moved)
+
+    def test_board_wrapper(self):
+        boards = list(EXAMPLE.gen_next_states())
+        states = list(bitboard.gen_next_states(EXAMPLE.state))
+        self.assertEqual(len(boards), len(states))
+        self.assertEqual(set(boards), set(Board.from_state(s) for s in states))
+        self.assertFalse(EXAMPLE.is_over())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import json
+import unittest
+
+import compact
+from pushfight import EXAMPLE_BOARD
+
+
+class TestCompact(unittest.TestCase):
+    def test_board_round_trip(self):
+        text = compact.encode_board(EXAMPLE_BOARD)
+        self.assertEqual(text, '>HF4RSI5?@.')
+        self.assertEqual(compact.decode_board(text), EXAMPLE_BOARD)
+        anchored = dict(EXAMPLE_BOARD, anchor=39)
+        self.assertEqual(compact.decode_board(compact.encode_board(anchored)), anchored)
+        # About a tenth the size as JSON
+        self.assertLess(len(json.dumps(text)) * 9, len(json.dumps(EXAMPLE_BOARD)))
+
+    def test_bad_boards(self):
+        for board in (dict(EXAMPLE_BOARD, wp1=40), dict(EXAMPLE_BOARD, wp1=-1),
+                      dict(EXAMPLE_BOARD, wp1='14'), dict(EXAMPLE_BOARD, extra=1),
+                      {k: v for k, v in EXAMPLE_BOARD.items() if k != 'anchor'}):
+            with self.assertRaises(ValueError):
+                compact.encode_board(board)
+        for text in ('', '>HF4RSI5?@', '>HF4RSI5?@.X', '>HF4RSI5?@/', 42):
+            with self.assertRaises(ValueError):
+                compact.decode_board(text)
+
+    def test_moves_round_trip(self):
+        moves = [{'from': 14, 'to': 15}, {'from': 0, 'to': 39}]
+        text = compact.encode_moves(moves)
+        self.assertEqual(text, '>?0W')
+        self.assertEqual(compact.decode_moves(text), moves)
+        self.assertEqual(compact.decode_moves(''), [])
+        with self.assertRaises(ValueError):
+            compact.encode_moves([{'from': 14}])
+        with self.assertRaises(ValueError):
+            compact.decode_moves('>')
+
+    def test_turns(self):
+        turn = {'moves': [{'from': 14, 'to': 15}], 'gameStage': 'whiteTurn', 'board': EXAMPLE_BOARD}
+        packed = compact.pack_turn(turn)
+        self.assertEqual(packed, {'moves': '>?', 'gameStage': 'whiteTurn', 'board': '>HF4RSI5?@.'})
+        self.assertEqual(compact.unpack_turn(packed), turn)
+        # Anything else is kept as it is
+        odd = {'moves': None, 'gameStage': 'whitesetup', 'board': {'wp1': [1, 4]}}
+        self.assertEqual(compact.pack_turn(odd), odd)
+        self.assertEqual(compact.unpack_turn(odd), odd)
+        self.assertEqual(compact.unpack_turn({'board': 'not a board'}), {'board': 'not a board'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,295 @@
+import contextlib
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import db_interface
+from db_interface import SQLite, Tiny
+from pushfight import EXAMPLE_BOARD
+
+
+class TestSQLite(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'db.sqlite3')
+        self.db = SQLite(self.path)
+
+    def tearDown(self):
+        self.db.close()
+        self.tmpdir.cleanup()
+
+    def test_users_get_sequential_ids(self):
+        first = self.db.put('users', {'email': 'a', 'password': 'x'}, key='email')
+        second = self.db.put('users', {'email': 'b', 'password': 'y'}, key='email')
+        self.assertEqual(first['_id'], 1)
+        self.assertEqual(second['_id'], 2)
+        self.assertEqual(self.db.find('users', 'b', key='email'), [second])
+        self.assertEqual(self.db.get('users', 1), [first])
+
+    def test_put_updates_in_place(self):
+        self.db.put('users', {'email': 'a', 'password': 'x'}, key='email')
+        updated = self.db.put('users', {'email': 'a', 'name': 'n'}, key='email')
+        self.assertEqual(updated, {'_id': 1, 'email': 'a', 'password': 'x', 'name': 'n'})
+        self.assertEqual(self.db.find('users', 'a', key='email'), [updated])
+        with self.assertRaises(ValueError):
+            self.db.put('users', {'_id': 5, 'email': 'a'}, key='email')
+        with self.assertRaises(ValueError):
+            self.db.put('users', {'name': 'no email'}, key='email')
+
+    def test_find_games(self):
+        game = {
+            '_id': 'g1',
+            'white_player': 'a',
+            'black_player': None,
+            'game_status': 'waitingforplayers',
+            'request': 'NoRequest',
+            'turns': [{'board': {'anchor': None}}],
+        }
+        self.db.put('games', game)
+        self.db.put('games', dict(game, _id='g2', white_player='b'))
+        header = dict(game, turn_count=1)
+        del header['turns']
+        self.assertEqual(self.db.find('games', 'g1'), [header])
+        self.assertEqual(len(self.db.find('games', None, key='black_player')), 2)
+        self.assertEqual(len(self.db.find('games', 'waitingforplayers', key='game_status')), 2)
+        self.assertEqual([g['_id'] for g in self.db.find('games', 'b', key='white_player')], ['g2'])
+        # Not an indexed column
+        self.assertEqual(len(self.db.find('games', 'NoRequest', key='request')), 2)
+
+        self.db.put('games', dict(game, game_status='whiteTurn'))
+        self.assertEqual(len(self.db.find('games', 'waitingforplayers', key='game_status')), 1)
+        self.db.delete('games', 'g1')
+        self.assertEqual(self.db.find('games', 'g1'), [])
+
+    def test_batch(self):
+        with self.db.batch():
+            self.db.put('users', {'email': 'a'}, key='email')
+            self.db.put('users', {'email': 'b'}, key='email')
+        with self.assertRaises(RuntimeError):
+            with self.db.batch():
+                self.db.put('users', {'email': 'c'}, key='email')
+                raise RuntimeError
+        self.assertEqual(self.db.find('users', 'c', key='email'), [])
+
+        self.db.close()
+        self.db = SQLite(self.path)
+        self.assertEqual(len(self.db.find('users', 'a', key='email')), 1)
+        self.assertEqual(len(self.db.find('users', 'b', key='email')), 1)
+
+    def test_turn_log(self):
+        check_turn_log(self, self.db)
+        header = self.db.find('games', 'g')[0]
+        self.assertNotIn('turns', header)
+
+    def test_find_any(self):
+        check_find_any(self, self.db)
+
+    def test_find_page(self):
+        check_find_page(self, self.db)
+
+    def test_scan(self):
+        check_scan(self, self.db)
+
+    def test_turns_are_stored_compact(self):
+        board = dict(EXAMPLE_BOARD)
+        turn = {'moves': [{'from': 14, 'to': 15}], 'gameStage': 'whiteTurn', 'board': board}
+        self.db.put('games', {'_id': 'g', 'turns': [turn]})
+        stored, = self.db._conn.execute('SELECT doc FROM turns').fetchone()
+        self.assertEqual(json.loads(stored)['board'], '>HF4RSI5?@.')
+        self.assertEqual(self.db.get_turns({'_id': 'g'}), [turn])
+        # Turns stored before boards were packed still read back
+        self.db._conn.execute('UPDATE turns SET doc = ?', (json.dumps(turn),))
+        self.assertEqual(self.db.latest_turn(self.db.find('games', 'g')[0]), turn)
+
+    def test_unknown_bucket(self):
+        with self.assertRaises(KeyError):
+            self.db.find('nope', 1)
+
+
+class TestTiny(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'db.json')
+        self.db = Tiny(self.path)
+
+    def tearDown(self):
+        self.db._DB.close()
+        self.tmpdir.cleanup()
+
+    def test_turn_log(self):
+        check_turn_log(self, self.db)
+
+    def test_find_any(self):
+        check_find_any(self, self.db)
+
+    def test_find_page(self):
+        check_find_page(self, self.db)
+
+    def test_scan(self):
+        check_scan(self, self.db)
+
+    @contextlib.contextmanager
+    def count_reads(self):
+        # Each read is a parse of the whole file
+        storage = self.db._DB.storage
+        with mock.patch.object(storage, 'read', wraps=storage.read) as read:
+            yield read
+
+    def test_find_reads_once(self):
+        for i in range(6):
+            self.db.put('games', {'_id': 'g{}'.format(i), 'white_player': 'a', 'black_player': 'b{}'.format(i % 2)})
+        with self.count_reads() as read:
+            games = self.db.find('games', 'a', key='white_player')
+        self.assertEqual(read.call_count, 1)
+        self.assertEqual([g['_id'] for g in games], ['g{}'.format(i) for i in range(6)])
+        with self.count_reads() as read:
+            games = self.db.find_any('games', 'b1', ('white_player', 'black_player'))
+        self.assertEqual(read.call_count, 1)
+        self.assertEqual([g['_id'] for g in games], ['g1', 'g3', 'g5'])
+
+    def test_find_page_reads_once(self):
+        for i in range(6):
+            self.db.put('games', {'_id': 'g{}'.format(i), 'white_player': 'a', 'black_player': 'b'})
+        with self.count_reads() as read:
+            games, after = self.db.find_page('games', 'a', ('white_player', 'black_player'), limit=4)
+        self.assertEqual(read.call_count, 1)
+        self.assertEqual([g['_id'] for g in games], ['g5', 'g4', 'g3', 'g2'])
+
+    def test_scan_reads_once_per_chunk(self):
+        for i in range(7):
+            self.db.put('games', {'_id': 'g{}'.format(i), 'white_player': 'a'})
+        seen = []
+        after = None
+        with self.count_reads() as read:
+            while True:
+                rows = self.db.scan('games', after=after, limit=3)
+                seen.extend(doc['_id'] for _, doc in rows)
+                if len(rows) < 3:
+                    break
+                after = rows[-1][0]
+        self.assertEqual(read.call_count, 3)
+        self.assertEqual(seen, ['g{}'.format(i) for i in range(7)])
+
+    def test_index_survives_reopening(self):
+        self.db.put('games', {'_id': 'g', 'white_player': 'a', 'game_status': 'whiteTurn'})
+        self.db._DB.close()
+        self.db = Tiny(self.path)
+        self.assertEqual(len(self.db.find('games', 'whiteTurn', key='game_status')), 1)
+        self.db.delete('games', 'g')
+        self.assertEqual(self.db.find('games', 'whiteTurn', key='game_status'), [])
+        self.assertEqual(self.db.find('games', 'g'), [])
+
+
+class TestDefaultPath(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def test_default_path(self):
+        with mock.patch.dict(os.environ):
+            os.environ.pop('PUSHFIGHT_DB', None)
+            self.assertEqual(db_interface.default_path(), 'db.sqlite3')
+            # An old deployment's data isn't left behind
+            open('db.json', 'w').close()
+            with self.assertLogs('pushfight.db', 'WARNING') as logs:
+                self.assertEqual(db_interface.default_path(), 'db.json')
+            self.assertIn('dbtool.py import', logs.output[0])
+            # Once imported, SQLite is used
+            open('db.sqlite3', 'w').close()
+            self.assertEqual(db_interface.default_path(), 'db.sqlite3')
+            os.environ['PUSHFIGHT_DB'] = 'other.json'
+            self.assertEqual(db_interface.default_path(), 'other.json')
+
+
+def check_find_any(test, db):
+    db.put('games', {'_id': 'g1', 'white_player': 'a', 'black_player': 'b', 'game_status': 'whiteTurn'})
+    db.put('games', {'_id': 'g2', 'white_player': 'b', 'black_player': 'a', 'game_status': 'whiteTurn'})
+    db.put('games', {'_id': 'g3', 'white_player': 'a', 'black_player': 'a', 'game_status': 'whiteTurn'})
+    db.put('games', {'_id': 'g4', 'white_player': 'c', 'black_player': None, 'game_status': 'waitingforplayers'})
+    players = ('white_player', 'black_player')
+
+    def ids(games):
+        return sorted(g['_id'] for g in games)
+
+    test.assertEqual(ids(db.find_any('games', 'a', players)), ['g1', 'g2', 'g3'])
+    test.assertEqual(ids(db.find_any('games', 'c', players)), ['g4'])
+    test.assertEqual(ids(db.find_any('games', None, players)), ['g4'])
+    test.assertEqual(db.find_any('games', 'd', players), [])
+
+    # Indexes follow updates
+    db.put('games', {'_id': 'g4', 'black_player': 'd', 'game_status': 'whiteTurn'})
+    test.assertEqual(ids(db.find_any('games', 'd', players)), ['g4'])
+    test.assertEqual(db.find('games', 'waitingforplayers', key='game_status'), [])
+    test.assertEqual(len(db.find('games', 'whiteTurn', key='game_status')), 4)
+
+
+def check_turn_log(test, db):
+    first = {'moves': [], 'gameStage': 'whitesetup', 'board': {'anchor': None}}
+    db.put('games', {'_id': 'g', 'white_player': 'a', 'black_player': 'b', 'turns': [first]})
+    game = db.find('games', 'g')[0]
+    test.assertEqual(db.turn_count(game), 1)
+    test.assertEqual(db.latest_turn(game), first)
+
+    second = dict(first, gameStage='blackSetup')
+    game = db.append_turn(game, second)
+    test.assertEqual(db.turn_count(game), 2)
+    test.assertEqual(db.latest_turn(game), second)
+    test.assertEqual(db.get_turns(db.find('games', 'g')[0]), [first, second])
+    header = db.find('games', 'g')[0]
+    test.assertEqual(db.get_turns(header, 1), [second])
+    test.assertEqual(db.get_turns(header, 0, 1), [first])
+    test.assertEqual(db.get_turns(header, 2), [])
+    # A turn appended to a header that is out of date is refused
+    stale = dict(game, turn_count=1)
+    with test.assertRaises(db_interface.Conflict):
+        db.append_turn(stale, dict(first, gameStage='whiteTurn'))
+    test.assertEqual(db.latest_turn(db.find('games', 'g')[0]), second)
+
+
+def check_scan(test, db):
+    for i in range(5):
+        db.put('games', {'_id': 'g{}'.format(i), 'white_player': 'a'})
+    db.delete('games', 'g2')
+    rows = db.scan('games', limit=2)
+    test.assertEqual([doc['_id'] for _, doc in rows], ['g0', 'g1'])
+    rows = db.scan('games', after=rows[-1][0], limit=2)
+    test.assertEqual([doc['_id'] for _, doc in rows], ['g3', 'g4'])
+    test.assertEqual(db.scan('games', after=rows[-1][0]), [])
+    test.assertEqual(db.scan('users'), [])
+    with test.assertRaises(ValueError):
+        db.scan('games', after='g1')
+
+
+def check_find_page(test, db):
+    for i in range(7):
+        white, black = ('a', 'b') if i % 2 else ('b', 'a')
+        if i == 3:
+            white, black = 'c', 'd'
+        db.put('games', {'_id': 'g{}'.format(i), 'white_player': white, 'black_player': black})
+    players = ('white_player', 'black_player')
+
+    pages = []
+    after = None
+    while True:
+        games, after = db.find_page('games', 'a', players, after=after, limit=2)
+        pages.append([g['_id'] for g in games])
+        if after is None:
+            break
+    test.assertEqual(pages, [['g6', 'g5'], ['g4', 'g2'], ['g1', 'g0']])
+
+    games, after = db.find_page('games', 'c', players, limit=1)
+    test.assertEqual(([g['_id'] for g in games], after), (['g3'], None))
+    test.assertEqual(db.find_page('games', 'e', players), ([], None))
+    with test.assertRaises(ValueError):
+        db.find_page('games', 'a', players, after=[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import compact
+import dbtool
+import history
+from db_interface import SQLite, Tiny
+from pushfight import EXAMPLE_BOARD, PIECE_ORDER
+
+
+def make_game(game_id, plies):
+    board = dict(EXAMPLE_BOARD)
+    turns = [{'moves': [], 'gameStage': 'whitesetup', 'board': board}]
+    for ply in range(1, plies):
+        frm = board['wp3']
+        moves = [{'from': frm, 'to': 32 if frm == 22 else 22}]
+        board = history.play(board, moves)
+        turns.append({'moves': moves, 'gameStage': 'blackTurn' if ply % 2 else 'whiteTurn', 'board': board})
+    return {'_id': game_id, 'white_player': 'a', 'black_player': 'b',
+            'game_status': turns[-1]['gameStage'], 'request': 'NoRequest', 'turns': turns}
+
+
+class TestDbTool(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db = SQLite(self.path('db.sqlite3'))
+        self.db.put('users', {'email': 'a', 'password': 'x'}, key='email')
+        self.db.put('users', {'email': 'b', 'password': 'y'}, key='email')
+        self.games = [make_game('g{}'.format(i), 3 + i) for i in range(7)]
+        for game in self.games:
+            self.db.put('games', game)
+
+    def tearDown(self):
+        self.db.close()
+        self.tmpdir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def check_copy(self, db):
+        self.assertEqual([d['email'] for _, d in db.scan('users')], ['a', 'b'])
+        for game in self.games:
+            header = db.find('games', game['_id'])[0]
+            self.assertEqual(db.get_turns(header), game['turns'])
+            self.assertEqual(header['white_player'], 'a')
+
+    def test_export_import(self):
+        out = self.path('dump.ndjson')
+        self.assertEqual(dbtool.export_ndjson(self.db, out, packed=True, chunk=3), 9)
+        with open(out) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([r['bucket'] for r in records], ['users'] * 2 + ['games'] * 7)
+        self.assertEqual(records[2]['turns'][0]['board'], compact.encode_board(EXAMPLE_BOARD))
+
+        copy = SQLite(self.path('copy.sqlite3'))
+        offsets = []
+        count, offset = dbtool.import_ndjson(copy, out, chunk=4, progress=lambda c, o: offsets.append(o))
+        self.assertEqual((count, offset), (9, os.path.getsize(out)))
+        self.assertEqual(len(offsets), 3)
+        self.check_copy(copy)
+        copy.close()
+
+        tiny = Tiny(self.path('copy.json'))
+        dbtool.import_ndjson(tiny, out)
+        self.check_copy(tiny)
+        tiny._DB.close()
+
+    def test_import_from_offset(self):
+        out = self.path('dump.ndjson')
+        dbtool.export_ndjson(self.db, out)
+        offsets = []
+        dbtool.import_ndjson(SQLite(self.path('copy.sqlite3')), out, chunk=5,
+                             progress=lambda c, o: offsets.append(o))
+        copy = SQLite(self.path('resumed.sqlite3'))
+        self.assertEqual(dbtool.import_ndjson(copy, out, offset=offsets[0])[0], 4)
+        self.assertEqual(len(copy.find('games', 'g6')), 1)
+        self.assertEqual(copy.find('users', 'a', key='email'), [])
+        copy.close()
+
+    def test_resume(self):
+        whole = self.path('whole.ndjson')
+        dbtool.export_ndjson(self.db, whole)
+        out = self.path('dump.ndjson')
+        dbtool.export_ndjson(self.db, out)
+        # Interrupted part way through the fifth line
+        with open(out, 'rb+') as f:
+            lines = f.readlines()
+            f.truncate(sum(map(len, lines[:4])) + 10)
+        self.assertEqual(dbtool.export_ndjson(self.db, out, resume=True), 5)
+        with open(whole) as a, open(out) as b:
+            self.assertEqual(a.read(), b.read())
+        # Nothing new
+        self.assertEqual(dbtool.export_ndjson(self.db, out, resume=True), 0)
+
+    def test_columns(self):
+        directory = self.path('columns')
+        rows = dbtool.export_columns(self.db, directory, chunk=2)
+        self.assertEqual(rows, sum(len(g['turns']) - 1 for g in self.games))
+
+        def column(name, dtype, width=1):
+            data = np.fromfile(os.path.join(directory, '{}.{}'.format(name, dtype)), dtype='<' + dtype)
+            return data.reshape(-1, width) if width > 1 else data
+        game = column('game', 'u4')
+        ply = column('ply', 'u2')
+        squares = column('squares', 'i1', len(PIECE_ORDER))
+        anchor = column('anchor', 'i1')
+        white = column('white', 'u1')
+        move = column('move', 'S6')
+        with open(os.path.join(directory, 'games.txt')) as f:
+            ids = [json.loads(line) for line in f]
+        self.assertEqual(ids, [g['_id'] for g in self.games])
+
+        for row in (0, 5, rows - 1):
+            turns = self.games[game[row]]['turns']
+            before, turn = turns[ply[row] - 1], turns[ply[row]]
+            self.assertEqual([int(sq) for sq in squares[row]], [before['board'][n] for n in PIECE_ORDER])
+            self.assertEqual(anchor[row], -1)
+            self.assertEqual(bool(white[row]), before['gameStage'].startswith('white'))
+            self.assertEqual(move[row].decode(), compact.encode_moves(turn['moves']))
+
+        # Resuming after a crash drops what wasn't recorded in columns.json
+        with open(os.path.join(directory, 'game.u4'), 'ab') as f:
+            f.write(b'\xff' * 4)
+        self.assertEqual(dbtool.export_columns(self.db, directory, resume=True), rows)
+        self.assertEqual(len(column('game', 'u4')), rows)
+        self.db.put('games', make_game('g7', 4))
+        self.assertEqual(dbtool.export_columns(self.db, directory, resume=True), rows + 3)
+        self.assertEqual(list(column('game', 'u4')[-3:]), [7, 7, 7])
+
+    def test_main(self):
+        self.db.close()
+        out = self.path('dump.ndjson')
+        dbtool.main(['export', '--db', self.path('db.sqlite3'), '--out', out, '--compact'])
+        dbtool.main(['import', '--db', self.path('copy.sqlite3'), '--in', out])
+        copy = SQLite(self.path('copy.sqlite3'))
+        self.check_copy(copy)
+        copy.close()
+        self.db = SQLite(self.path('db.sqlite3'))
+
+
+if __name__ == '__main__':
+    unittest.main()
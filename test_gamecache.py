@@ -0,0 +1,238 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from db_interface import Conflict, SQLite
+from gamecache import ROTATED, GameCache
+from test_db_interface import check_find_any, check_turn_log
+
+FIRST = {'moves': [], 'gameStage': 'whitesetup', 'board': {'anchor': None}}
+
+
+class TestGameCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.journal = os.path.join(self.tmpdir.name, 'games.journal')
+        self.backend = SQLite(os.path.join(self.tmpdir.name, 'db.sqlite3'))
+        self.cache = self.open()
+
+    def tearDown(self):
+        self.cache.close()
+        self.backend.close()
+        self.tmpdir.cleanup()
+
+    def open(self, **kwargs):
+        # Long enough that the tests decide when turns are flushed
+        return GameCache(self.backend, flush_interval=3600, journal=self.journal, **kwargs)
+
+    def start_game(self, game_id='g'):
+        self.cache.put('games', {'_id': game_id, 'white_player': 'a', 'black_player': 'b',
+                                 'game_status': 'whitesetup', 'turns': [FIRST]})
+        return self.cache.find('games', game_id)[0]
+
+    def test_turn_log(self):
+        check_turn_log(self, self.cache)
+
+    def test_find_any(self):
+        check_find_any(self, self.cache)
+
+    def test_reads_come_from_memory(self):
+        self.start_game()
+        self.backend.find = None
+        try:
+            self.assertEqual(self.cache.find('games', 'g')[0]['turn_count'], 1)
+            self.assertEqual(self.cache.latest_turn({'_id': 'g'}), FIRST)
+        finally:
+            del self.backend.find
+        self.assertEqual(self.cache.info()['hits'], 2)
+
+    def test_turns_are_written_behind(self):
+        game = self.start_game()
+        second = dict(FIRST, gameStage='blackSetup')
+        game = self.cache.append_turn(game, second, game_status='blackSetup')
+        self.assertEqual(game['turn_count'], 2)
+        self.assertEqual(self.backend.find('games', 'g')[0]['turn_count'], 1)
+        # Lookups by other keys see the turn that hasn't been flushed
+        found = self.cache.find_any('games', 'a', ('white_player', 'black_player'))
+        self.assertEqual(found[0]['turn_count'], 2)
+        self.assertEqual(self.cache.info()['dirty'], 1)
+
+        self.cache.flush()
+        header = self.backend.find('games', 'g')[0]
+        self.assertEqual((header['turn_count'], header['game_status']), (2, 'blackSetup'))
+        self.assertEqual(self.backend.get_turns(header), [FIRST, second])
+        self.assertEqual(os.path.getsize(self.journal), 0)
+
+    def test_turns_are_read_without_flushing(self):
+        game = self.start_game()
+        second = dict(FIRST, gameStage='blackSetup')
+        third = dict(FIRST, gameStage='whiteTurn')
+        game = self.cache.append_turn(game, second)
+        self.cache.flush()
+        game = self.cache.append_turn(game, third)
+        self.assertEqual(self.cache.get_turns(game), [FIRST, second, third])
+        self.assertEqual(self.cache.get_turns(game, 1, 1), [second])
+        self.assertEqual(self.cache.get_turns(game, 1), [second, third])
+        self.assertEqual(self.cache.get_turns(game, 2), [third])
+        self.assertEqual(self.backend.find('games', 'g')[0]['turn_count'], 2)
+        self.assertEqual(self.cache.info()['dirty'], 1)
+
+    def test_finished_game_is_flushed(self):
+        game = self.start_game()
+        self.cache.append_turn(game, dict(FIRST, gameStage='whiteWon'), game_status='whiteWon')
+        self.assertEqual(self.backend.find('games', 'g')[0]['game_status'], 'whiteWon')
+        self.assertEqual(self.cache.info()['size'], 0)
+
+    def test_stale_append_is_refused(self):
+        game = self.start_game()
+        self.cache.append_turn(game, dict(FIRST, gameStage='blackSetup'))
+        with self.assertRaises(Conflict):
+            self.cache.append_turn(game, dict(FIRST, gameStage='whiteTurn'))
+        with self.assertRaises(KeyError):
+            self.cache.append_turn({'_id': 'nope', 'turn_count': 0}, FIRST)
+
+    def test_journal_is_replayed(self):
+        game = self.start_game()
+        second = dict(FIRST, gameStage='blackSetup')
+        third = dict(FIRST, gameStage='whiteTurn')
+        game = self.cache.append_turn(game, second, game_status='blackSetup')
+        self.cache.append_turn(game, third, game_status='whiteTurn')
+        # The process dies before the flush, half way through a record
+        self.cache._journal.write('["g", 3, {"ga')
+        self.cache._journal.close()
+        self.cache._journal = None
+
+        self.cache = self.open()
+        header = self.backend.find('games', 'g')[0]
+        self.assertEqual((header['turn_count'], header['game_status']), (3, 'whiteTurn'))
+        self.assertEqual(self.backend.get_turns(header), [FIRST, second, third])
+        self.assertEqual(os.path.getsize(self.journal), 0)
+
+    def test_journal_is_rotated_under_traffic(self):
+        game = self.start_game('g')
+        other = self.start_game('h')
+        self.cache.append_turn(game, dict(FIRST, gameStage='blackSetup'))
+        append = self.backend.append_turn
+        moved = []
+
+        def busy(header, turn, **fields):
+            # Another game moves while the flush is writing
+            if not moved:
+                moved.append(self.cache.append_turn(other, dict(FIRST, gameStage='blackSetup')))
+            return append(header, turn, **fields)
+        with mock.patch.object(self.backend, 'append_turn', side_effect=busy):
+            self.cache.flush()
+        self.assertEqual(self.cache.info()['dirty'], 1)
+        with open(self.journal) as f:
+            self.assertEqual([json.loads(line)[:2] for line in f], [['h', 1]])
+        self.assertFalse(os.path.exists(self.journal + ROTATED))
+
+    def test_rotated_journal_is_replayed(self):
+        game = self.start_game()
+        second = dict(FIRST, gameStage='blackSetup')
+        third = dict(FIRST, gameStage='whiteTurn')
+        game = self.cache.append_turn(game, second, game_status='blackSetup')
+        # The flush fails after rotating, so the second turn is only in the
+        # rotated file and the third goes to the new one
+        with mock.patch.object(self.backend, 'append_turn', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                self.cache.flush()
+        self.cache.append_turn(game, third, game_status='whiteTurn')
+        self.assertTrue(os.path.exists(self.journal + ROTATED))
+        self.cache._journal.close()
+        self.cache._journal = None
+
+        self.cache = self.open()
+        header = self.backend.find('games', 'g')[0]
+        self.assertEqual((header['turn_count'], header['game_status']), (3, 'whiteTurn'))
+        self.assertEqual(self.backend.get_turns(header), [FIRST, second, third])
+        self.assertEqual(os.path.getsize(self.journal), 0)
+        self.assertFalse(os.path.exists(self.journal + ROTATED))
+
+    def test_only_clean_games_are_evicted(self):
+        self.cache.close()
+        self.cache = self.open(maxsize=2)
+        games = [self.start_game('g{}'.format(i)) for i in range(3)]
+        self.assertEqual(self.cache.info()['size'], 2)
+        for game in games:
+            self.cache.append_turn(game, dict(FIRST, gameStage='blackSetup'))
+        # All three have turns waiting so none can go
+        self.assertEqual(self.cache.info()['size'], 3)
+        self.cache.flush()
+        self.assertEqual(self.cache.info()['size'], 2)
+
+    def hold_find(self, game_id):
+        # Makes the backend's next find of game_id stop after reading, until
+        # release is set. Returns (reading, release).
+        reading, release = threading.Event(), threading.Event()
+        find = self.backend.find
+
+        def held(bucket, value, key=None):
+            found = find(bucket, value, key)
+            if value == game_id and not reading.is_set():
+                reading.set()
+                release.wait(5)
+            return found
+        patcher = mock.patch.object(self.backend, 'find', side_effect=held)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return reading, release
+
+    def test_miss_doesnt_block_other_games(self):
+        game = self.start_game('g')
+        self.start_game('slow')
+        self.cache.put('games', {'_id': 'slow', 'white_player': 'c'})
+        reading, release = self.hold_find('slow')
+        loader = threading.Thread(target=self.cache.find, args=('games', 'slow'))
+        loader.start()
+        self.assertTrue(reading.wait(5))
+        # While the backend is busy with slow, g is still read and moved
+        results = []
+
+        def other_game():
+            results.append(self.cache.find('games', 'g')[0]['turn_count'])
+            self.cache.append_turn(game, dict(FIRST, gameStage='blackSetup'))
+            results.append(self.cache.latest_turn(game)['gameStage'])
+        other = threading.Thread(target=other_game)
+        other.start()
+        other.join(2)
+        finished = not other.is_alive()
+        release.set()
+        loader.join()
+        other.join()
+        self.assertTrue(finished)
+        self.assertEqual(results, [1, 'blackSetup'])
+
+    def test_write_during_load_isnt_cached(self):
+        self.start_game('g')
+        self.cache.put('games', {'_id': 'g', 'white_player': 'a'})
+        reading, release = self.hold_find('g')
+        found = []
+        loader = threading.Thread(target=lambda: found.extend(self.cache.find('games', 'g')))
+        loader.start()
+        self.assertTrue(reading.wait(5))
+        # Written through while the load holds what it read before
+        self.cache.put('games', {'_id': 'g', 'white_player': 'z'})
+        release.set()
+        loader.join()
+        self.assertEqual(found[0]['white_player'], 'z')
+        self.assertEqual(self.cache.find('games', 'g')[0]['white_player'], 'z')
+
+    def test_flush_failures_are_logged(self):
+        self.cache.close()
+        self.cache = GameCache(self.backend, flush_interval=0.01, journal=self.journal)
+        game = self.start_game()
+        with mock.patch.object(self.backend, 'append_turn', side_effect=OSError('disk full')):
+            with self.assertLogs('pushfight.gamecache', 'ERROR') as logs:
+                self.cache.append_turn(game, dict(FIRST, gameStage='blackSetup'))
+                while not logs.records:
+                    threading.Event().wait(0.01)
+        self.assertEqual(str(logs.records[0].exc_info[1]), 'disk full')
+        self.assertEqual(len(logs.records), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import os
+import unittest
+
+import geometry
+from geometry import square
+
+DIRNAME = os.path.dirname(os.path.realpath(__file__))
+
+
+class TestGeometry(unittest.TestCase):
+    def test_board_shape(self):
+        # The corners and the asymmetric (0, 2)/(3, 7) squares are off
+        for row, col in [(0, 0), (3, 0), (0, 9), (3, 9), (0, 2), (3, 7)]:
+            self.assertFalse(geometry.IS_ONBOARD[square(row, col)])
+        for row, col in [(0, 7), (3, 2), (1, 1), (2, 8)]:
+            self.assertTrue(geometry.IS_ONBOARD[square(row, col)])
+        self.assertEqual(bin(geometry.ONBOARD).count('1'), 26)
+
+    def test_rails(self):
+        self.assertEqual(geometry.RAIL_ABOVE, tuple(square(0, c) for c in range(3, 8)))
+        self.assertEqual(geometry.RAIL_BELOW, tuple(square(3, c) for c in range(2, 7)))
+        self.assertEqual(geometry.PUSH_RAYS[geometry.UP][square(1, 4)], (square(0, 4),))
+
+    def test_push_chains(self):
+        ray = geometry.PUSH_RAYS[geometry.RIGHT][square(1, 6)]
+        self.assertEqual(ray, (square(1, 7), square(1, 8), square(1, 9)))
+        chains = geometry.PUSH_CHAINS[geometry.RIGHT][square(1, 6)]
+        self.assertEqual(chains[2], 1 << square(1, 6) | 1 << square(1, 7) | 1 << square(1, 8))
+
+    def test_neighbours(self):
+        self.assertEqual(geometry.NEIGHBOURS[square(0, 3)], (square(1, 3), square(0, 4)))
+
+    def test_elm_module_is_current(self):
+        path = os.path.join(DIRNAME, 'pushfight-viz', 'src', 'Pushfight', 'Geometry.elm')
+        with open(path) as f:
+            self.assertEqual(f.read(), geometry.elm_module())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import json
+import unittest
+
+import history
+from pushfight import EXAMPLE_BOARD
+
+
+def make_turns(count):
+    # A setup placement and then turns that shuffle wp3 back and forth,
+    # with a push in the middle
+    start = {'moves': [], 'gameStage': 'whitesetup', 'board': EXAMPLE_BOARD}
+    placed = {'moves': [], 'gameStage': 'blackSetup', 'board': dict(EXAMPLE_BOARD, wp3=23)}
+    turns = [start, placed]
+    board = placed['board']
+    for ply in range(2, count):
+        if ply == 10:
+            moves = [{'from': 14, 'to': 15}]
+        else:
+            frm = board['wp3']
+            moves = [{'from': frm, 'to': 33 if frm == 23 else 23}]
+        board = history.play(board, moves)
+        turns.append({'moves': moves, 'gameStage': 'whiteTurn' if ply % 2 else 'blackTurn', 'board': board})
+    return turns
+
+
+class TestHistory(unittest.TestCase):
+    def test_play(self):
+        board = history.play(EXAMPLE_BOARD, [{'from': 22, 'to': 32}, {'from': 14, 'to': 15}])
+        self.assertEqual(board, dict(EXAMPLE_BOARD, wp3=32, wp1=15, bm1=16, bm2=17, anchor=15))
+        with self.assertRaises(ValueError):
+            history.play(EXAMPLE_BOARD, [{'from': 0, 'to': 1}])
+
+    def test_round_trip(self):
+        turns = make_turns(40)
+        records = list(history.encode(turns))
+        # The start, the placement that isn't a move, and the checkpoints
+        self.assertEqual([r['ply'] for r in records if 'board' in r], [0, 1, 16, 32])
+        decoded = list(history.decode(records))
+        self.assertEqual([dict(t, ply=ply) for ply, t in enumerate(turns)], decoded)
+
+    def test_packed(self):
+        turns = make_turns(40)
+        records = list(history.encode(turns, packed=True))
+        self.assertEqual(records[2], {'ply': 2, 'gameStage': 'blackTurn', 'moves': 'GQ'})
+        self.assertEqual([t['board'] for t in history.decode(records)], [t['board'] for t in turns])
+        size = len(json.dumps(records))
+        self.assertLess(size * 3, len(json.dumps(turns)))
+
+    def test_start(self):
+        turns = make_turns(40)
+        records = list(history.encode(turns, start=20))
+        self.assertEqual([r['ply'] for r in records if 'board' in r], [20, 32])
+        self.assertEqual(next(history.decode(records))['board'], turns[20]['board'])
+        self.assertEqual(list(history.encode(turns, start=40)), [])
+        # The same records from only the turns they cover
+        self.assertEqual(list(history.encode(turns[20:], start=20, first=20)), records)
+
+    def test_turn_at(self):
+        turns = make_turns(40)
+        records = list(history.encode(turns, packed=True))
+        for ply in (0, 11, 15, 16, 39):
+            self.assertEqual(history.turn_at(records, ply)['board'], turns[ply]['board'])
+        with self.assertRaises(IndexError):
+            history.turn_at(records, 40)
+
+    def test_needs_a_board(self):
+        records = list(history.encode(make_turns(4)))
+        with self.assertRaises(ValueError):
+            list(history.decode(records[2:]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import threading
+import unittest
+
+from locks import KeyedLocks
+
+
+class TestKeyedLocks(unittest.TestCase):
+    def test_same_key_waits(self):
+        locks = KeyedLocks()
+        entered = threading.Event()
+        with locks.hold('g'):
+            def waiter():
+                with locks.hold('g'):
+                    entered.set()
+            t = threading.Thread(target=waiter)
+            t.start()
+            self.assertFalse(entered.wait(0.05))
+            self.assertEqual(len(locks), 1)
+        t.join(5)
+        self.assertTrue(entered.is_set())
+        self.assertEqual(len(locks), 0)
+
+    def test_other_keys_dont_wait(self):
+        locks = KeyedLocks()
+        entered = threading.Event()
+
+        def other():
+            with locks.hold('h'):
+                entered.set()
+        with locks.hold('g'):
+            t = threading.Thread(target=other)
+            t.start()
+            self.assertTrue(entered.wait(5))
+        t.join(5)
+
+    def test_released_on_error(self):
+        locks = KeyedLocks()
+        with self.assertRaises(RuntimeError):
+            with locks.hold('g'):
+                raise RuntimeError
+        self.assertEqual(len(locks), 0)
+        with locks.hold('g'):
+            pass
+
+    def test_counts_are_kept_under_contention(self):
+        locks = KeyedLocks()
+        counts = {'g': 0, 'h': 0}
+
+        def bump(key):
+            for _ in range(1000):
+                with locks.hold(key):
+                    value = counts[key]
+                    counts[key] = value + 1
+        threads = [threading.Thread(target=bump, args=(key,)) for key in 'gghh']
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(counts, {'g': 2000, 'h': 2000})
+        self.assertEqual(len(locks), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import io
+import time
+import unittest
+
+import bottle
+
+import metrics
+from db_interface import SQLite
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram(self):
+        registry = metrics.Registry()
+        latency = registry.histogram('latency_seconds', 'Latency', ('route',), buckets=(0.1, 1.0))
+        latency.observe(0.05, '/a')
+        latency.observe(0.5, '/a')
+        latency.observe(5.0, '/a')
+        latency.observe(1.0, '/b "quoted"')
+        self.assertEqual(latency.count('/a'), 3)
+        lines = registry.render().splitlines()
+        self.assertIn('# TYPE latency_seconds histogram', lines)
+        self.assertIn('latency_seconds_bucket{route="/a",le="0.1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{route="/a",le="1.0"} 2', lines)
+        self.assertIn('latency_seconds_bucket{route="/a",le="+Inf"} 3', lines)
+        self.assertIn('latency_seconds_sum{route="/a"} 5.55', lines)
+        self.assertIn('latency_seconds_count{route="/a"} 3', lines)
+        # Bucket bounds are inclusive, label values escaped
+        self.assertIn('latency_seconds_bucket{route="/b \\"quoted\\"",le="1.0"} 1', lines)
+
+    def test_counter_and_info(self):
+        registry = metrics.Registry()
+        requests = registry.counter('requests_total', 'Requests', ('status',))
+        requests.inc('200')
+        requests.inc('200')
+        requests.inc('404')
+        registry.collect_info('pool', lambda: {'pending': 2, 'wait': {'max': 0.5}, 'name': 'x'}, 'Pool')
+        lines = registry.render().splitlines()
+        self.assertIn('requests_total{status="200"} 2', lines)
+        self.assertIn('requests_total{status="404"} 1', lines)
+        self.assertIn('pool_pending 2', lines)
+        self.assertIn('pool_wait_max 0.5', lines)
+        self.assertFalse([line for line in lines if line.startswith('pool_name')])
+
+    def test_plugin(self):
+        app = bottle.Bottle()
+        latency = metrics.Histogram('latency', 'Latency', ('method', 'route'))
+        responses = metrics.Counter('responses', 'Responses', ('method', 'route', 'status'))
+        app.install(metrics.Plugin(latency, responses))
+
+        @app.get('/game/<name>')
+        def game(name):
+            if name == 'missing':
+                bottle.abort(404, 'No such game')
+            if name == 'broken':
+                raise RuntimeError(name)
+            if name == 'waiting':
+                bottle.request.environ['pushfight.suspended'] = True
+            return {'name': name}
+
+        for name in ('a', 'b', 'missing', 'broken', 'waiting'):
+            environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/game/' + name, 'wsgi.errors': io.StringIO()}
+            app(environ, lambda status, headers, exc_info=None: None)
+        self.assertEqual(responses.value('GET', '/game/<name>', '200'), 2)
+        self.assertEqual(responses.value('GET', '/game/<name>', '404'), 1)
+        self.assertEqual(responses.value('GET', '/game/<name>', '500'), 1)
+        self.assertEqual(latency.count('GET', '/game/<name>'), 4)
+
+    def test_timed_db(self):
+        histogram = metrics.Histogram('db', 'DB', ('op',), metrics.FAST_BUCKETS)
+        backend = SQLite(':memory:')
+        db = metrics.TimedDB(backend, histogram)
+        db.put('games', {'_id': 'g', 'white_player': 'a'})
+        self.assertEqual(db.find('games', 'g')[0]['white_player'], 'a')
+        db.find('games', 'h')
+        self.assertEqual(histogram.count('put'), 1)
+        self.assertEqual(histogram.count('find'), 2)
+        # Everything else passes straight through
+        self.assertIs(db.turn_count, backend.turn_count)
+        backend.close()
+
+    def test_time(self):
+        histogram = metrics.Histogram('t', 'T', buckets=(0.001, 1.0))
+        with histogram.time():
+            time.sleep(0.002)
+        self.assertEqual(list(histogram.render())[2], 't_bucket{le="0.001"} 0')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import threading
+import time
+import unittest
+
+from notify import GameEvents
+
+
+class TestGameEvents(unittest.TestCase):
+    def test_wait_times_out(self):
+        events = GameEvents()
+        start = time.time()
+        self.assertFalse(events.wait('g', 3, 0.05))
+        self.assertGreaterEqual(time.time() - start, 0.05)
+        self.assertEqual(events.waiting(), 0)
+
+    def test_publish_wakes_waiters_of_that_game(self):
+        events = GameEvents()
+        results = {}
+
+        def wait(game_id):
+            results[game_id] = events.wait(game_id, 3, 5)
+
+        threads = [threading.Thread(target=wait, args=(g,)) for g in ('a', 'b')]
+        for t in threads:
+            t.start()
+        while events.waiting() < 2:
+            time.sleep(0.001)
+        # Not newer than what the waiter has seen
+        events.publish('a', 3)
+        events.publish('a', 4)
+        threads[0].join(5)
+        self.assertEqual(results, {'a': True})
+        self.assertEqual(events.waiting(), 1)
+        events.publish('b', 5)
+        threads[1].join(5)
+        self.assertEqual(results, {'a': True, 'b': True})
+        self.assertEqual(events.waiting(), 0)
+
+    def test_current_version_already_newer(self):
+        events = GameEvents()
+        self.assertTrue(events.wait('g', 3, 5, current=lambda: 4))
+        self.assertFalse(events.wait('g', 3, 0.01, current=lambda: 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
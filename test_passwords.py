@@ -0,0 +1,63 @@
+import threading
+import time
+import unittest
+
+from passwords import Busy, PasswordPool
+
+
+class TestPasswordPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = PasswordPool(workers=1, max_queue=1, per_account=1, per_ip=2, rounds=4)
+        self.release = threading.Event()
+        self.threads = []
+
+    def tearDown(self):
+        self.release.set()
+        for t in self.threads:
+            t.join(5)
+        self.pool.shutdown()
+
+    def block(self, account=None, ip=None):
+        # Holds a slot in the pool until release is set
+        t = threading.Thread(target=self.pool._run, args=(self.release.wait, (5,), account, ip))
+        pending = self.pool.info()['pending']
+        t.start()
+        self.threads.append(t)
+        while self.pool.info()['pending'] == pending:
+            time.sleep(0.001)
+
+    def test_hash_and_check(self):
+        hashed = self.pool.hash('secret', account='a', ip='1.2.3.4')
+        self.assertTrue(hashed.startswith('$2b$04$'))
+        self.assertTrue(self.pool.check(b'secret', hashed.encode('utf8')))
+        self.assertFalse(self.pool.check(b'wrong', hashed.encode('utf8')))
+        info = self.pool.info()
+        self.assertEqual(info['hash_time']['count'], 3)
+        self.assertEqual(info['queue_wait']['count'], 3)
+        self.assertGreater(info['hash_time']['total'], 0)
+        self.assertEqual(info['pending'], 0)
+
+    def test_per_account_cap(self):
+        self.block(account='a')
+        with self.assertRaises(Busy):
+            self.pool.hash('x', account='a')
+        # Another account still gets in, up to the queue limit
+        self.block(account='b')
+        with self.assertRaises(Busy):
+            self.pool.hash('x', account='c')
+        self.assertEqual(self.pool.info()['rejected'], 2)
+
+    def test_per_ip_cap(self):
+        self.pool.max_pending = 10
+        self.block(ip='1.2.3.4')
+        self.block(ip='1.2.3.4')
+        with self.assertRaises(Busy):
+            self.pool.hash('x', ip='1.2.3.4')
+        self.release.set()
+        for t in self.threads:
+            t.join(5)
+        self.assertTrue(self.pool.hash('x', ip='1.2.3.4'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import io
+import unittest
+
+import bottle
+
+import profiler
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        # The sampler thread never gets to run, the handler samples itself
+        self.profiler = profiler.Profiler(interval=3600)
+        self.app = bottle.Bottle()
+        self.app.install(self.profiler.plugin())
+
+        @self.app.get('/slow')
+        def slow():
+            work(3)
+            return 'done'
+
+        def work(samples):
+            for _ in range(samples):
+                self.profiler.sample()
+
+        @self.app.get('/fast')
+        def fast():
+            return 'done'
+
+    def tearDown(self):
+        self.profiler.set_rate(0)
+
+    def get(self, path):
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'wsgi.errors': io.StringIO()}
+        return b''.join(self.app(environ, lambda status, headers, exc_info=None: None))
+
+    def test_off(self):
+        self.get('/slow')
+        self.assertEqual(self.profiler.info()['requests'], 0)
+        self.assertEqual(self.profiler.collapsed(), '')
+
+    def test_samples(self):
+        self.profiler.set_rate(1.0)
+        self.assertEqual(self.get('/slow'), b'done')
+        self.get('/fast')
+        info = self.profiler.info()
+        self.assertEqual((info['requests'], info['active']), (2, 0))
+        self.assertEqual(info['samples'], 3)
+        # Rooted at the route, with nothing of bottle's below the callback
+        self.assertEqual(self.profiler.collapsed().splitlines(),
+                         ['GET /slow;test_profiler.py:slow;test_profiler.py:work;profiler.py:sample 3'])
+        self.assertEqual(self.profiler.collapsed('GET /fast'), '')
+
+        self.profiler.reset()
+        self.assertEqual(self.profiler.info()['samples'], 0)
+        self.assertEqual(self.profiler.collapsed(), '')
+
+    def test_max_stacks(self):
+        self.profiler.max_stacks = 1
+        # Profiles this thread, its whole stack
+        ident = self.profiler._enter('a', None)
+        self.profiler._counts = {('a', 'x'): 1}
+        self.profiler.sample()
+        self.profiler._exit(ident)
+        self.assertEqual(self.profiler.collapsed().splitlines(), ['a;[other] 1', 'a;x 1'])
+
+    def test_rate(self):
+        with self.assertRaises(ValueError):
+            self.profiler.set_rate(2)
+        self.profiler.set_rate(0.5)
+        self.assertIsNotNone(self.profiler._thread)
+        self.profiler.set_rate(0)
+        self.assertIsNone(self.profiler._thread)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,30 @@
+import pickle
 import unittest
 
 from pushfight import *
 
+EXAMPLE = Board(
+    pieces={
+        'wp1': (1, 4),
+        'wp2': (2, 4),
+        'wp3': (2, 2),
+        'wm1': (0, 4),
+        'wm2': (3, 4),
+        'bp1': (3, 5),
+        'bp2': (2, 5),
+        'bp3': (0, 5),
+        'bm1': (1, 5),
+        'bm2': (1, 6)
+    },
+    anchored=None,
+    is_whites_turn=True
+)
 
 class TestPushfight(unittest.TestCase):
     def test_gen_cardinal_dirs(self):
         self.assertEqual(list(gen_cardinal_dirs()), [(-1, 0), (1, 0), (0, -1), (0, 1)])
     def test_pushes(self):
-        pushes = list(EXAMPLE_BOARD.gen_execute_pushes(EXAMPLE_BOARD.pieces))
+        pushes = list(EXAMPLE.gen_execute_pushes(EXAMPLE.pieces))
         for b in pushes:
             self.assertTrue(not b.is_whites_turn)
 
@@ -18,9 +35,60 @@ class TestPushfight(unittest.TestCase):
         self.assertEqual(len(pushes), 2)
 
     def test_board(self):
-        a = Board(EXAMPLE_BOARD.pieces.copy(), None, True)
-        b = Board(EXAMPLE_BOARD.pieces.copy(), None, True)
+        a = Board(EXAMPLE.pieces.copy(), None, True)
+        b = Board(EXAMPLE.pieces.copy(), None, True)
         self.assertEqual(a, b)
 
+    def test_position(self):
+        a = Position.from_pieces(EXAMPLE.pieces, None, True)
+        self.assertEqual(a.pieces, EXAMPLE.pieces)
+        self.assertEqual(a.anchor, None)
+        self.assertTrue(a.is_whites_turn)
+        self.assertEqual(Position.from_board(a.to_board(), True), a)
+        self.assertEqual(pickle.loads(pickle.dumps(a)), a)
+        with self.assertRaises(AttributeError):
+            a.packed = 0
+
+        swapped = EXAMPLE.pieces.copy()
+        swapped['wm1'], swapped['wm2'] = swapped['wm2'], swapped['wm1']
+        b = Position.from_pieces(swapped, None, True)
+        self.assertNotEqual(a, b)
+        self.assertEqual(a.canonical(), b.canonical())
+        self.assertEqual(a.canonical(), EXAMPLE.position)
+        self.assertEqual(a.canonical().state, EXAMPLE.state)
+        self.assertNotEqual(a, Position.from_pieces(EXAMPLE.pieces, (1, 4), True))
+        self.assertNotEqual(a, Position.from_pieces(EXAMPLE.pieces, None, False))
+
+        with self.assertRaises(ValueError):
+            Position.from_board(dict(a.to_board(), wp1=64), True)
+
+    def test_unique_next_states(self):
+        unique = list(EXAMPLE.gen_unique_next_states())
+        self.assertEqual(len(unique), len(set(unique)))
+        self.assertEqual(set(unique), set(EXAMPLE.gen_next_states()))
+
+        for moves, board in EXAMPLE.gen_unique_next_states(with_moves=True):
+            self.assertLessEqual(len(moves), 2)
+            pieces = EXAMPLE.pieces.copy()
+            for frm, to in moves:
+                mover = next(p for p, at in pieces.items() if at == frm)
+                self.assertIn(to, list(EXAMPLE.gen_neighbors(pieces, *frm)))
+                pieces[mover] = to
+            self.assertIn(board, list(EXAMPLE.gen_execute_pushes(pieces)))
+
+    def test_successor_cache(self):
+        cache = SuccessorCache(maxsize=1)
+        start = EXAMPLE.state
+        end = next(EXAMPLE.gen_next_states()).state
+        self.assertTrue(cache.is_legal(start, end))
+        self.assertFalse(cache.is_legal(start, start))
+        self.assertEqual(cache.info()['misses'], 1)
+        self.assertEqual(cache.info()['hits'], 1)
+
+        cache.successors(end)
+        self.assertEqual(cache.info()['size'], 1)
+        cache.successors(start)
+        self.assertEqual(cache.info()['misses'], 3)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+import bitboard
+import search
+from pushfight import EXAMPLE_BOARD, apply_turn
+from test_bitboard import state_of
+from test_pushfight import EXAMPLE
+
+
+class TestSearch(unittest.TestCase):
+    def test_finds_winning_push(self):
+        state = state_of(
+            wp=[(1, 3), (2, 4), (2, 5)], wm=[(0, 4), (3, 4)],
+            bp=[(1, 4), (2, 3), (3, 3)], bm=[(1, 5), (1, 8)])
+        result = search.Searcher().search(state, time_limit=5)
+        self.assertTrue(bitboard.is_over(result.state))
+        self.assertFalse(bitboard.white_lost(result.state))
+        self.assertGreaterEqual(result.score, search.WIN)
+
+        placed = state
+        for frm, to in result.moves:
+            placed = bitboard.apply_move(placed, frm, to)
+        self.assertIn(result.state, bitboard.pushes(placed))
+
+    def test_node_limit(self):
+        searcher = search.Searcher()
+        result = searcher.search(EXAMPLE.state, time_limit=None, node_limit=50)
+        self.assertLessEqual(searcher.nodes, 51)
+        self.assertEqual(result.depth, 0)
+        self.assertIn(result.state, set(bitboard.gen_unique_next_states(EXAMPLE.state)))
+
+    def test_table_is_bounded(self):
+        table = search.TranspositionTable(maxsize=2)
+        for key in range(5):
+            table.put(key, (1, 0, search.EXACT, None))
+        self.assertEqual(len(table), 2)
+        self.assertIsNone(table.get(0))
+        self.assertIsNotNone(table.get(4))
+
+    def test_apply_turn_keeps_names(self):
+        # wp1 on 14 pushes bm1 and bm2 along the row
+        board = apply_turn(EXAMPLE_BOARD, [(22, 32)], (14, 15))
+        self.assertEqual(board['wp3'], 32)
+        self.assertEqual((board['wp1'], board['bm1'], board['bm2']), (15, 16, 17))
+        self.assertEqual(board['anchor'], 15)
+
+
+if __name__ == '__main__':
+    unittest.main()
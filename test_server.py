@@ -1,8 +1,20 @@
 # import base64
+import concurrent.futures
+import json
+import threading
+import time
+from unittest import mock
+
+from cryptography.fernet import Fernet
+
+import compact
+import history
 import server
+import tokens
 import bottle as b
 from utils import b64encode
-from db_interface import db
+from db_interface import db, SQLite
+from pushfight import EXAMPLE_BOARD
 
 from boddle import boddle
 
@@ -59,6 +71,35 @@ def test_check_user():
 def test_opengames():
     pass
 
+def test_mygames_pagination(tmp_path):
+    old_db = server.db
+    server.db = SQLite(str(tmp_path / 'db.sqlite3'))
+    try:
+        for i in range(5):
+            server.db.put('games', {'_id': 'g{}'.format(i), 'white_player': 'me', 'black_player': 'you'})
+        get_my_games = server.get_my_games.__wrapped__
+        seen = []
+        params = {'limit': '2'}
+        while True:
+            with boddle(auth=('me', 'token'), query=params):
+                res = get_my_games()
+            seen.append(res['games'])
+            if res['next'] is None:
+                break
+            params = {'limit': '2', 'cursor': res['next']}
+        assert seen == [['g4', 'g3'], ['g2', 'g1'], ['g0']]
+
+        for bad in [{'limit': '0'}, {'limit': 'x'}, {'cursor': 'not a cursor'}, {'cursor': server._encode_cursor('g1')}]:
+            with boddle(auth=('me', 'token'), query=bad):
+                try:
+                    get_my_games()
+                    assert False
+                except b.HTTPError as e:
+                    assert e.status_code == 400
+    finally:
+        server.db.close()
+        server.db = old_db
+
 def test_game_challenge():
     pass
 
@@ -74,9 +115,349 @@ def test_game_status():
 def test_move():
     pass
 
+def test_status_long_poll(tmp_path):
+    old_db = server.db
+    server.db = SQLite(str(tmp_path / 'db.sqlite3'))
+    try:
+        game = server.make_game('me', 'you')
+        server.db.put('games', game)
+        game_status = server.game_status.__wrapped__
+        with boddle(auth=('me', 'token'), query={'game': game['_id']}):
+            assert game_status()['version'] == 1
+        # Nothing new, so it waits out the timeout
+        with boddle(auth=('me', 'token'), query={'game': game['_id'], 'after': '1', 'wait': '0.05'}):
+            assert game_status()['version'] == 1
+
+        def move():
+            while server.game_events.waiting() == 0:
+                time.sleep(0.001)
+            header = server.db.find('games', game['_id'])[0]
+            turn = dict(game['turns'][0], gameStage='blackSetup')
+            header = server.db.append_turn(header, turn)
+            server.game_events.publish(game['_id'], server.db.turn_count(header))
+
+        mover = threading.Thread(target=move)
+        mover.start()
+        start = time.time()
+        with boddle(auth=('me', 'token'), query={'game': game['_id'], 'after': '1', 'wait': '10'}):
+            res = game_status()
+        mover.join()
+        assert time.time() - start < 5
+        assert res['version'] == 2
+        assert res['gameStage'] == 'blackSetup'
+    finally:
+        server.db.close()
+        server.db = old_db
+
+def test_status_compact(tmp_path):
+    old_db = server.db
+    server.db = SQLite(str(tmp_path / 'db.sqlite3'))
+    try:
+        game = server.make_game('me', 'you')
+        server.db.put('games', game)
+        game_status = server.game_status.__wrapped__
+        with boddle(auth=('me', 'token'), query={'game': game['_id'], 'format': 'compact'}):
+            assert game_status()['board'] == compact.encode_board(game['turns'][0]['board'])
+        with boddle(auth=('me', 'token'), query={'game': game['_id']}):
+            assert game_status()['board'] == game['turns'][0]['board']
+        with boddle(auth=('me', 'token'), query={'game': game['_id'], 'format': 'xml'}):
+            try:
+                game_status()
+                assert False
+            except b.HTTPError as e:
+                assert e.status_code == 400
+    finally:
+        server.db.close()
+        server.db = old_db
+
+def test_game_history(tmp_path):
+    old_db = server.db
+    server.db = SQLite(str(tmp_path / 'db.sqlite3'))
+    try:
+        game = server.make_game('me', 'you')
+        server.db.put('games', game)
+        header = server.db.find('games', game['_id'])[0]
+        board = game['turns'][0]['board']
+        for stage in ('blackSetup', 'whiteTurn', 'blackTurn'):
+            moves = [{'from': board['wp3'], 'to': board['wp3'] + 10}]
+            board = history.play(board, moves)
+            header = server.db.append_turn(header, {'moves': moves, 'gameStage': stage, 'board': board})
+        game_history = server.game_history.__wrapped__
+        with boddle(auth=('me', 'token'), query={'game': game['_id'], 'format': 'compact'}):
+            lines = ''.join(game_history()).splitlines()
+        records = [json.loads(line) for line in lines]
+        assert [('board' in r) for r in records] == [True, False, False, False]
+        turns = list(history.decode(records))
+        assert [t['board'] for t in turns] == [t['board'] for t in server.db.get_turns(header)]
+        with boddle(auth=('me', 'token'), query={'game': game['_id'], 'from': '2'}):
+            records = [json.loads(line) for line in ''.join(game_history()).splitlines()]
+        assert [r['ply'] for r in records] == [2, 3]
+        assert records[0]['board'] == server.db.get_turns(header)[2]['board']
+        with boddle(auth=('me', 'token'), query={'game': game['_id'], 'from': '1', 'limit': '2'}):
+            records = [json.loads(line) for line in ''.join(game_history()).splitlines()]
+        assert [r['ply'] for r in records] == [1, 2]
+        for query in ({'from': '5'}, {'from': 'x'}, {'limit': '0'}, {'limit': 'x'}):
+            with boddle(auth=('me', 'token'), query=dict(query, game=game['_id'])):
+                try:
+                    game_history()
+                    assert False
+                except b.HTTPError as e:
+                    assert e.status_code == 400
+    finally:
+        server.db.close()
+        server.db = old_db
+
+def test_move_conflicts(tmp_path):
+    old_db = server.db
+    server.db = SQLite(str(tmp_path / 'db.sqlite3'))
+    try:
+        game = server.make_game('me', 'you')
+        server.db.put('games', game)
+        start = game['turns'][0]['board']
+        post_move = server.post_move.__wrapped__
+
+        def move(end_stage, user='me', **extra):
+            # Setup isn't checked, any change to the board will do
+            end = dict(start, anchor=(start.get('anchor') or 0) + 1)
+            body = dict({'gameId': game['_id'], 'startBoard': start, 'finalBoard': end,
+                         'moves': [], 'finalGameStage': end_stage}, **extra)
+            with boddle(auth=(user, 'token'), json=body):
+                try:
+                    post_move()
+                    return 200
+                except b.HTTPError as e:
+                    return e.status_code
+
+        # Both moves start from the same board, only one is recorded
+        results = []
+        barrier = threading.Barrier(2)
+
+        def race():
+            # bottle's request is per thread
+            b.request.bind({})
+            barrier.wait()
+            results.append(move('blackSetup'))
+        racers = [threading.Thread(target=race) for _ in range(2)]
+        for t in racers:
+            t.start()
+        for t in racers:
+            t.join()
+        assert sorted(results) == [200, 409]
+        assert server.db.find('games', game['_id'])[0]['turn_count'] == 2
+
+        start = server.db.latest_turn(server.db.find('games', game['_id'])[0])['board']
+        # Other errors from storage aren't reported as a conflict
+        with mock.patch.object(server.db, 'append_turn', side_effect=ValueError):
+            try:
+                move('whiteTurn', user='you')
+                assert False
+            except ValueError:
+                pass
+        assert move('whiteTurn', user='you', version=1) == 409
+        assert move('whiteTurn', user='you', version=2) == 200
+        assert len(server.game_locks) == 0
+    finally:
+        server.db.close()
+        server.db = old_db
+
+def test_token_cache_and_logout():
+    old_key, old_cache = server.session_key, server.token_cache
+    server.session_key = Fernet(Fernet.generate_key())
+    server.token_cache = tokens.TokenCache()
+    try:
+        def token(user, expires):
+            info = json.dumps({'user': user, 'expires': expires})
+            return str(server.session_key.encrypt(bytes(info, 'utf8')), 'utf8')
+
+        good = token('me', time.time() + 60)
+        assert server._auth_check('me', good)
+        assert not server._auth_check('you', good)
+        assert server.token_cache.hits == 1
+        assert not server._auth_check('me', token('me', time.time() - 1))
+        assert not server._auth_check('me', token('me', None))
+        assert not server._auth_check('me', 'garbage')
+
+        with boddle(auth=('me', good)):
+            assert server.logout.__wrapped__() == {}
+        assert not server._auth_check('me', good)
+    finally:
+        server.session_key, server.token_cache = old_key, old_cache
+
+def test_move_validation(tmp_path):
+    start = dict(EXAMPLE_BOARD)
+    latest = {'board': start, 'gameStage': 'whiteTurn'}
+    # wp1 on 14 pushes bm1 on 15 along the row into bm2 on 16
+    end = dict(start, wp1=15, bm1=16, bm2=17, anchor=15)
+    assert server.next_stage(latest, end) == 'blackTurn'
+    assert server.next_stage(latest, start) is None
+    assert server.next_stage(latest, {'wp1': 15}) is None
+    # wp1 steps to 12 and wp3 pushes it up off the board
+    lost = dict(start, wp1=2, wp3=12, anchor=12)
+    assert server.next_stage(latest, lost) == 'blackWon'
+    # setup placements are not checked
+    assert server.next_stage({'board': start, 'gameStage': 'whiteSetup'}, start) == 'blackSetup'
+    assert server.next_stage({'board': start, 'gameStage': 'blackWon'}, end) is None
+
+    old_db = server.db
+    server.db = SQLite(str(tmp_path / 'db.sqlite3'))
+    try:
+        game = server.make_game('me', 'you')
+        game['turns'][0]['gameStage'] = 'whiteTurn'
+        server.db.put('games', game)
+        post_move = server.post_move.__wrapped__
+
+        def move(user, **extra):
+            body = dict({'gameId': game['_id'], 'startBoard': start, 'finalBoard': end, 'moves': []}, **extra)
+            with boddle(auth=(user, 'token'), json=body):
+                try:
+                    return post_move()
+                except b.HTTPError as e:
+                    return e.status_code
+
+        assert move('you') == 403
+        # The client can't pick a stage that skips the checks or ends the game
+        assert move('me', finalGameStage='whiteWon') == 400
+        assert move('me', finalGameStage='whiteSetup') == 400
+        assert move('me')['gameStage'] == 'blackTurn'
+        header = server.db.find('games', game['_id'])[0]
+        assert header['game_status'] == 'blackTurn'
+        assert server.db.latest_turn(header)['gameStage'] == 'blackTurn'
+        assert move('me', startBoard=end) == 403
+    finally:
+        server.db.close()
+        server.db = old_db
+
+
+def test_metrics():
+    import io
+    app = b.default_app()
+
+    def get(path):
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'wsgi.errors': io.StringIO()}
+        started = []
+        body = b''.join(app(environ, lambda status, headers, exc_info=None: started.append((status, headers))))
+        return started[0], body.decode('utf8')
+
+    get('/1/opengames')
+    get('/no/such/file')
+    (status, headers), body = get('/metrics')
+    assert status == '200 OK'
+    assert dict(headers)['Content-Type'].startswith('text/plain; version=0.0.4')
+    lines = body.splitlines()
+    assert 'pushfight_requests_total{method="GET",route="/<filepath:path>",status="404"} 1' in lines
+    assert any(line.startswith('pushfight_request_seconds_count{method="GET",route="/1/opengames"}') for line in lines)
+    assert any(line.startswith('pushfight_db_seconds_count{op="find"}') for line in lines)
+    assert 'pushfight_bcrypt_max_pending {}'.format(server.password_pool.max_pending) in lines
+
+
+def test_admin_profile():
+    post_profile = server.post_profile.__wrapped__
+    get_profile = server.get_profile.__wrapped__
+    with boddle(auth=('me', 'token'), json={'rate': 1}):
+        try:
+            post_profile()
+            assert False
+        except b.HTTPError as e:
+            assert e.status_code == 403
+    server.ADMINS.add('admin')
+    try:
+        for bad in [{'rate': 2}, {'rate': 'x'}, {'interval': 0}]:
+            with boddle(auth=('admin', 'token'), json=bad):
+                try:
+                    post_profile()
+                    assert False
+                except b.HTTPError as e:
+                    assert e.status_code == 400
+        # The sampler thread stays idle, the request samples itself
+        with boddle(auth=('admin', 'token'), json={'rate': 1, 'interval': 3600, 'reset': True}):
+            assert post_profile()['rate'] == 1
+
+        def post_move():
+            server.request_profiler.sample()
+        route = b.Route(b.default_app(), '/1/move', 'POST', post_move)
+        server.request_profiler.plugin().apply(post_move, route)()
+        with boddle(auth=('admin', 'token'), query={'route': 'POST /1/move'}):
+            assert get_profile() == 'POST /1/move;test_server.py:post_move;profiler.py:sample 1\n'
+        with boddle(auth=('admin', 'token'), query={'route': 'GET /1/opengames'}):
+            assert get_profile() == ''
+        with boddle(auth=('admin', 'token'), json={'reset': True}):
+            assert post_profile()['samples'] == 0
+        with boddle(auth=('admin', 'token')):
+            assert get_profile() == ''
+    finally:
+        server.ADMINS.discard('admin')
+        server.request_profiler.set_rate(0)
+        server.request_profiler.reset()
+
+
+def test_password_cap_ignores_forwarded_for():
+    pool = server.passwords.PasswordPool(workers=1, per_ip=1, rounds=4)
+    # One check from 10.0.0.1 already in progress
+    pool._ips['10.0.0.1'] = 1
+    try:
+        for forwarded in ['1.2.3.4', '5.6.7.8, 9.9.9.9']:
+            with boddle(headers={'X-Forwarded-For': forwarded}):
+                b.request.environ['REMOTE_ADDR'] = '10.0.0.1'
+                try:
+                    server._password_work(pool.hash, 'pw')
+                    assert False
+                except b.HTTPError as e:
+                    assert e.status_code == 429
+
+        # Behind a trusted proxy the address it adds counts instead
+        server.TRUSTED_PROXIES.add('10.0.0.2')
+        with boddle(headers={'X-Forwarded-For': '10.0.0.1, 1.2.3.4'}):
+            b.request.environ['REMOTE_ADDR'] = '10.0.0.2'
+            assert server._client_ip() == '1.2.3.4'
+            assert server._password_work(pool.hash, 'pw')
+        with boddle(headers={'X-Forwarded-For': '1.2.3.4, 10.0.0.1'}):
+            b.request.environ['REMOTE_ADDR'] = '10.0.0.2'
+            try:
+                server._password_work(pool.hash, 'pw')
+                assert False
+            except b.HTTPError as e:
+                assert e.status_code == 429
+    finally:
+        server.TRUSTED_PROXIES.discard('10.0.0.2')
+        pool.shutdown()
+
+
+def test_analyse_cancelled_is_unavailable():
+    class Job(object):
+        def __init__(self, outcome):
+            self.outcome = outcome
+
+        def result(self, timeout=None):
+            if isinstance(self.outcome, Exception):
+                raise self.outcome
+            return self.outcome
+
+        def cancel(self):
+            pass
+
+    class Pool(object):
+        def submit(self, state, time_limit):
+            return Job(outcome)
+
+    old_pool = server.analysis_pool
+    server.analysis_pool = Pool()
+    try:
+        for outcome in [server.analysis.Cancelled(), concurrent.futures.TimeoutError()]:
+            try:
+                server.analyse(None, 1.0)
+                assert False
+            except b.HTTPError as e:
+                assert e.status_code == 503
+                assert e.headers['Retry-After'] == '1'
+        # A position with no moves is still the client's problem
+        outcome = None
+        assert server.analyse(None, 1.0) is None
+    finally:
+        server.analysis_pool = old_pool
+
 
 if __name__ == '__main__':
     server.load_session_key()
     test_register()
     test_login()
-    test_check_user()
\ No newline at end of file
+    test_check_user()
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+
+import bitboard
+import search
+import tablebase
+from test_bitboard import state_of
+from test_pushfight import EXAMPLE
+
+WINNING = state_of(
+    wp=[(1, 3), (2, 4), (2, 5)], wm=[(0, 4), (3, 4)],
+    bp=[(1, 4), (2, 3), (3, 3)], bm=[(1, 5), (1, 8)])
+
+
+class TestTablebase(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_write_and_probe(self):
+        states = list(bitboard.gen_unique_next_states(EXAMPLE.state))[:100]
+        outcomes = {bitboard.key(state): i % 7 - 3 for i, state in enumerate(states)}
+        tablebase.write(self.path, outcomes)
+        table = tablebase.Tablebase(self.path)
+        self.assertEqual(len(table), len(outcomes))
+        for state in states:
+            self.assertEqual(table.probe(state), outcomes[bitboard.key(state)])
+        self.assertIsNone(table.probe(EXAMPLE.state))
+        table.close()
+
+    def test_solve(self):
+        self.assertEqual(tablebase.solve(WINNING, 1), 1)
+        self.assertIsNone(tablebase.solve(EXAMPLE.state, 1))
+        self.assertIsNone(tablebase.solve(WINNING, 0))
+
+    def test_search_probes_tablebase(self):
+        outcomes = tablebase.build([WINNING], plies=1, spread=0)
+        self.assertEqual(outcomes, {bitboard.key(WINNING): 1})
+        tablebase.write(self.path, outcomes)
+        table = tablebase.Tablebase(self.path)
+        searcher = search.Searcher(tablebase=table)
+        self.assertEqual(searcher._negamax(WINNING, 3, -search.WIN * 2, search.WIN * 2), search.WIN + 2)
+        self.assertEqual(searcher.nodes, 1)
+        table.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
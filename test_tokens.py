@@ -0,0 +1,41 @@
+import unittest
+
+from tokens import REVOKED, TokenCache
+
+
+class TestTokenCache(unittest.TestCase):
+    def test_expires_with_token(self):
+        cache = TokenCache()
+        self.assertIsNone(cache.get('t', now=0))
+        cache.put('t', 'alice', expires=100)
+        self.assertEqual(cache.get('t', now=99), 'alice')
+        self.assertIsNone(cache.get('t', now=100))
+        self.assertEqual(cache.info()['size'], 0)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_lru_bound(self):
+        cache = TokenCache(maxsize=2)
+        cache.put('a', 'a', 100)
+        cache.put('b', 'b', 100)
+        cache.get('a', now=0)
+        cache.put('c', 'c', 100)
+        self.assertEqual(cache.get('a', now=0), 'a')
+        self.assertIsNone(cache.get('b', now=0))
+        self.assertEqual(cache.get('c', now=0), 'c')
+
+    def test_revoke(self):
+        cache = TokenCache()
+        cache.put('t', 'alice', expires=2 ** 40)
+        cache.revoke('t', expires=2 ** 40)
+        self.assertIs(cache.get('t'), REVOKED)
+        # Verifying it again doesn't bring it back
+        cache.put('t', 'alice', expires=2 ** 40)
+        self.assertIs(cache.get('t'), REVOKED)
+        # Revocations are dropped once the token would have expired anyway
+        cache.revoke('old', expires=0)
+        cache.revoke('other', expires=2 ** 40)
+        self.assertEqual(cache.info()['revoked'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
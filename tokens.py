@@ -0,0 +1,81 @@
+"""A cache of session tokens that have already been verified.
+
+Checking a token means a Fernet decrypt, an HMAC and a JSON parse, and
+every authenticated request does it. Verified tokens are remembered here,
+keyed by a digest so the tokens themselves aren't kept, until the expiry
+written into them. Revoked tokens are remembered until then too, so a
+logged out token can't be verified again after it drops out of the cache.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+REVOKED = object()
+
+
+def _digest(token):
+    return hashlib.sha256(token.encode('utf8')).digest()
+
+
+class TokenCache(object):
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # digest -> (user, expires), least recently used first
+        self._cache = OrderedDict()
+        # digest -> expires
+        self._revoked = {}
+
+    def get(self, token, now=None):
+        # The user a token was verified for, REVOKED, or None if it has to
+        # be verified
+        now = time.time() if now is None else now
+        digest = _digest(token)
+        with self._lock:
+            expires = self._revoked.get(digest)
+            if expires is not None:
+                if expires > now:
+                    return REVOKED
+                del self._revoked[digest]
+            entry = self._cache.get(digest)
+            if entry is not None:
+                if entry[1] > now:
+                    self._cache.move_to_end(digest)
+                    self.hits += 1
+                    return entry[0]
+                del self._cache[digest]
+            self.misses += 1
+            return None
+
+    def put(self, token, user, expires):
+        digest = _digest(token)
+        with self._lock:
+            if digest in self._revoked:
+                return
+            self._cache[digest] = (user, expires)
+            self._cache.move_to_end(digest)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def revoke(self, token, expires):
+        now = time.time()
+        digest = _digest(token)
+        with self._lock:
+            self._cache.pop(digest, None)
+            # Drop revocations that have expired on their own
+            for old in [d for d, e in self._revoked.items() if e <= now]:
+                del self._revoked[old]
+            self._revoked[digest] = expires
+
+    def info(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._cache),
+                "maxsize": self.maxsize,
+                "revoked": len(self._revoked),
+            }
@@ -1,9 +1,12 @@
 import base64
 import bcrypt
 
+# bcrypt's cost factor, each step doubles the time a hash takes
+BCRYPT_ROUNDS = 12
+
 # We use bcrypt to do the actual hashing and comparisons
-def hash_pw(plaintext):
-    return bcrypt.hashpw(plaintext.encode(), bcrypt.gensalt()).decode('utf8')
+def hash_pw(plaintext, rounds=BCRYPT_ROUNDS):
+    return bcrypt.hashpw(plaintext.encode(), bcrypt.gensalt(rounds)).decode('utf8')
 
 def check_pw(pw, hashed):
     return bcrypt.checkpw(pw, hashed)